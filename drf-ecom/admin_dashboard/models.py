@@ -2,6 +2,7 @@ from django.db import models
 from django.contrib.auth.models import User
 from decimal import Decimal
 from shop.models import Customer, Order
+from shop.sequences import Sequence, last_number
 
 # ============ RESSOURCES HUMAINES ============
 
@@ -124,6 +125,9 @@ class AccountingEntry(models.Model):
 
     class Meta:
         unique_together = ['journal', 'entry_number']
+        indexes = [
+            models.Index(fields=['entry_date', 'id'], name='entry_keyset_idx'),
+        ]
 
     def __str__(self):
         return f"{self.journal.code}-{self.entry_number} - {self.description}"
@@ -225,6 +229,11 @@ class Invoice(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='invoice_keyset_idx'),
+        ]
+
     def __str__(self):
         return f"Facture {self.invoice_number}"
 
@@ -262,4 +271,14 @@ class Payment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"Paiement {self.amount}€ - {self.invoice.invoice_number}"
\ No newline at end of file
+        return f"Paiement {self.amount}€ - {self.invoice.invoice_number}"
+
+# Numérotations continues (obligation comptable) : aucun bloc, aucun trou
+INVOICE_NUMBERS = Sequence(
+    'invoice', prefix='FAC', width=4, block_size=1,
+    seed=lambda scope, prefix: last_number(Invoice.objects.all(), 'invoice_number', prefix)
+)
+ENTRY_NUMBERS = Sequence(
+    'accounting_entry', period_format='%Y-', width=6, block_size=1,
+    seed=lambda scope, prefix: last_number(AccountingEntry.objects.filter(journal_id=scope), 'entry_number', prefix)
+)
@@ -0,0 +1,8 @@
+from django.dispatch import receiver
+from shop.payments import orders_paid
+from .utils import create_invoices_for_orders
+
+@receiver(orders_paid)
+def invoice_paid_orders(sender, order_ids, **kwargs):
+    """Facturer les commandes payées, dans la transaction qui les confirme"""
+    create_invoices_for_orders(order_ids)
@@ -4,6 +4,8 @@ from django.template.loader import get_template
 from django.core.mail import EmailMessage
 from django.conf import settings
 from datetime import datetime
+from decimal import Decimal
+from django.utils import timezone
 import logging
 
 logger = logging.getLogger(__name__)
@@ -76,4 +78,62 @@ def get_invoices_by_period(year=None, quarter=None):
         if quarter in quarter_months:
             queryset = queryset.filter(invoice_date__month__in=quarter_months[quarter])
     
-    return queryset.order_by('-invoice_date')
\ No newline at end of file
+    return queryset.order_by('-invoice_date')
+
+def create_invoices_for_orders(order_ids):
+    """Factures de vente des commandes payées, en quelques requêtes quel que soit leur nombre.
+
+    Les commandes déjà facturées sont ignorées. Numéros pris d'un seul
+    incrément du compteur (numérotation continue), factures et lignes
+    insérées par bulk_create : les totaux des lignes sont calculés ici,
+    InvoiceLine.save() n'étant pas appelé.
+    """
+    from shop.models import Order, OrderItem
+    from .models import Invoice, InvoiceLine, INVOICE_NUMBERS
+
+    orders = list(
+        Order.objects.filter(pk__in=order_ids).exclude(invoice__isnull=False).order_by('pk')
+    )
+    if not orders:
+        return []
+
+    today = timezone.localdate()
+    invoices = Invoice.objects.bulk_create([
+        Invoice(
+            invoice_number=number,
+            invoice_type='sale',
+            customer_id=order.customer_id,
+            invoice_date=today,
+            due_date=today,
+            status='paid',
+            subtotal_excl_vat=order.total_amount,
+            vat_amount=order.vat_amount,
+            total_incl_vat=order.total_amount + order.vat_amount,
+            billing_address=order.billing_address,
+            order=order,
+            notes=f"Commande {order.order_number}",
+        )
+        for order, number in zip(orders, INVOICE_NUMBERS.next_many(len(orders)))
+    ])
+    if invoices[0].pk is None:
+        # Sans RETURNING, les clés sont relues par numéro
+        invoices = list(Invoice.objects.filter(invoice_number__in=[invoice.invoice_number for invoice in invoices]))
+    invoice_by_order = {invoice.order_id: invoice for invoice in invoices}
+
+    lines = []
+    for item in OrderItem.objects.filter(order__in=orders).select_related('product').order_by('pk'):
+        total_excl_vat = item.unit_price * item.quantity
+        vat_amount = (total_excl_vat * item.vat_rate / 100).quantize(Decimal('0.01'))
+        lines.append(InvoiceLine(
+            invoice=invoice_by_order[item.order_id],
+            description=item.product.name[:200],
+            quantity=item.quantity,
+            unit_price_excl_vat=item.unit_price,
+            vat_rate=item.vat_rate,
+            total_excl_vat=total_excl_vat,
+            vat_amount=vat_amount,
+            total_incl_vat=total_excl_vat + vat_amount,
+        ))
+    InvoiceLine.objects.bulk_create(lines)
+    logger.info(f"Invoices created for {len(invoices)} paid orders")
+    return invoices
@@ -3,8 +3,11 @@ Configuration et utilitaires de cache avancés
 """
 import hashlib
 import json
+import time
 from django.core.cache import cache
+from django.db import transaction
 from django.conf import settings
+from django.utils.module_loading import import_string
 from functools import wraps
 from typing import Any, Optional, Union
 import logging
@@ -24,6 +27,7 @@ class CacheManager:
         'accounting': 1800,  # 30 minutes
         'vat_rates': 86400,  # 24 heures
         'user_session': 3600,  # 1 heure
+        'counts': 300,  # 5 minutes
     }
     
     @staticmethod
@@ -76,6 +80,75 @@ class CacheManager:
             logger.error(f"Cache delete error for {key}: {e}")
             return False
 
+    # Versions mémorisées par processus pendant VERSION_TTL secondes
+    VERSION_TTL = 1.0
+    _versions = {}
+    _version_store = None
+
+    @classmethod
+    def version_store(cls):
+        """Stockage des versions : classe désignée par CACHE_VERSION_STORE, sinon le cache Django"""
+        if cls._version_store is None:
+            path = getattr(settings, 'CACHE_VERSION_STORE', None)
+            cls._version_store = import_string(path)() if path else CacheVersionStore()
+        return cls._version_store
+
+    @classmethod
+    def get_version(cls, namespace: str) -> int:
+        """Version courante d'un espace de clés (à inclure dans les clés dérivées).
+
+        Un changement fait par un autre processus est vu au plus VERSION_TTL
+        secondes plus tard.
+        """
+        value, expires = cls._versions.get(namespace, (None, 0))
+        if value is not None and time.monotonic() < expires:
+            return value
+        version = cls.version_store().get(namespace)
+        cls._versions[namespace] = (version, time.monotonic() + cls.VERSION_TTL)
+        return version
+
+    @classmethod
+    def bump_version(cls, namespace: str):
+        """Invalider d'un coup toutes les clés construites sur cette version.
+
+        L'incrément a lieu au commit de la transaction en cours : il ne
+        rallonge pas la transaction de l'appelant, et une transaction
+        annulée n'invalide rien.
+        """
+        def bump():
+            version = cls.version_store().bump(namespace)
+            cls._versions.pop(namespace, None)
+            logger.debug(f"Cache version bumped: {namespace} -> {version}")
+        transaction.on_commit(bump)
+
+class CacheVersionStore:
+    """Versions dans le cache Django : cache.add à la création, cache.incr ensuite.
+
+    Partagées entre processus si le cache l'est (Redis, Memcached) ; avec
+    LocMem, désigner un autre stockage dans CACHE_VERSION_STORE.
+    """
+
+    KEY_PREFIX = 'cache_version'
+
+    def key(self, namespace: str) -> str:
+        return f"{self.KEY_PREFIX}:{namespace}"
+
+    def get(self, namespace: str) -> int:
+        version = cache.get(self.key(namespace))
+        if version is None:
+            # Initialisée à l'horloge : jamais égale à une version déjà servie
+            cache.add(self.key(namespace), int(time.time() * 1000), None)
+            version = cache.get(self.key(namespace))
+        return version
+
+    def bump(self, namespace: str) -> int:
+        try:
+            return cache.incr(self.key(namespace))
+        except ValueError:
+            # Clé absente (évincée) : recréée à l'horloge puis incrémentée
+            self.get(namespace)
+            return cache.incr(self.key(namespace))
+
 def cache_result(timeout: int = 3600, category: str = 'default', key_prefix: str = None):
     """Décorateur pour mettre en cache le résultat d'une fonction"""
     def decorator(func):
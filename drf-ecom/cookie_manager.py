@@ -2,11 +2,13 @@
 Gestionnaire de cookies avancé avec sécurité et performance
 """
 import json
+import base64
 import hashlib
 from datetime import datetime, timedelta
+from django.core import signing
 from django.http import HttpResponse
 from django.conf import settings
-from typing import Any, Optional, Dict
+from typing import Any, Optional, Dict, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
@@ -81,6 +83,71 @@ class SecureCookieManager:
             logger.error(f"Cookie delete error for {key}: {e}")
             return response
 
+class CompactCookieCodec:
+    """Valeurs courtes empaquetées en binaire, base64 url-safe, signées.
+
+    Entiers en varint (7 bits par octet), chaînes préfixées par leur
+    longueur. La signature (django.core.signing, salée par cookie) rend
+    illisible toute valeur modifiée ou tronquée : elle est alors ignorée.
+    """
+
+    VERSION = 1
+
+    @staticmethod
+    def pack_varint(value: int) -> bytes:
+        if value < 0:
+            raise ValueError(f"Varint négatif: {value}")
+        packed = bytearray()
+        while True:
+            byte = value & 0x7F
+            value >>= 7
+            if value:
+                packed.append(byte | 0x80)
+            else:
+                packed.append(byte)
+                return bytes(packed)
+
+    @staticmethod
+    def unpack_varint(data: bytes, offset: int) -> Tuple[int, int]:
+        """(valeur, position suivante) ; IndexError si le varint est incomplet"""
+        value = shift = 0
+        while True:
+            byte = data[offset]
+            offset += 1
+            value |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                return value, offset
+            shift += 7
+
+    @classmethod
+    def pack_text(cls, value: str) -> bytes:
+        encoded = str(value).encode('utf-8')
+        return cls.pack_varint(len(encoded)) + encoded
+
+    @classmethod
+    def unpack_text(cls, data: bytes, offset: int) -> Tuple[str, int]:
+        length, offset = cls.unpack_varint(data, offset)
+        if offset + length > len(data):
+            raise IndexError('Chaîne tronquée')
+        return data[offset:offset + length].decode('utf-8'), offset + length
+
+    @classmethod
+    def sign(cls, payload: bytes, salt: str) -> str:
+        value = base64.urlsafe_b64encode(bytes([cls.VERSION]) + payload).rstrip(b'=').decode('ascii')
+        return signing.Signer(salt=salt).sign(value)
+
+    @classmethod
+    def unsign(cls, value: str, salt: str) -> Optional[bytes]:
+        """Contenu d'une valeur signée, None si la signature ou la version ne correspond pas"""
+        try:
+            value = signing.Signer(salt=salt).unsign(value)
+            data = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+        except (signing.BadSignature, ValueError):
+            return None
+        if not data or data[0] != cls.VERSION:
+            return None
+        return data[1:]
+
 class UserPreferenceCookies:
     """Gestion des préférences utilisateur via cookies"""
     
@@ -93,35 +160,124 @@ class UserPreferenceCookies:
         'dashboard_layout': 'user_dashboard_layout'
     }
     
-    @staticmethod
-    def set_preference(response: HttpResponse, preference: str, value: Any) -> HttpResponse:
-        """Définir une préférence utilisateur"""
-        cookie_key = UserPreferenceCookies.PREFERENCE_KEYS.get(preference)
-        if not cookie_key:
+    # Toutes les préférences dans un seul cookie compact ; les anciens cookies restent lus
+    COOKIE_KEY = 'prefs'
+    MAX_AGE = 86400 * 30  # 30 jours
+    # Préférences entières et leurs bornes (max_page_size de la pagination)
+    INTEGER_PREFERENCES = {'items_per_page': (1, 100)}
+
+    @classmethod
+    def clean_integer(cls, preference: str, value: Any) -> Optional[int]:
+        """Valeur ramenée dans ses bornes, None si elle n'est pas entière"""
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            logger.warning(f"Invalid preference {preference}: {value!r}")
+            return None
+        low, high = cls.INTEGER_PREFERENCES[preference]
+        return max(low, min(value, high))
+
+    @classmethod
+    def encode(cls, preferences: Dict[str, Any]) -> str:
+        """Masque des préférences présentes puis leurs valeurs, dans l'ordre de PREFERENCE_KEYS.
+
+        Une préférence entière invalide est ignorée, hors bornes elle est ramenée dans ses bornes.
+        """
+        mask = 0
+        payload = b''
+        for bit, preference in enumerate(cls.PREFERENCE_KEYS):
+            value = preferences.get(preference)
+            if value in (None, ''):
+                continue
+            if preference in cls.INTEGER_PREFERENCES:
+                value = cls.clean_integer(preference, value)
+                if value is None:
+                    continue
+                payload += CompactCookieCodec.pack_varint(value)
+            else:
+                payload += CompactCookieCodec.pack_text(value)
+            mask |= 1 << bit
+        return CompactCookieCodec.sign(CompactCookieCodec.pack_varint(mask) + payload, cls.COOKIE_KEY)
+
+    @classmethod
+    def decode(cls, value: str) -> Optional[Dict[str, Any]]:
+        data = CompactCookieCodec.unsign(value, cls.COOKIE_KEY)
+        if data is None:
+            return None
+        try:
+            mask, offset = CompactCookieCodec.unpack_varint(data, 0)
+            preferences = {}
+            for bit, preference in enumerate(cls.PREFERENCE_KEYS):
+                if not mask & (1 << bit):
+                    continue
+                if preference in cls.INTEGER_PREFERENCES:
+                    preferences[preference], offset = CompactCookieCodec.unpack_varint(data, offset)
+                else:
+                    preferences[preference], offset = CompactCookieCodec.unpack_text(data, offset)
+        except (IndexError, UnicodeDecodeError):
+            logger.warning("Invalid preferences cookie")
+            return None
+        return preferences
+
+    @classmethod
+    def set_preferences(cls, request, response: HttpResponse, preferences: Dict[str, Any]) -> HttpResponse:
+        """Écrire les préférences (fusionnées avec celles du cookie) et retirer les anciens cookies"""
+        unknown = set(preferences) - set(cls.PREFERENCE_KEYS)
+        if unknown:
+            logger.warning(f"Unknown preferences: {sorted(unknown)}")
+        stored = {key: value for key, value in cls.get_all_preferences(request).items() if value is not None}
+        stored.update({key: value for key, value in preferences.items() if key in cls.PREFERENCE_KEYS})
+
+        SecureCookieManager.set_cookie(
+            response, cls.COOKIE_KEY, cls.encode(stored),
+            max_age=cls.MAX_AGE,
+            httponly=False  # Accessible en JavaScript pour l'UI
+        )
+        for cookie_key in cls.PREFERENCE_KEYS.values():
+            if cookie_key in request.COOKIES:
+                SecureCookieManager.delete_cookie(response, cookie_key)
+        return response
+
+    @classmethod
+    def set_preference(cls, response: HttpResponse, preference: str, value: Any, request=None) -> HttpResponse:
+        """Définir une préférence utilisateur.
+
+        Avec request, elle rejoint le cookie compact ; sans, elle est écrite
+        dans son ancien cookie, lu en priorité jusqu'à la prochaine fusion.
+        """
+        if preference not in cls.PREFERENCE_KEYS:
             logger.warning(f"Unknown preference: {preference}")
             return response
-        
+        if request is not None:
+            return cls.set_preferences(request, response, {preference: value})
+        if preference in cls.INTEGER_PREFERENCES:
+            value = cls.clean_integer(preference, value)
+            if value is None:
+                return response
         return SecureCookieManager.set_cookie(
-            response, cookie_key, value, 
-            max_age=86400 * 30,  # 30 jours
+            response, cls.PREFERENCE_KEYS[preference], value,
+            max_age=cls.MAX_AGE,
             httponly=False  # Accessible en JavaScript pour l'UI
         )
-    
-    @staticmethod
-    def get_preference(request, preference: str, default: Any = None) -> Any:
+
+    @classmethod
+    def get_preference(cls, request, preference: str, default: Any = None) -> Any:
         """Récupérer une préférence utilisateur"""
-        cookie_key = UserPreferenceCookies.PREFERENCE_KEYS.get(preference)
-        if not cookie_key:
-            return default
-        
-        return SecureCookieManager.get_cookie(request, cookie_key, default)
-    
-    @staticmethod
-    def get_all_preferences(request) -> Dict[str, Any]:
+        value = cls.get_all_preferences(request).get(preference)
+        return default if value is None else value
+
+    @classmethod
+    def get_all_preferences(cls, request) -> Dict[str, Any]:
         """Récupérer toutes les préférences utilisateur"""
-        preferences = {}
-        for pref, cookie_key in UserPreferenceCookies.PREFERENCE_KEYS.items():
-            preferences[pref] = SecureCookieManager.get_cookie(request, cookie_key)
+        value = request.COOKIES.get(cls.COOKIE_KEY)
+        compact = (cls.decode(value) if value else None) or {}
+        preferences = {pref: compact.get(pref) for pref in cls.PREFERENCE_KEYS}
+        # Anciens cookies, un par préférence : retirés à chaque écriture du cookie compact,
+        # un ancien cookie encore présent est donc plus récent que lui
+        for pref, cookie_key in cls.PREFERENCE_KEYS.items():
+            legacy = SecureCookieManager.get_cookie(request, cookie_key)
+            if legacy is not None:
+                preferences[pref] = legacy
         return preferences
 
 class SessionCookies:
@@ -154,54 +310,98 @@ class SessionCookies:
         return SecureCookieManager.delete_cookie(response, session_key)
 
 class CartCookies:
-    """Gestion du panier via cookies pour utilisateurs non connectés"""
+    """Gestion du panier via cookies pour utilisateurs non connectés.
+
+    Le cookie ne contient que (produit, quantité), identifiants triés et
+    codés en écart au précédent : les prix et le total sont toujours lus en
+    base. Les anciens cookies JSON restent lus.
+    """
     
     CART_COOKIE_KEY = 'guest_cart'
     CART_MAX_AGE = 86400 * 7  # 7 jours
+    # Reste sous la limite de 4 Ko par cookie
+    MAX_ITEMS = 100
+
+    @staticmethod
+    def encode(items: Dict[int, int]) -> str:
+        payload = b''
+        previous = 0
+        for product_id in sorted(items):
+            payload += CompactCookieCodec.pack_varint(product_id - previous)
+            payload += CompactCookieCodec.pack_varint(items[product_id])
+            previous = product_id
+        return CompactCookieCodec.sign(payload, CartCookies.CART_COOKIE_KEY)
+
+    @staticmethod
+    def decode(value: str) -> Optional[Dict[int, int]]:
+        data = CompactCookieCodec.unsign(value, CartCookies.CART_COOKIE_KEY)
+        if data is None:
+            return None
+        items = {}
+        offset = product_id = 0
+        try:
+            while offset < len(data):
+                delta, offset = CompactCookieCodec.unpack_varint(data, offset)
+                quantity, offset = CompactCookieCodec.unpack_varint(data, offset)
+                product_id += delta
+                if quantity > 0:
+                    items[product_id] = quantity
+        except IndexError:
+            logger.warning("Truncated guest cart cookie")
+            return None
+        return items
+
+    @staticmethod
+    def _legacy_items(value: str) -> Dict[int, int]:
+        """Ancien format JSON non signé : seuls produits et quantités sont repris"""
+        try:
+            cart = json.loads(value)
+            return {
+                int(item['product_id']): int(item['quantity'])
+                for item in cart.get('items', [])
+                if int(item['quantity']) > 0
+            }
+        except (ValueError, TypeError, KeyError, AttributeError):
+            return {}
+
+    @staticmethod
+    def get_items(request) -> Dict[int, int]:
+        """Quantités par produit du panier invité"""
+        value = request.COOKIES.get(CartCookies.CART_COOKIE_KEY)
+        if not value:
+            return {}
+        items = CartCookies.decode(value)
+        return CartCookies._legacy_items(value) if items is None else items
     
     @staticmethod
-    def set_cart(response: HttpResponse, cart_data: Dict) -> HttpResponse:
+    def set_cart(response: HttpResponse, items: Dict[int, int]) -> HttpResponse:
         """Définir le panier dans un cookie"""
+        if len(items) > CartCookies.MAX_ITEMS:
+            raise ValueError(f"Panier invité limité à {CartCookies.MAX_ITEMS} produits")
         return SecureCookieManager.set_cookie(
-            response, CartCookies.CART_COOKIE_KEY, cart_data,
-            max_age=CartCookies.CART_MAX_AGE,
-            httponly=False  # Accessible en JavaScript
+            response, CartCookies.CART_COOKIE_KEY, CartCookies.encode(items),
+            max_age=CartCookies.CART_MAX_AGE
         )
     
     @staticmethod
     def get_cart(request) -> Dict:
         """Récupérer le panier depuis un cookie"""
-        return SecureCookieManager.get_cookie(
-            request, CartCookies.CART_COOKIE_KEY,
-            default={'items': [], 'total': 0},
-            parse_json=True
-        )
+        return {
+            'items': [
+                {'product_id': product_id, 'quantity': quantity}
+                for product_id, quantity in CartCookies.get_items(request).items()
+            ]
+        }
     
     @staticmethod
     def add_item_to_cart(request, response: HttpResponse, 
-                        product_id: int, quantity: int, price: float) -> HttpResponse:
+                        product_id: int, quantity: int) -> HttpResponse:
         """Ajouter un article au panier cookie"""
-        cart = CartCookies.get_cart(request)
-        
-        # Chercher si l'article existe déjà
-        for item in cart['items']:
-            if item['product_id'] == product_id:
-                item['quantity'] += quantity
-                break
-        else:
-            # Nouvel article
-            cart['items'].append({
-                'product_id': product_id,
-                'quantity': quantity,
-                'price': price
-            })
-        
-        # Recalculer le total
-        cart['total'] = sum(item['quantity'] * item['price'] for item in cart['items'])
-        
-        return CartCookies.set_cart(response, cart)
+        items = CartCookies.get_items(request)
+        items[product_id] = items.get(product_id, 0) + quantity
+        return CartCookies.set_cart(response, items)
     
     @staticmethod
     def clear_cart(response: HttpResponse) -> HttpResponse:
         """Vider le panier cookie"""
-        return SecureCookieManager.delete_cookie(response, CartCookies.CART_COOKIE_KEY)
\ No newline at end of file
+        return SecureCookieManager.delete_cookie(response, CartCookies.CART_COOKIE_KEY)
@@ -0,0 +1,20 @@
+# Generated by Django 5.0.1 on 2026-10-18 12:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service', '0002_service_search_index'),
+        ('shop', '0005_order_order_keyset_idx_product_product_keyset_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='supportticket',
+            index=models.Index(fields=['customer', 'created_at', 'id'], name='ticket_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,7 @@
+"""
+Index plein texte du catalogue de services
+"""
+from search_index import SearchIndex
+from .models import Service
+
+service_search_index = SearchIndex(Service, ['name', 'description'])
@@ -72,6 +72,42 @@ class ServiceTestCase(APITestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]['id'], service1.id)
 
+class ServicePriceFilterTestCase(APITestCase):
+    def setUp(self):
+        self.category = ServiceCategory.objects.create(name='Conseil')
+        for name, price in [('Audit', '100.00'), ('Formation', '250.00'), ('Accompagnement', '400.00')]:
+            Service.objects.create(
+                name=name, description=name, category=self.category,
+                type='consultation', price=Decimal(price)
+            )
+
+    def test_price_with_vat_range_and_ordering(self):
+        """Test filtrage et tri sur le prix TVAC stocké"""
+        response = self.client.get('/api/service/services/', {
+            'min_price': '121', 'max_price': '302.50', 'ordering': '-price_with_vat'
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        results = response.data.get('results', response.data)
+        self.assertEqual([s['name'] for s in results], ['Formation', 'Audit'])
+        self.assertEqual(Decimal(results[0]['price_with_vat']), Decimal('302.50'))
+
+    def test_conditional_get(self):
+        """Test 304 tant qu'aucun service n'est modifié"""
+        from rest_framework.test import APIRequestFactory
+        from .views import ServiceViewSet
+
+        factory = APIRequestFactory()
+        view = ServiceViewSet.as_view({'get': 'list'})
+        etag = view(factory.get('/api/service/services/'))['ETag']
+        response = view(factory.get('/api/service/services/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Service.objects.filter(name='Audit').first().delete()
+        response = view(factory.get('/api/service/services/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
 class SubscriptionTestCase(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -0,0 +1,40 @@
+"""
+Versions de cache tenues en base (CACHE_VERSION_STORE) : partagées sans cache partagé
+"""
+import time
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from .models import SequenceCounter
+
+class SequenceCounterVersionStore:
+    """Une ligne SequenceCounter « version:<espace> » par espace de clés.
+
+    Pour un cache propre à chaque processus (LocMem) : les versions restent
+    communes à tous les workers et ne sont jamais évincées. CacheManager
+    n'incrémente qu'au commit, hors de la transaction des écrivains.
+    """
+
+    @staticmethod
+    def counters(namespace: str):
+        return SequenceCounter.objects.filter(key=f"version:{namespace}", period='')
+
+    def get(self, namespace: str) -> int:
+        version = self.counters(namespace).values_list('value', flat=True).first()
+        return self.create(namespace) if version is None else version
+
+    def bump(self, namespace: str) -> int:
+        counters = self.counters(namespace)
+        with transaction.atomic():
+            if counters.update(value=F('value') + 1):
+                return counters.values_list('value', flat=True).get()
+            return self.create(namespace)
+
+    def create(self, namespace: str) -> int:
+        # Initialisée à l'horloge : jamais égale à une version déjà servie
+        try:
+            with transaction.atomic():
+                return SequenceCounter.objects.create(
+                    key=f"version:{namespace}", period='', value=int(time.time() * 1000)
+                ).value
+        except IntegrityError:
+            return self.counters(namespace).values_list('value', flat=True).get()
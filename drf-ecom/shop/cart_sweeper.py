@@ -0,0 +1,102 @@
+"""
+Balayage par lots des paniers abandonnés et des sessions expirées
+"""
+import time
+import logging
+from datetime import timedelta
+from importlib import import_module
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from .cart_store import CartStore
+from .models import Cart, CartItem, SequenceCounter
+
+logger = logging.getLogger(__name__)
+
+class CartSweeper:
+    """Supprime les paniers sans modification depuis ``CART_IDLE_DAYS`` jours.
+
+    Parcours par clé (pk > dernier pk vu), jamais par OFFSET : chaque lot
+    est une courte transaction qui ne verrouille que ses lignes. La
+    condition d'inactivité est revérifiée au DELETE, un panier modifié
+    entre-temps est conservé. Les mutations encore en cache (cache partagé
+    de ``CartStore``) sont écrites avant le balayage pour que ``updated_at``
+    soit à jour ; un panier resté sale, flush échoué ou mutation arrivée
+    depuis, est épargné.
+    """
+
+    BATCH_SIZE = 500
+    DEFAULT_IDLE_DAYS = 30
+    METRICS_PREFIX = 'cart_sweeper:'
+    METRICS = ('runs', 'carts', 'items', 'sessions')
+
+    @classmethod
+    def sweep(cls, idle_days: int = None, batch_size: int = None, now=None) -> dict:
+        start = time.time()
+        idle_days = idle_days or getattr(settings, 'CART_IDLE_DAYS', cls.DEFAULT_IDLE_DAYS)
+        batch_size = batch_size or cls.BATCH_SIZE
+        cutoff = (now or timezone.now()) - timedelta(days=idle_days)
+        CartStore.flush()
+
+        stats = {'carts': 0, 'items': 0, 'sessions': 0, 'batches': 0}
+        last = 0
+        while True:
+            ids = list(
+                Cart.objects.filter(updated_at__lt=cutoff, pk__gt=last)
+                .order_by('pk').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            last = ids[-1]
+            dirty = CartStore.dirty_ids()
+            ids = [pk for pk in ids if pk not in dirty]
+            with transaction.atomic():
+                _, deleted = Cart.objects.filter(pk__in=ids, updated_at__lt=cutoff).delete()
+            CartStore.discard(ids)
+            stats['carts'] += deleted.get(Cart._meta.label, 0)
+            stats['items'] += deleted.get(CartItem._meta.label, 0)
+            stats['batches'] += 1
+
+        stats['sessions'] = cls.clear_sessions(batch_size)
+        stats['duration'] = time.time() - start
+        cls.record(stats)
+        logger.info(f"Cart sweep: {stats}")
+        return stats
+
+    @staticmethod
+    def clear_sessions(batch_size: int) -> int:
+        """Sessions expirées en base, par lots ; les moteurs en cache expirent d'eux-mêmes"""
+        store = import_module(settings.SESSION_ENGINE).SessionStore
+        if not hasattr(store, 'get_model_class'):
+            return 0
+        model = store.get_model_class()
+        now = timezone.now()
+        total = 0
+        last = ''
+        while True:
+            keys = list(
+                model.objects.filter(expire_date__lt=now, session_key__gt=last)
+                .order_by('session_key').values_list('session_key', flat=True)[:batch_size]
+            )
+            if not keys:
+                return total
+            last = keys[-1]
+            total += model.objects.filter(session_key__in=keys, expire_date__lt=now).delete()[0]
+
+    @classmethod
+    def record(cls, stats: dict):
+        """Cumuls des lignes récupérées, en base (un compteur par mesure), lus par metrics()"""
+        increments = {'runs': 1, **{name: stats[name] for name in cls.METRICS if name != 'runs'}}
+        with transaction.atomic():
+            SequenceCounter.objects.bulk_create(
+                [SequenceCounter(key=cls.METRICS_PREFIX + name, period='') for name in cls.METRICS],
+                ignore_conflicts=True
+            )
+            for name, amount in increments.items():
+                SequenceCounter.objects.filter(key=cls.METRICS_PREFIX + name, period='').update(value=F('value') + amount)
+
+    @classmethod
+    def metrics(cls) -> dict:
+        counters = SequenceCounter.objects.filter(key__startswith=cls.METRICS_PREFIX, period='')
+        return {key.removeprefix(cls.METRICS_PREFIX): value for key, value in counters.values_list('key', 'value')}
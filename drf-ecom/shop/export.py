@@ -0,0 +1,124 @@
+"""
+Export en flux du catalogue produits (NDJSON / CSV)
+"""
+import csv
+from datetime import datetime, time
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import BaseRenderer
+from .models import ProductSnapshot
+
+class EchoBuffer:
+    """Pseudo-fichier pour csv.writer : write() retourne la ligne au lieu de la stocker"""
+
+    def write(self, value):
+        return value
+
+class NDJSONRenderer(BaseRenderer):
+    """Format ndjson pour la négociation ; le catalogue est produit en flux,
+    render() ne sert qu'aux réponses d'erreur."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return (DjangoJSONEncoder(ensure_ascii=False).encode(data) + '\n').encode(self.charset)
+
+class CSVRenderer(BaseRenderer):
+    """Format csv pour la négociation ; render() ne sert qu'aux réponses d'erreur"""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        writer = csv.writer(EchoBuffer())
+        items = data.items() if isinstance(data, dict) else [('detail', data)]
+        return ''.join(writer.writerow([key, value]) for key, value in items).encode(self.charset)
+
+class CatalogExporter:
+    """Parcourt le modèle de lecture du catalogue par curseur et produit le flux.
+
+    La mémoire reste constante : lecture par ``iterator(chunk_size)``
+    (curseur serveur sous PostgreSQL), aucune liste intermédiaire, et les
+    lignes sont émises par paquets de ``LINES_PER_CHUNK``. Avec
+    ``updated_since`` et ``include_inactive`` (réservé au personnel), les
+    produits désactivés sont aussi émis (is_active = false) pour que le
+    partenaire puisse les retirer.
+    """
+
+    FIELDS = (
+        'product', 'sku', 'slug', 'name', 'description', 'category', 'category_name',
+        'price', 'vat_rate', 'price_with_vat', 'stock_quantity', 'is_in_stock',
+        'is_digital', 'is_active', 'primary_image', 'updated_at'
+    )
+    HEADER = ('id',) + FIELDS[1:]
+    CHUNK_SIZE = 2000
+    LINES_PER_CHUNK = 200
+
+    def __init__(self, updated_since=None, include_inactive: bool = False):
+        self.updated_since = updated_since
+        self.include_inactive = include_inactive
+        # Horodatage à repasser en updated_since lors de la prochaine synchronisation
+        self.started_at = timezone.now()
+
+    @staticmethod
+    def parse_since(value):
+        """Date ou date-heure ISO 8601 ; une date naïve est interprétée dans le fuseau courant"""
+        if not value:
+            return None
+        try:
+            moment = parse_datetime(value)
+            if moment is None:
+                day = parse_date(value)
+                moment = datetime.combine(day, time.min) if day else None
+        except ValueError:
+            moment = None
+        if moment is None:
+            raise ValidationError({'updated_since': 'Date ISO 8601 invalide'})
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment)
+        return moment
+
+    def get_queryset(self):
+        queryset = ProductSnapshot.objects.all()
+        if self.updated_since is not None:
+            # synced_at et non updated_at : stock, images et catégorie changent sans toucher au produit
+            queryset = queryset.filter(synced_at__gte=self.updated_since)
+        if self.updated_since is None or not self.include_inactive:
+            queryset = queryset.filter(is_active=True)
+        return queryset.order_by('synced_at', 'product').values_list(*self.FIELDS)
+
+    def rows(self):
+        return self.get_queryset().iterator(chunk_size=self.CHUNK_SIZE)
+
+    @classmethod
+    def _batched(cls, lines):
+        batch = []
+        for line in lines:
+            batch.append(line)
+            if len(batch) >= cls.LINES_PER_CHUNK:
+                yield ''.join(batch)
+                batch = []
+        if batch:
+            yield ''.join(batch)
+
+    def ndjson(self):
+        encoder = DjangoJSONEncoder(ensure_ascii=False)
+        return self._batched(
+            encoder.encode(dict(zip(self.HEADER, row))) + '\n'
+            for row in self.rows()
+        )
+
+    def csv(self):
+        writer = csv.writer(EchoBuffer())
+
+        def lines():
+            yield writer.writerow(self.HEADER)
+            for row in self.rows():
+                yield writer.writerow([
+                    value.isoformat() if hasattr(value, 'isoformat') else value
+                    for value in row
+                ])
+        return self._batched(lines())
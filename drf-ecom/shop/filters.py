@@ -0,0 +1,36 @@
+import django_filters
+from .models import Category, Product, ProductSnapshot
+
+class ProductFilter(django_filters.FilterSet):
+    """Filtres du catalogue produits"""
+
+    descendants = django_filters.CharFilter(method='filter_descendants')
+    # Fourchette de prix TVAC, sur la colonne stockée et indexée
+    min_price = django_filters.NumberFilter(field_name='price_with_vat', lookup_expr='gte')
+    max_price = django_filters.NumberFilter(field_name='price_with_vat', lookup_expr='lte')
+    category_path_lookup = 'category__path'
+
+    class Meta:
+        model = Product
+        fields = ['category', 'is_digital']
+
+    def filter_descendants(self, queryset, name, value):
+        """Produits de toute la sous-arborescence d'une catégorie (id ou slug)"""
+        lookup = {'pk': value} if value.isdigit() else {'slug': value}
+        path = Category.objects.filter(**lookup).values_list('path', flat=True).first()
+        if path is None:
+            return queryset.none()
+
+        start, end = Category.subtree_range(path)
+        return queryset.filter(**{
+            f'{self.category_path_lookup}__gte': start,
+            f'{self.category_path_lookup}__lt': end,
+        })
+
+class ProductSnapshotFilter(ProductFilter):
+    """Mêmes filtres sur le modèle de lecture (chemin de catégorie dénormalisé)"""
+
+    category_path_lookup = 'category_path'
+
+    class Meta(ProductFilter.Meta):
+        model = ProductSnapshot
@@ -0,0 +1,171 @@
+"""
+En-tête Idempotency-Key : une requête rejouée reçoit la réponse de la première
+"""
+import time
+import hashlib
+import logging
+from datetime import timedelta
+from django.db import IntegrityError, transaction
+from django.http.request import RawPostDataException
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+from .models import IdempotencyRecord
+
+logger = logging.getLogger(__name__)
+
+class IdempotencyConflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'Une requête avec cette Idempotency-Key est encore en cours'
+    default_code = 'idempotency_in_progress'
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = 'Idempotency-Key déjà utilisée pour une requête différente'
+    default_code = 'idempotency_key_reused'
+
+class Replay(Exception):
+    """Interrompt la vue : la réponse mémorisée est renvoyée telle quelle"""
+
+    def __init__(self, response):
+        self.response = response
+        super().__init__(response.status_code)
+
+class IdempotencyStore:
+    """Enregistrements (utilisateur, clé, route) en base, partagés par tous les processus.
+
+    L'INSERT de l'enregistrement « en cours » sert de verrou : une requête
+    dupliquée concurrente trouve la ligne et attend son résultat au lieu
+    d'exécuter la vue une seconde fois. Un enregistrement resté en cours
+    au-delà de LOCK_TIMEOUT (processus arrêté) peut être repris.
+    """
+
+    TTL = timedelta(hours=24)
+    LOCK_TIMEOUT = timedelta(seconds=60)
+    WAIT_TIMEOUT = 10
+    POLL_INTERVAL = 0.05
+    SWEEP_BATCH_SIZE = 1000
+
+    @classmethod
+    def claim(cls, user, key: str, route: str, request_hash: str):
+        """(enregistrement, True si cette requête doit exécuter la vue)"""
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                record = IdempotencyRecord.objects.create(
+                    user=user, key=key, route=route, request_hash=request_hash, expires_at=now + cls.TTL
+                )
+            return record, True
+        except IntegrityError:
+            record = IdempotencyRecord.objects.get(user=user, key=key, route=route)
+
+        if record.request_hash != request_hash:
+            raise IdempotencyKeyReused()
+        # Première requête abandonnée : reprise par une mise à jour conditionnelle
+        taken = IdempotencyRecord.objects.filter(
+            pk=record.pk, status_code__isnull=True, created_at__lt=now - cls.LOCK_TIMEOUT
+        ).update(created_at=now, expires_at=now + cls.TTL)
+        return record, bool(taken)
+
+    @classmethod
+    def wait(cls, record) -> Response:
+        """Réponse de la première requête, attendue au plus WAIT_TIMEOUT secondes"""
+        deadline = time.monotonic() + cls.WAIT_TIMEOUT
+        while True:
+            status_code, body = IdempotencyRecord.objects.filter(pk=record.pk).values_list(
+                'status_code', 'response_body'
+            ).first() or (None, None)
+            if status_code is not None:
+                return Response(body, status=status_code, headers={'Idempotent-Replayed': 'true'})
+            if time.monotonic() > deadline:
+                raise IdempotencyConflict()
+            time.sleep(cls.POLL_INTERVAL)
+
+    @staticmethod
+    def complete(record, status_code: int, body):
+        IdempotencyRecord.objects.filter(pk=record.pk).update(status_code=status_code, response_body=body)
+
+    @staticmethod
+    def release(record):
+        """Oublier une requête en échec serveur : une nouvelle tentative s'exécutera"""
+        IdempotencyRecord.objects.filter(pk=record.pk, status_code__isnull=True).delete()
+
+    @classmethod
+    def sweep(cls, now=None, batch_size: int = None) -> int:
+        """Supprimer par lots les enregistrements expirés"""
+        now = now or timezone.now()
+        batch_size = batch_size or cls.SWEEP_BATCH_SIZE
+        total = 0
+        while True:
+            ids = list(
+                IdempotencyRecord.objects.filter(expires_at__lte=now)
+                .order_by('expires_at').values_list('pk', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            total += IdempotencyRecord.objects.filter(pk__in=ids).delete()[0]
+        if total:
+            logger.info(f"Idempotency records swept: {total}")
+        return total
+
+class IdempotencyMixin:
+    """Actions de ``idempotent_actions`` rejouables sans effet de bord.
+
+    Une requête authentifiée avec ``Idempotency-Key`` est enregistrée sous
+    (utilisateur, clé, méthode + chemin) avec l'empreinte de son corps. Les
+    réponses < 500 sont mémorisées et renvoyées aux répétitions ; une
+    erreur serveur libère la clé. La même clé avec un autre corps : 422.
+    """
+
+    idempotent_actions = ()
+    IDEMPOTENCY_HEADER = 'Idempotency-Key'
+    MAX_KEY_LENGTH = 255
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.idempotency_record = None
+        key = request.headers.get(self.IDEMPOTENCY_HEADER)
+        if not key or self.action not in self.idempotent_actions or not request.user.is_authenticated:
+            return
+        if len(key) > self.MAX_KEY_LENGTH:
+            raise ValidationError({self.IDEMPOTENCY_HEADER: f'{self.MAX_KEY_LENGTH} caractères au maximum'})
+
+        try:
+            body = request.body
+        except RawPostDataException:
+            body = repr(sorted(request.data.items())).encode()
+        request_hash = hashlib.sha256(body).hexdigest()
+        route = f'{request.method} {request.path}'[:200]
+
+        record, claimed = IdempotencyStore.claim(request.user, key, route, request_hash)
+        if not claimed:
+            logger.debug(f"Idempotent replay for {route}")
+            raise Replay(IdempotencyStore.wait(record))
+        self.idempotency_record = record
+
+    def handle_exception(self, exc):
+        if isinstance(exc, Replay):
+            return exc.response
+        try:
+            return super().handle_exception(exc)
+        except Exception:
+            self.release_idempotency()
+            raise
+
+    def release_idempotency(self):
+        record = getattr(self, 'idempotency_record', None)
+        if record is not None:
+            IdempotencyStore.release(record)
+            self.idempotency_record = None
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        record = getattr(self, 'idempotency_record', None)
+        if record is not None:
+            if response.status_code >= 500:
+                self.release_idempotency()
+            else:
+                IdempotencyStore.complete(record, response.status_code, getattr(response, 'data', None))
+                self.idempotency_record = None
+        return response
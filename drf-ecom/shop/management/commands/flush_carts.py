@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from shop.cart_store import CartStore
+
+class Command(BaseCommand):
+    help = 'Écrit en base les paniers modifiés en cache (à planifier toutes les minutes)'
+
+    def handle(self, *args, **options):
+        if not CartStore.write_behind():
+            self.stdout.write('✅ Cache des paniers local au processus : paniers déjà écrits en base')
+            return
+        count = CartStore.flush()
+        self.stdout.write(f'✅ {count} paniers écrits en base')
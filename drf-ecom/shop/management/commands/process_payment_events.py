@@ -0,0 +1,29 @@
+import time
+from django.core.management.base import BaseCommand
+from shop.webhooks import PaymentEventInbox
+
+class Command(BaseCommand):
+    help = 'Traite par lots les événements de paiement reçus par webhook (worker ou tâche planifiée)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=PaymentEventInbox.BATCH_SIZE, help='Événements par lot')
+        parser.add_argument('--loop', action='store_true', help='Tourner en continu')
+        parser.add_argument('--interval', type=float, default=1.0, help='Pause en secondes entre deux passages')
+        parser.add_argument('--requeue-failed', action='store_true', help='Remettre en file les événements abandonnés')
+
+    def handle(self, *args, **options):
+        if options['requeue_failed']:
+            count = PaymentEventInbox.requeue_failed()
+            self.stdout.write(f'✅ {count} événements abandonnés remis en file')
+        while True:
+            # process_pending vide la file disponible : les événements en échec
+            # attendent leur délai de reprise, le worker fait une pause
+            stats = PaymentEventInbox.process_pending(batch_size=options['batch_size'])
+            if stats['events'] or stats['failed'] or not options['loop']:
+                self.stdout.write(
+                    f"✅ {stats['events']} événements traités ({stats['orders']} commandes payées, "
+                    f"{stats['failed']} en erreur) en {stats['batches']} lots"
+                )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
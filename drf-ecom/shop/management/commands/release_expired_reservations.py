@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from shop.stock import StockReservationService
+
+class Command(BaseCommand):
+    help = 'Libère les réservations de stock expirées et rend le stock (à planifier chaque minute)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=StockReservationService.SWEEP_BATCH_SIZE, help='Réservations par lot')
+
+    def handle(self, *args, **options):
+        count = StockReservationService.release_expired(batch_size=options['batch_size'])
+        self.stdout.write(f'✅ {count} réservations expirées libérées')
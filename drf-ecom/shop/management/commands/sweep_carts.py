@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from shop.cart_sweeper import CartSweeper
+
+class Command(BaseCommand):
+    help = 'Supprime par lots les paniers abandonnés et les sessions expirées (à planifier chaque nuit)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None, help="Jours d'inactivité (défaut : CART_IDLE_DAYS)")
+        parser.add_argument('--batch-size', type=int, default=CartSweeper.BATCH_SIZE, help='Paniers par lot')
+
+    def handle(self, *args, **options):
+        stats = CartSweeper.sweep(idle_days=options['days'], batch_size=options['batch_size'])
+        self.stdout.write(
+            f"✅ {stats['carts']} paniers ({stats['items']} articles) et {stats['sessions']} sessions supprimés "
+            f"en {stats['batches']} lots"
+        )
@@ -0,0 +1,44 @@
+# Generated by Django 5.0.1 on 2026-10-18 09:00
+
+from django.db import migrations
+
+# DDL figé : l'index évolue avec search_index.SearchIndex, pas cette migration
+TABLE = 'shop_product'
+INDEX = 'shop_product_fts'
+COLUMNS = ['name', 'description', 'sku']
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    columns = ', '.join(COLUMNS)
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f'CREATE VIRTUAL TABLE IF NOT EXISTS "{INDEX}" '
+            f"USING fts5({columns}, tokenize='unicode61 remove_diacritics 2')"
+        )
+        schema_editor.execute(f'INSERT INTO "{INDEX}"(rowid, {columns}) SELECT id, {columns} FROM "{TABLE}"')
+    elif vendor == 'postgresql':
+        document = " || ' ' || ".join(f"coalesce(\"{column}\", '')" for column in COLUMNS)
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS "{INDEX}_gin" ON "{TABLE}" '
+            f"USING GIN ((to_tsvector('simple', {document})))"
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(f'DROP TABLE IF EXISTS "{INDEX}"')
+    elif vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS "{INDEX}_gin"')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_alter_customer_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 5.0.1 on 2026-10-18 13:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_product_snapshots(apps, schema_editor):
+    # Copie figée (modèles historiques) : ProductSnapshotBuilder évolue avec le schéma
+    from decimal import Decimal
+    from django.core.files.storage import default_storage
+    from django.db.models import OuterRef, Subquery
+
+    Product = apps.get_model('shop', 'Product')
+    ProductImage = apps.get_model('shop', 'ProductImage')
+    ProductSnapshot = apps.get_model('shop', 'ProductSnapshot')
+
+    primary_image = ProductImage.objects.filter(product=OuterRef('pk')).order_by('-is_primary', 'pk')
+    rows = Product.objects.annotate(
+        primary_image=Subquery(primary_image.values('image')[:1])
+    ).values(
+        'pk', 'name', 'slug', 'sku', 'description', 'category_id', 'category__name', 'category__path',
+        'price', 'vat_rate', 'stock_quantity', 'is_digital', 'is_active', 'primary_image',
+        'created_at', 'updated_at'
+    )
+    ProductSnapshot.objects.bulk_create([
+        ProductSnapshot(
+            product_id=row['pk'],
+            name=row['name'],
+            slug=row['slug'],
+            sku=row['sku'],
+            description=row['description'],
+            category_id=row['category_id'],
+            category_name=row['category__name'],
+            category_path=row['category__path'],
+            price=row['price'],
+            vat_rate=row['vat_rate'],
+            price_with_vat=(row['price'] * (1 + row['vat_rate'] / 100)).quantize(Decimal('0.01')),
+            stock_quantity=row['stock_quantity'],
+            is_in_stock=row['stock_quantity'] > 0,
+            is_digital=row['is_digital'],
+            is_active=row['is_active'],
+            primary_image=default_storage.url(row['primary_image']) if row['primary_image'] else '',
+            created_at=row['created_at'],
+            updated_at=row['updated_at'],
+        )
+        for row in rows.iterator(chunk_size=500)
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_product_recommendations'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSnapshot',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='shop.product')),
+                ('name', models.CharField(max_length=200)),
+                ('slug', models.SlugField()),
+                ('sku', models.CharField(max_length=50)),
+                ('description', models.TextField()),
+                ('category_name', models.CharField(max_length=100)),
+                ('category_path', models.CharField(db_index=True, max_length=255)),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('vat_rate', models.DecimalField(decimal_places=2, max_digits=4)),
+                ('price_with_vat', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('stock_quantity', models.PositiveIntegerField(default=0)),
+                ('is_in_stock', models.BooleanField(default=False)),
+                ('is_digital', models.BooleanField(default=False)),
+                ('is_active', models.BooleanField(default=True)),
+                ('primary_image', models.CharField(blank=True, max_length=500)),
+                ('created_at', models.DateTimeField()),
+                ('updated_at', models.DateTimeField()),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.category')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['created_at', 'product'], name='snapshot_keyset_idx')],
+            },
+        ),
+        migrations.RunPython(build_product_snapshots, migrations.RunPython.noop),
+    ]
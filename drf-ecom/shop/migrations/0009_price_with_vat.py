@@ -0,0 +1,29 @@
+# Generated by Django 5.0.1 on 2026-10-18 13:04
+
+import django.db.models.expressions
+import django.db.models.functions.math
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_product_snapshot'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='price_with_vat',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.math.Round(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('price'), '*', django.db.models.expressions.CombinedExpression(models.F('vat_rate'), '+', models.Value(Decimal('100')))), '*', models.Value(Decimal('0.01'))), 2), output_field=models.DecimalField(decimal_places=2, max_digits=10)),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['price_with_vat'], name='product_price_vat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productsnapshot',
+            index=models.Index(fields=['price_with_vat'], name='snapshot_price_vat_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.1 on 2026-10-18 13:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_stock_reservation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('reason', models.CharField(choices=[('reservation', 'Réservation'), ('release', 'Libération'), ('import', 'Import catalogue'), ('adjustment', 'Ajustement')], max_length=20)),
+                ('reference', models.CharField(blank=True, max_length=50)),
+                ('balance', models.IntegerField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('stock_quantity__lt', models.F('min_stock_level'))), fields=['stock_quantity', 'min_stock_level', 'id'], name='product_low_stock_idx'),
+        ),
+        migrations.AddField(
+            model_name='stockmovement',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stock_movements', to='shop.product'),
+        ),
+        migrations.AddIndex(
+            model_name='stockmovement',
+            index=models.Index(fields=['product', 'created_at', 'id'], name='movement_product_idx'),
+        ),
+    ]
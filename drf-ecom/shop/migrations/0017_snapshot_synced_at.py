@@ -0,0 +1,31 @@
+# Generated by Django 5.0.1 on 2026-10-18 15:10
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def restore_updated_at(apps, schema_editor):
+    # updated_at redevient celui du produit ; l'instant de réécriture passe dans synced_at
+    Product = apps.get_model('shop', 'Product')
+    ProductSnapshot = apps.get_model('shop', 'ProductSnapshot')
+    ProductSnapshot.objects.update(
+        synced_at=models.F('updated_at'),
+        updated_at=models.Subquery(Product.objects.filter(pk=models.OuterRef('pk')).values('updated_at')[:1])
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_payment_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productsnapshot',
+            name='synced_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(restore_updated_at, migrations.RunPython.noop),
+    ]
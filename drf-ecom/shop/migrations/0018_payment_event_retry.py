@@ -0,0 +1,45 @@
+# Generated by Django 5.0.1 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+def mark_abandoned(apps, schema_editor):
+    # Jusqu'ici un événement abandonné était marqué traité en gardant son erreur
+    PaymentEvent = apps.get_model('shop', 'PaymentEvent')
+    PaymentEvent.objects.filter(processed_at__isnull=False).exclude(error='').update(
+        failed_at=models.F('processed_at'), processed_at=None
+    )
+
+
+def unmark_abandoned(apps, schema_editor):
+    PaymentEvent = apps.get_model('shop', 'PaymentEvent')
+    PaymentEvent.objects.filter(failed_at__isnull=False).update(processed_at=models.F('failed_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0017_snapshot_synced_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='paymentevent',
+            name='payment_event_pending_idx',
+        ),
+        migrations.AddField(
+            model_name='paymentevent',
+            name='failed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='paymentevent',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_abandoned, unmark_abandoned),
+        migrations.AddIndex(
+            model_name='paymentevent',
+            index=models.Index(condition=models.Q(('failed_at__isnull', True), ('processed_at__isnull', True)), fields=['id'], name='payment_event_pending_idx'),
+        ),
+    ]
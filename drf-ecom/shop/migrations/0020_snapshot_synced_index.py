@@ -0,0 +1,21 @@
+# Generated by Django 5.0.1 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0019_copurchase_basket'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='productsnapshot',
+            name='snapshot_updated_idx',
+        ),
+        migrations.AddIndex(
+            model_name='productsnapshot',
+            index=models.Index(fields=['synced_at', 'product'], name='snapshot_synced_idx'),
+        ),
+    ]
@@ -1,23 +1,133 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce, Concat, Round, Substr
 from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator, MaxValueValidator
 from decimal import Decimal
 
+def vat_inclusive_price(price='price', vat_rate='vat_rate'):
+    """Expression SQL du prix TVAC arrondi au cent.
+
+    Multiplication par 0.01 plutôt que division par 100 : sous SQLite, des
+    montants entiers stockés en NUMERIC donneraient une division entière.
+    """
+    return Round(F(price) * (F(vat_rate) + Value(Decimal('100'))) * Value(Decimal('0.01')), 2)
+
+class VatInclusivePriceMixin:
+    """Relit ``price_with_vat`` après un save() de mise à jour.
+
+    La colonne générée est renvoyée par l'INSERT (RETURNING), pas par
+    l'UPDATE : sans relecture, l'instance garderait l'ancien prix TVAC.
+    """
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if not adding and (update_fields is None or {'price', 'vat_rate'} & set(update_fields)):
+            self.refresh_from_db(fields=['price_with_vat'])
+
 class Category(models.Model):
     name = models.CharField(max_length=100)
     slug = models.SlugField(unique=True)
     description = models.TextField(blank=True)
     parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True)
+    # Chemin matérialisé : un segment base 36 de largeur fixe par niveau ("000001/00000A/")
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    SEGMENT_WIDTH = 6
+    SEGMENT_DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+    TREE_CACHE_KEY = 'category_tree'
+    # Version CacheManager incrémentée à chaque modification (validateur HTTP)
+    VERSION_NAMESPACE = 'categories'
+
     class Meta:
         verbose_name_plural = "Categories"
 
     def __str__(self):
         return self.name
 
-class Product(models.Model):
+    @classmethod
+    def path_segment(cls, pk):
+        """Encoder un id en segment base 36 de largeur fixe (ordre lexicographique = ordre numérique)"""
+        digits = ''
+        while pk:
+            pk, remainder = divmod(pk, 36)
+            digits = cls.SEGMENT_DIGITS[remainder] + digits
+        return digits.rjust(cls.SEGMENT_WIDTH, '0') + '/'
+
+    @staticmethod
+    def subtree_range(path):
+        """Bornes [début, fin[ couvrant tous les chemins préfixés par path.
+
+        '/' précède '0' : remplacer le séparateur final par '0' donne la borne
+        haute, ce qui permet un parcours d'index plutôt qu'un LIKE.
+        """
+        return path, path[:-1] + '0'
+
+    def get_descendants(self, include_self=True):
+        """Sous-arbre complet en une seule requête indexée"""
+        start, end = self.subtree_range(self.path)
+        queryset = Category.objects.filter(path__gte=start, path__lt=end)
+        if not include_self:
+            queryset = queryset.exclude(pk=self.pk)
+        return queryset
+
+    @classmethod
+    def build_tree(cls):
+        """Arborescence active imbriquée, construite en une requête triée par chemin"""
+        nodes = {}
+        roots = []
+        rows = cls.objects.filter(is_active=True).order_by('path').values(
+            'id', 'name', 'slug', 'parent_id', 'depth'
+        )
+        for row in rows:
+            parent_id = row.pop('parent_id')
+            node = dict(row, children=[])
+            nodes[node['id']] = node
+            if parent_id is None:
+                roots.append(node)
+            elif parent_id in nodes:
+                nodes[parent_id]['children'].append(node)
+        return roots
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic():
+            parent_path = ''
+            if self.parent_id:
+                parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).get()
+
+            if self.pk is None:
+                super().save(*args, **kwargs)
+                self.path = parent_path + self.path_segment(self.pk)
+                self.depth = self.path.count('/') - 1
+                Category.objects.filter(pk=self.pk).update(path=self.path, depth=self.depth)
+                return
+
+            old_path = Category.objects.filter(pk=self.pk).values_list('path', flat=True).first() or ''
+            new_path = parent_path + self.path_segment(self.pk)
+            if old_path and parent_path.startswith(old_path):
+                raise ValueError("Une catégorie ne peut pas être déplacée sous l'un de ses descendants")
+
+            self.path = new_path
+            self.depth = new_path.count('/') - 1
+
+            if old_path and old_path != new_path:
+                # Déplacement : réécrire le préfixe du sous-arbre en un seul UPDATE,
+                # avant post_save pour que les receveurs voient l'arbre à jour
+                start, end = self.subtree_range(old_path)
+                Category.objects.filter(path__gte=start, path__lt=end).exclude(pk=self.pk).update(
+                    path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + (self.depth - (old_path.count('/') - 1))
+                )
+
+            super().save(*args, **kwargs)
+
+class Product(VatInclusivePriceMixin, models.Model):
     name = models.CharField(max_length=200)
     slug = models.SlugField(unique=True)
     description = models.TextField()
@@ -30,11 +140,32 @@ class Product(models.Model):
     weight = models.DecimalField(max_digits=8, decimal_places=2, null=True, blank=True)
     dimensions = models.CharField(max_length=100, blank=True)
     vat_rate = models.DecimalField(max_digits=4, decimal_places=2, default=Decimal('21.00'))
+    # Calculé et stocké par la base : filtrable, triable et indexable
+    price_with_vat = models.GeneratedField(
+        expression=vat_inclusive_price(),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True
+    )
     is_active = models.BooleanField(default=True)
     is_digital = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='product_keyset_idx'),
+            models.Index(fields=['price_with_vat'], name='product_price_vat_idx'),
+            # Index partiel : ne contient que les produits à réapprovisionner. Les requêtes
+            # doivent reprendre exactement LOW_STOCK pour que le planificateur l'utilise.
+            models.Index(
+                fields=['stock_quantity', 'min_stock_level', 'id'], name='product_low_stock_idx',
+                condition=Q(stock_quantity__lt=F('min_stock_level'))
+            ),
+        ]
+
+    # Prédicat de réassort (identique à la condition de product_low_stock_idx)
+    LOW_STOCK = Q(stock_quantity__lt=F('min_stock_level'))
+
     def __str__(self):
         return self.name
 
@@ -42,15 +173,13 @@ class Product(models.Model):
     def is_in_stock(self):
         return self.stock_quantity > 0
 
-    @property
-    def price_with_vat(self):
-        return self.price * (1 + self.vat_rate / 100)
-
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='products/')
     alt_text = models.CharField(max_length=200, blank=True)
     is_primary = models.BooleanField(default=False)
+    # {'source': <fichier traité>, <variante>: {<format>: <chemin>}} (voir shop.images)
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
 class Customer(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -81,14 +210,58 @@ class Address(models.Model):
     country = models.CharField(max_length=2, default='BE')
     is_default = models.BooleanField(default=False)
 
+def cart_totals(prefix: str = ''):
+    """Totaux d'un panier en agrégats SQL : HTVA, TVA et nombre de lignes.
+
+    ``prefix='items__'`` depuis Cart (annotation), vide depuis CartItem.
+    """
+    amount = DecimalField(max_digits=12, decimal_places=2)
+    net = Sum(F(f'{prefix}quantity') * F(f'{prefix}product__price'), output_field=amount)
+    gross = Sum(F(f'{prefix}quantity') * F(f'{prefix}product__price_with_vat'), output_field=amount)
+    zero = Value(Decimal('0.00'))
+    return {
+        'total_amount': Coalesce(net, zero, output_field=amount),
+        'vat_amount': Coalesce(gross - net, zero, output_field=amount),
+        'items_count': Count(f'{prefix}id'),
+    }
+
+class CartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Totaux calculés par la base, dans la requête qui lit les paniers"""
+        return self.annotate(**cart_totals('items__'))
+
+class CartTotal:
+    """Total de panier : valeur annotée par ``with_totals()`` si présente,
+    sinon tous les totaux calculés d'un coup par une requête d'agrégat."""
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, cart, owner=None):
+        if cart is None:
+            return self
+        totals = cart.__dict__.setdefault('_totals', {})
+        if self.name not in totals:
+            totals.update(cart.items.aggregate(**cart_totals()))
+        return totals[self.name]
+
+    def __set__(self, cart, value):
+        cart.__dict__.setdefault('_totals', {})[self.name] = value
+
 class Cart(models.Model):
     customer = models.OneToOneField(Customer, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    @property
-    def total_amount(self):
-        return sum(item.subtotal for item in self.items.all())
+    objects = CartQuerySet.as_manager()
+
+    total_amount = CartTotal()
+    vat_amount = CartTotal()
+    items_count = CartTotal()
+
+    def reset_totals(self):
+        """Oublier les totaux lus après une modification des lignes"""
+        self.__dict__.pop('_totals', None)
 
 class CartItem(models.Model):
     cart = models.ForeignKey(Cart, related_name='items', on_delete=models.CASCADE)
@@ -107,6 +280,8 @@ class Order(models.Model):
     STATUS_CHOICES = [
         ('pending', 'En attente'),
         ('confirmed', 'Confirmée'),
+        # Payée mais stock vendu entre-temps : à réapprovisionner ou rembourser
+        ('backorder', 'En rupture'),
         ('processing', 'En traitement'),
         ('shipped', 'Expédiée'),
         ('delivered', 'Livrée'),
@@ -128,6 +303,11 @@ class Order(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['customer', 'created_at', 'id'], name='order_keyset_idx'),
+        ]
+
     def __str__(self):
         return f"Commande {self.order_number}"
 
@@ -157,4 +337,162 @@ class WishlistItem(models.Model):
     added_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        unique_together = ['wishlist', 'product']
\ No newline at end of file
+        unique_together = ['wishlist', 'product']
+
+class ProductCoPurchase(models.Model):
+    """Entrée non nulle de la matrice creuse produit x produit (achats conjoints)"""
+    product = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    related = models.ForeignKey(Product, related_name='+', on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['product', 'related']
+
+class ProductCoPurchaseBasket(models.Model):
+    """Commande comptée dans la matrice d'achats conjoints, avec son panier.
+
+    Sans clé étrangère : le panier reste connu pour être décompté quand la
+    commande est annulée, remboursée ou supprimée.
+    """
+    order_id = models.PositiveBigIntegerField(primary_key=True)
+    product_ids = models.JSONField(default=list)
+
+class ProductRecommendation(models.Model):
+    """Top-N précalculé des produits achetés avec un produit donné"""
+    product = models.OneToOneField(Product, primary_key=True, related_name='recommendation', on_delete=models.CASCADE)
+    related_ids = models.JSONField(default=list)
+    last_order_id = models.PositiveBigIntegerField(default=0, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+class ProductSnapshot(models.Model):
+    """Modèle de lecture dénormalisé du catalogue : une ligne par produit, sans jointure.
+
+    Maintenu par les signaux (produit, image, catégorie) et reconstructible
+    avec la commande rebuild_product_snapshots.
+    """
+    product = models.OneToOneField(Product, primary_key=True, related_name='snapshot', on_delete=models.CASCADE)
+    name = models.CharField(max_length=200)
+    slug = models.SlugField()
+    sku = models.CharField(max_length=50)
+    description = models.TextField()
+    category = models.ForeignKey(Category, related_name='+', on_delete=models.CASCADE)
+    category_name = models.CharField(max_length=100)
+    category_path = models.CharField(max_length=255, db_index=True)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    vat_rate = models.DecimalField(max_digits=4, decimal_places=2)
+    price_with_vat = models.DecimalField(max_digits=10, decimal_places=2)
+    stock_quantity = models.PositiveIntegerField(default=0)
+    is_in_stock = models.BooleanField(default=False)
+    is_digital = models.BooleanField(default=False)
+    is_active = models.BooleanField(default=True)
+    primary_image = models.CharField(max_length=500, blank=True)
+    primary_image_variants = models.JSONField(default=dict, blank=True)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    # Dernier changement du contenu de la ligne (export incrémental, requêtes conditionnelles)
+    synced_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'product'], name='snapshot_keyset_idx'),
+            models.Index(fields=['price_with_vat'], name='snapshot_price_vat_idx'),
+            models.Index(fields=['synced_at', 'product'], name='snapshot_synced_idx'),
+        ]
+
+class StockReservation(models.Model):
+    """Réservation temporaire de stock posée au checkout (voir shop.stock)"""
+    STATUS_CHOICES = [
+        ('held', 'Réservé'),
+        ('converted', 'Converti'),
+        ('released', 'Libéré'),
+    ]
+
+    order = models.ForeignKey(Order, related_name='reservations', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='reservations', on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='held')
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'expires_at'], name='reservation_expiry_idx'),
+        ]
+
+class StockMovement(models.Model):
+    """Journal append-only des mouvements de stock (quantité signée)"""
+    REASON_CHOICES = [
+        ('reservation', 'Réservation'),
+        ('release', 'Libération'),
+        ('import', 'Import catalogue'),
+        ('adjustment', 'Ajustement'),
+    ]
+
+    product = models.ForeignKey(Product, related_name='stock_movements', on_delete=models.CASCADE)
+    quantity = models.IntegerField()
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    reference = models.CharField(max_length=50, blank=True)
+    # Solde après mouvement, recalculé par rebuild_stock_balances
+    balance = models.IntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'created_at', 'id'], name='movement_product_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("Le journal de stock est en ajout seul")
+        super().save(*args, **kwargs)
+
+class SequenceCounter(models.Model):
+    """Dernier numéro réservé d'une numérotation de documents, par clé et période"""
+    key = models.CharField(max_length=100)
+    period = models.CharField(max_length=20, blank=True)
+    value = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ['key', 'period']
+
+    def __str__(self):
+        return f"{self.key} {self.period}: {self.value}"
+
+class IdempotencyRecord(models.Model):
+    """Réponse mémorisée d'une requête portant un en-tête Idempotency-Key"""
+    user = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    route = models.CharField(max_length=200)
+    request_hash = models.CharField(max_length=64)
+    # None tant que la première requête est en cours
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        unique_together = ['user', 'key', 'route']
+
+class PaymentEvent(models.Model):
+    """Événement brut reçu de la passerelle de paiement (journal append-only)"""
+    # Identifiant de la passerelle : l'index unique écarte les livraisons répétées
+    event_id = models.CharField(max_length=100, unique=True)
+    type = models.CharField(max_length=100)
+    payload = models.JSONField(encoder=DjangoJSONEncoder)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    # Après un échec : pas de nouvelle tentative avant cet instant
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    # Abandonné après MAX_ATTEMPTS échecs : hors de la file, à reprendre à la main
+    failed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # File d'attente : seuls les événements ni traités ni abandonnés sont indexés
+            models.Index(
+                fields=['id'], name='payment_event_pending_idx',
+                condition=Q(processed_at__isnull=True, failed_at__isnull=True)
+            ),
+        ]
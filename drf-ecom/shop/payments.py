@@ -0,0 +1,388 @@
+"""
+Passerelle de paiement : client mutualisé, délais courts, reprises hors requête et disjoncteur
+"""
+import hmac
+import json
+import time
+import uuid
+import random
+import hashlib
+import logging
+import threading
+import requests
+import stripe
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+from .models import Order
+from .stock import StockReservationService
+
+logger = logging.getLogger(__name__)
+
+# Émis avec order_ids, dans la transaction, lorsque des commandes passent à payées
+orders_paid = Signal()
+
+class PaymentGatewayError(Exception):
+    """Réponse définitive de la passerelle (refus, paramètre invalide, signature incorrecte)"""
+
+class GatewayUnavailable(PaymentGatewayError):
+    """Passerelle injoignable, trop lente ou disjoncteur ouvert : réessayer plus tard"""
+
+class CircuitBreaker:
+    """Ouvert après ``failure_threshold`` échecs consécutifs.
+
+    Ouvert, il fait échouer les appels immédiatement pendant
+    ``reset_timeout`` secondes : une passerelle en panne n'immobilise plus
+    les workers. Ensuite un seul appel d'essai passe (semi-ouvert) ; son
+    succès referme le disjoncteur, son échec le rouvre.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if self.trial or time.monotonic() - self.opened_at < self.reset_timeout:
+            return 'open'
+        return 'half_open'
+
+    def before_call(self):
+        with self.lock:
+            state = self.state
+            if state == 'open':
+                raise GatewayUnavailable('Passerelle de paiement indisponible (disjoncteur ouvert)')
+            if state == 'half_open':
+                self.trial = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial = False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"Payment gateway circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+class PaymentGateway:
+    """Interface des passerelles ; les intentions et événements sont des dictionnaires.
+
+    Intention : {'id', 'status', 'client_secret', 'amount', 'currency', 'metadata'}
+    Événement : {'id', 'type', 'intent'}
+
+    Un appel fait une seule tentative par défaut : dans une requête HTTP,
+    attendre une reprise immobiliserait le worker, le client rejoue avec
+    sa clé d'idempotence (transmise à la passerelle pour la création).
+    Les tâches de fond passent ``retries`` : seuls les échecs transitoires
+    (GatewayUnavailable) sont alors repris, avec un délai exponentiel
+    aléatoire (« full jitter »).
+    """
+
+    TIMEOUT = 3
+    # Reprises des tâches de fond (PaymentService.reconcile)
+    RETRIES = 2
+    BACKOFF = 0.2
+    BACKOFF_MAX = 2.0
+
+    def __init__(self):
+        self.breaker = CircuitBreaker()
+
+    def call(self, operation, *args, retries: int = 0):
+        for attempt in range(retries + 1):
+            self.breaker.before_call()
+            try:
+                result = operation(*args)
+            except GatewayUnavailable as e:
+                self.breaker.record_failure()
+                if attempt == retries:
+                    raise
+                delay = random.uniform(0, min(self.BACKOFF_MAX, self.BACKOFF * 2 ** attempt))
+                logger.info(f"Payment gateway retry {attempt + 1} in {delay:.2f}s: {e}")
+                time.sleep(delay)
+            except PaymentGatewayError:
+                # La passerelle a répondu : pas une panne
+                self.breaker.record_success()
+                raise
+            except BaseException:
+                # Erreur imprévue (réponse illisible, interruption) : comptée comme un
+                # échec, sinon l'essai semi-ouvert resterait pris et le disjoncteur ouvert
+                self.breaker.record_failure()
+                raise
+            else:
+                self.breaker.record_success()
+                return result
+
+    def create_intent(self, amount: int, currency: str, metadata: dict, idempotency_key: str = None,
+                      retries: int = 0) -> dict:
+        return self.call(self._create_intent, amount, currency, metadata, idempotency_key, retries=retries)
+
+    def retrieve_intent(self, intent_id: str, retries: int = 0) -> dict:
+        return self.call(self._retrieve_intent, intent_id, retries=retries)
+
+    def parse_event(self, payload: bytes, signature: str) -> dict:
+        """Événement webhook vérifié ; PaymentGatewayError si la signature est invalide"""
+        raise NotImplementedError
+
+    def _create_intent(self, amount, currency, metadata, idempotency_key):
+        raise NotImplementedError
+
+    def _retrieve_intent(self, intent_id):
+        raise NotImplementedError
+
+class StripeGateway(PaymentGateway):
+    """Stripe via un client HTTP mutualisé (pool de connexions keep-alive par processus)"""
+
+    POOL_SIZE = 10
+
+    def __init__(self):
+        super().__init__()
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=self.POOL_SIZE))
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        # Les reprises sont faites ici, pas par le SDK
+        stripe.max_network_retries = 0
+        stripe.default_http_client = stripe.http_client.RequestsClient(timeout=self.TIMEOUT, session=session)
+
+    @staticmethod
+    def as_dict(intent) -> dict:
+        return {
+            'id': intent.id,
+            'status': intent.status,
+            'client_secret': intent.client_secret,
+            'amount': intent.amount,
+            'currency': intent.currency,
+            'metadata': dict(intent.metadata or {}),
+        }
+
+    @staticmethod
+    def request(method, *args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except (stripe.error.APIConnectionError, stripe.error.RateLimitError) as e:
+            raise GatewayUnavailable(str(e)) from e
+        except stripe.error.APIError as e:
+            if (e.http_status or 500) >= 500:
+                raise GatewayUnavailable(str(e)) from e
+            raise PaymentGatewayError(str(e)) from e
+        except stripe.error.StripeError as e:
+            raise PaymentGatewayError(str(e)) from e
+
+    def _create_intent(self, amount, currency, metadata, idempotency_key):
+        return self.as_dict(self.request(
+            stripe.PaymentIntent.create,
+            amount=amount, currency=currency, metadata=metadata, idempotency_key=idempotency_key
+        ))
+
+    def _retrieve_intent(self, intent_id):
+        return self.as_dict(self.request(stripe.PaymentIntent.retrieve, intent_id))
+
+    def parse_event(self, payload, signature):
+        try:
+            event = stripe.Webhook.construct_event(payload, signature, settings.STRIPE_WEBHOOK_SECRET)
+        except (ValueError, stripe.error.SignatureVerificationError) as e:
+            raise PaymentGatewayError(f"Webhook invalide: {e}") from e
+        intent = event.data.object
+        return {
+            'id': event.id,
+            'type': event.type,
+            'intent': self.as_dict(intent) if intent.get('object') == 'payment_intent' else None,
+        }
+
+class FakeGateway(PaymentGateway):
+    """Passerelle en mémoire du processus, pour les tests et les bancs de charge.
+
+    ``latency`` simule le temps de réponse, ``failure_rate`` la part
+    d'appels en échec transitoire. ``succeed()`` simule le paiement du
+    client et retourne l'événement webhook correspondant, signé par ``sign()``.
+    """
+
+    RETRIES = 2
+    BACKOFF = 0
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed=None):
+        super().__init__()
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.random = random.Random(seed)
+        self.intents = {}
+        self.keys = {}
+        self.lock = threading.Lock()
+
+    def simulate_network(self):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            raise GatewayUnavailable('Panne simulée')
+
+    def _create_intent(self, amount, currency, metadata, idempotency_key):
+        self.simulate_network()
+        with self.lock:
+            if idempotency_key in self.keys:
+                return dict(self.intents[self.keys[idempotency_key]])
+            intent_id = f'pi_fake_{uuid.uuid4().hex[:16]}'
+            self.intents[intent_id] = {
+                'id': intent_id,
+                'status': 'requires_payment_method',
+                'client_secret': f'{intent_id}_secret_{uuid.uuid4().hex[:8]}',
+                'amount': amount,
+                'currency': currency,
+                'metadata': dict(metadata),
+            }
+            if idempotency_key:
+                self.keys[idempotency_key] = intent_id
+            return dict(self.intents[intent_id])
+
+    def _retrieve_intent(self, intent_id):
+        self.simulate_network()
+        with self.lock:
+            if intent_id not in self.intents:
+                raise PaymentGatewayError(f"Intention inconnue: {intent_id}")
+            return dict(self.intents[intent_id])
+
+    def succeed(self, intent_id: str) -> dict:
+        with self.lock:
+            self.intents[intent_id]['status'] = 'succeeded'
+            intent = dict(self.intents[intent_id])
+        return {'id': f'evt_fake_{uuid.uuid4().hex[:16]}', 'type': 'payment_intent.succeeded', 'intent': intent}
+
+    @staticmethod
+    def sign(payload: bytes) -> str:
+        return hmac.new(settings.SECRET_KEY.encode(), payload, hashlib.sha256).hexdigest()
+
+    def parse_event(self, payload, signature):
+        if not hmac.compare_digest(self.sign(payload), signature or ''):
+            raise PaymentGatewayError('Webhook invalide: signature')
+        try:
+            return json.loads(payload)
+        except ValueError as e:
+            raise PaymentGatewayError(f"Webhook invalide: {e}") from e
+
+GATEWAYS = {'stripe': StripeGateway, 'fake': FakeGateway}
+_gateways = {}
+
+def get_gateway() -> PaymentGateway:
+    """Passerelle de settings.PAYMENT_GATEWAY, une instance (pool, disjoncteur) par processus"""
+    name = getattr(settings, 'PAYMENT_GATEWAY', 'stripe')
+    if name not in _gateways:
+        _gateways[name] = GATEWAYS[name]()
+    return _gateways[name]
+
+class PaymentService:
+    """Paiement d'une commande, quel que soit le canal de confirmation (client ou webhook)"""
+
+    @staticmethod
+    def create_intent(order, idempotency_key: str = None) -> dict:
+        intent = get_gateway().create_intent(
+            amount=int(order.total_amount * 100),  # en centimes
+            currency='eur',
+            metadata={'order_id': order.id},
+            idempotency_key=idempotency_key
+        )
+        Order.objects.filter(pk=order.pk).update(stripe_payment_intent_id=intent['id'], updated_at=timezone.now())
+        order.stripe_payment_intent_id = intent['id']
+        return intent
+
+    @staticmethod
+    def mark_paid_many(orders) -> list:
+        """Convertir les réservations et confirmer des commandes, une seule fois chacune.
+
+        Les commandes encore impayées sont verrouillées puis passées à payées
+        en un UPDATE : un webhook et un appel client simultanés ne
+        confirment pas deux fois. Le paiement est toujours enregistré : une
+        commande dont le stock a été vendu entre-temps passe en rupture
+        (status='backorder'), à réapprovisionner ou rembourser, sans bloquer
+        les autres commandes du lot.
+        """
+        with transaction.atomic():
+            pending = list(
+                Order.objects.filter(pk__in=[order.pk for order in orders]).exclude(payment_status='paid')
+                .select_for_update().order_by('pk')
+            )
+            if not pending:
+                return []
+            Order.objects.filter(pk__in=[order.pk for order in pending]).update(
+                payment_status='paid', status='confirmed', updated_at=timezone.now()
+            )
+            backordered = {order.pk for order in StockReservationService.convert_many(pending)}
+            if backordered:
+                Order.objects.filter(pk__in=backordered).update(status='backorder')
+                logger.warning(f"Paid orders backordered, stock sold elsewhere: {sorted(backordered)}")
+            orders_paid.send(sender=Order, order_ids=[order.pk for order in pending])
+        confirmed = {order.pk for order in pending}
+        for order in orders:
+            order.payment_status = 'paid'
+            if order.pk in confirmed:
+                order.status = 'backorder' if order.pk in backordered else 'confirmed'
+        return pending
+
+    @classmethod
+    def mark_paid(cls, order) -> bool:
+        return bool(cls.mark_paid_many([order]))
+
+    @staticmethod
+    def confirm(order) -> str:
+        """Statut du paiement lu en base, sans appel à la passerelle.
+
+        La commande est payée par le webhook, ou à défaut par reconcile() ;
+        le client rappelle tant que le paiement n'est pas confirmé.
+        """
+        payment_status = Order.objects.filter(pk=order.pk).values_list('payment_status', flat=True).first()
+        return 'succeeded' if payment_status == 'paid' else 'processing'
+
+    @classmethod
+    def reconcile(cls, orders) -> int:
+        """Rattraper les paiements dont le webhook n'est pas arrivé (tâche planifiée).
+
+        La passerelle est interrogée hors requête HTTP, avec reprises ; les
+        intentions réussies confirment leurs commandes par lot. Retourne le
+        nombre de commandes confirmées.
+        """
+        gateway = get_gateway()
+        succeeded = []
+        for order in orders:
+            try:
+                intent = gateway.retrieve_intent(order.stripe_payment_intent_id, retries=gateway.RETRIES)
+            except PaymentGatewayError as e:
+                logger.warning(f"Payment reconciliation failed for order {order.pk}: {e}")
+                continue
+            if intent['status'] == 'succeeded':
+                succeeded.append(order)
+        return len(cls.mark_paid_many(succeeded)) if succeeded else 0
+
+    @classmethod
+    def apply_events(cls, events) -> int:
+        """Événements de la passerelle : payment_intent.succeeded confirme la commande.
+
+        Commandes retrouvées en une requête IN et confirmées par lot ;
+        retourne le nombre de commandes confirmées.
+        """
+        intents = {
+            event['intent']['id']: event['id']
+            for event in events
+            if event['type'] == 'payment_intent.succeeded' and event.get('intent')
+        }
+        if not intents:
+            return 0
+        orders = list(Order.objects.filter(stripe_payment_intent_id__in=intents))
+        unknown = set(intents) - {order.stripe_payment_intent_id for order in orders}
+        if unknown:
+            logger.warning(f"Payment events for unknown intents: {sorted(unknown)}")
+        return len(cls.mark_paid_many(orders)) if orders else 0
+
+    @classmethod
+    def apply_event(cls, event: dict) -> bool:
+        return bool(cls.apply_events([event]))
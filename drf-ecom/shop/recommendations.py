@@ -0,0 +1,181 @@
+"""
+Recommandations « achetés ensemble » calculées hors ligne à partir des commandes
+"""
+import heapq
+import time
+import logging
+from collections import Counter, defaultdict
+from functools import reduce
+from operator import or_
+from django.db import transaction
+from django.db.models import Max, Q
+from .models import Order, OrderItem, Product, ProductCoPurchase, ProductCoPurchaseBasket, ProductRecommendation
+
+logger = logging.getLogger(__name__)
+
+class CoPurchaseRecommender:
+    """Construit la matrice creuse des achats conjoints et le top-N par produit.
+
+    La matrice est un dictionnaire de Counter (seules les cellules non nulles
+    existent) alimenté en un seul parcours des lignes de commande triées par
+    commande. Elle est persistée dans ProductCoPurchase pour permettre les
+    mises à jour incrémentales, avec le panier de chaque commande comptée
+    (ProductCoPurchaseBasket). Un passage incrémental compare les deux
+    ensembles : les commandes devenues comptables (payées, non annulées),
+    quel que soit leur ordre de création ou de validation, sont ajoutées ;
+    celles qui ne le sont plus (annulées, remboursées, supprimées) sont
+    décomptées. Seuls les produits touchés sont recalculés.
+    """
+
+    TOP_N = 10
+    # Au-delà, un panier (commande B2B) coûte O(n²) paires pour un signal faible
+    MAX_BASKET_SIZE = 50
+    CHUNK_SIZE = 5000
+    BATCH_SIZE = 1000
+
+    def __init__(self, top_n: int = None, max_basket_size: int = None):
+        self.top_n = top_n or self.TOP_N
+        self.max_basket_size = max_basket_size or self.MAX_BASKET_SIZE
+        self.last_order_id = 0
+
+    @staticmethod
+    def counted_orders():
+        """Commandes dont le panier compte dans la matrice"""
+        return Order.objects.filter(payment_status='paid').exclude(status='cancelled')
+
+    # ---- Lecture des paniers ----
+
+    def iter_baskets(self, orders):
+        """(order_id, ensemble de product_id) des commandes de orders, par commande"""
+        rows = (
+            OrderItem.objects
+            .filter(order__in=orders)
+            .order_by('order_id')
+            .values_list('order_id', 'product_id')
+            .iterator(chunk_size=self.CHUNK_SIZE)
+        )
+
+        current, basket = None, set()
+        for order_id, product_id in rows:
+            if order_id != current:
+                if current is not None:
+                    yield current, basket
+                current, basket = order_id, set()
+            basket.add(product_id)
+        if current is not None:
+            yield current, basket
+
+    def record_baskets(self, baskets):
+        """Enregistrer les paniers comptés au fil du parcours, par lots"""
+        pending = []
+        for order_id, basket in baskets:
+            pending.append(ProductCoPurchaseBasket(order_id=order_id, product_ids=sorted(basket)))
+            if len(pending) >= self.BATCH_SIZE:
+                ProductCoPurchaseBasket.objects.bulk_create(pending)
+                pending = []
+            self.last_order_id = max(self.last_order_id, order_id)
+            yield basket
+        ProductCoPurchaseBasket.objects.bulk_create(pending)
+
+    def count_pairs(self, baskets, matrix=None, sign: int = 1):
+        """Matrice creuse {produit: Counter({produit lié: nb de commandes})}, sign=-1 pour décompter"""
+        matrix = defaultdict(Counter) if matrix is None else matrix
+        for basket in baskets:
+            if len(basket) < 2 or len(basket) > self.max_basket_size:
+                continue
+            for product_id in basket:
+                row = matrix[product_id]
+                for related_id in basket:
+                    if related_id != product_id:
+                        row[related_id] += sign
+        return matrix
+
+    def top_related(self, row: Counter):
+        """Top-N d'une ligne, égalités départagées par id pour un résultat stable"""
+        best = heapq.nsmallest(self.top_n, row.items(), key=lambda item: (-item[1], item[0]))
+        return [related_id for related_id, _ in best]
+
+    # ---- Persistance ----
+
+    def run(self, full: bool = False):
+        """Lancer un passage (complet ou incrémental) et retourner les statistiques"""
+        start = time.time()
+
+        with transaction.atomic():
+            if full:
+                ProductCoPurchase.objects.all().delete()
+                ProductRecommendation.objects.all().delete()
+                ProductCoPurchaseBasket.objects.all().delete()
+                self.last_order_id = 0
+            else:
+                self.last_order_id = ProductRecommendation.objects.aggregate(last=Max('last_order_id'))['last'] or 0
+
+            counted = self.counted_orders()
+            # Sortis des commandes comptées depuis le dernier passage : décomptés
+            gone = ProductCoPurchaseBasket.objects.exclude(order_id__in=counted.values('pk'))
+            removed = list(gone.values_list('order_id', 'product_ids'))
+            gone.delete()
+            delta = self.count_pairs((set(product_ids) for _, product_ids in removed), sign=-1)
+
+            new_orders = counted.exclude(pk__in=ProductCoPurchaseBasket.objects.values('order_id'))
+            added = 0
+            for basket in self.record_baskets(self.iter_baskets(new_orders)):
+                added += 1
+                self.count_pairs([basket], matrix=delta)
+
+            # Un panier décompté peut citer un produit supprimé depuis
+            product_ids = sorted(Product.objects.filter(pk__in=list(delta)).values_list('pk', flat=True))
+            for i in range(0, len(product_ids), self.BATCH_SIZE):
+                self._merge_batch(product_ids[i:i + self.BATCH_SIZE], delta, merge=not full)
+
+        stats = {
+            'orders_added': added,
+            'orders_removed': len(removed),
+            'products': len(product_ids),
+            'pairs': sum(len(row) for row in delta.values()),
+            'last_order_id': self.last_order_id,
+            'duration': time.time() - start,
+        }
+        logger.info(f"Recommendations built: {stats}")
+        return stats
+
+    def _merge_batch(self, product_ids, delta, merge: bool):
+        """Fusionner le delta avec les comptes existants et réécrire le top-N"""
+        rows = {product_id: Counter() for product_id in product_ids}
+        if merge:
+            existing = ProductCoPurchase.objects.filter(product_id__in=product_ids).values_list(
+                'product_id', 'related_id', 'count'
+            )
+            for product_id, related_id, count in existing:
+                rows[product_id][related_id] = count
+
+        pairs = []
+        emptied = defaultdict(list)
+        recommendations = []
+        for product_id in product_ids:
+            row = rows[product_id]
+            row.update(delta[product_id])
+            for related_id in delta[product_id]:
+                if row[related_id] > 0:
+                    pairs.append(ProductCoPurchase(product_id=product_id, related_id=related_id, count=row[related_id]))
+                else:
+                    emptied[product_id].append(related_id)
+            recommendations.append(ProductRecommendation(
+                product_id=product_id,
+                related_ids=self.top_related(+row),
+                last_order_id=self.last_order_id
+            ))
+
+        if emptied:
+            ProductCoPurchase.objects.filter(reduce(or_, (
+                Q(product_id=product_id, related_id__in=related_ids) for product_id, related_ids in emptied.items()
+            ))).delete()
+        ProductCoPurchase.objects.bulk_create(
+            pairs, batch_size=self.BATCH_SIZE,
+            update_conflicts=True, unique_fields=['product', 'related'], update_fields=['count']
+        )
+        ProductRecommendation.objects.bulk_create(
+            recommendations, batch_size=self.BATCH_SIZE,
+            update_conflicts=True, unique_fields=['product'],
+            update_fields=['related_ids', 'last_order_id', 'updated_at']
+        )
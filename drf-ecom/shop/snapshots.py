@@ -0,0 +1,123 @@
+"""
+Maintenance du modèle de lecture dénormalisé du catalogue (ProductSnapshot)
+"""
+import logging
+from django.core.files.storage import default_storage
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+from .models import Category, Product, ProductImage, ProductSnapshot, vat_inclusive_price
+from .images import ProductImagePipeline
+
+logger = logging.getLogger(__name__)
+
+class ProductSnapshotBuilder:
+    """Recalcule les lignes de ProductSnapshot à partir des tables normalisées.
+
+    Une requête par lot (produit + catégorie jointe + image principale en
+    sous-requête), puis un upsert groupé. Les écritures passant par
+    ``QuerySet.update()`` ne déclenchent pas les signaux : l'appelant doit
+    alors appeler ``refresh()`` lui-même.
+
+    ``updated_at`` reprend celui du produit (même valeur qu'en détail).
+    ``synced_at`` est l'instant du dernier changement du contenu de la
+    ligne : il change aussi quand seuls le stock, les images ou la
+    catégorie changent, mais pas quand une ligne est réécrite à
+    l'identique. Il sert de curseur à l'export incrémental et de
+    validateur aux requêtes conditionnelles.
+    """
+
+    BATCH_SIZE = 500
+    COLUMNS = [
+        'name', 'slug', 'sku', 'description', 'category', 'category_name', 'category_path',
+        'price', 'vat_rate', 'price_with_vat', 'stock_quantity', 'is_in_stock',
+        'is_digital', 'is_active', 'primary_image', 'primary_image_variants', 'created_at', 'updated_at',
+        'synced_at',
+    ]
+
+    @classmethod
+    def sync(cls, queryset) -> int:
+        """Réécrire les snapshots des produits d'un queryset"""
+        primary_image = ProductImage.objects.filter(product=OuterRef('pk')).order_by('-is_primary', 'pk')
+        rows = (
+            queryset.order_by('pk')
+            .annotate(
+                primary_image=Subquery(primary_image.values('image')[:1]),
+                primary_image_variants=Subquery(primary_image.values('variants')[:1]),
+                gross_price=vat_inclusive_price()
+            )
+            .values(
+                'pk', 'name', 'slug', 'sku', 'description', 'category_id', 'category__name',
+                'category__path', 'price', 'vat_rate', 'gross_price', 'stock_quantity', 'is_digital',
+                'is_active', 'primary_image', 'primary_image_variants', 'created_at', 'updated_at'
+            )
+            .iterator(chunk_size=cls.BATCH_SIZE)
+        )
+
+        now = timezone.now()
+        total = 0
+        batch = []
+        for row in rows:
+            batch.append(ProductSnapshot(
+                product_id=row['pk'],
+                name=row['name'],
+                slug=row['slug'],
+                sku=row['sku'],
+                description=row['description'],
+                category_id=row['category_id'],
+                category_name=row['category__name'],
+                category_path=row['category__path'],
+                price=row['price'],
+                vat_rate=row['vat_rate'],
+                price_with_vat=row['gross_price'],
+                stock_quantity=row['stock_quantity'],
+                is_in_stock=row['stock_quantity'] > 0,
+                is_digital=row['is_digital'],
+                is_active=row['is_active'],
+                primary_image=default_storage.url(row['primary_image']) if row['primary_image'] else '',
+                primary_image_variants=ProductImagePipeline.urls(row['primary_image_variants'] or {}),
+                created_at=row['created_at'],
+                updated_at=row['updated_at'],
+                synced_at=now,
+            ))
+            if len(batch) >= cls.BATCH_SIZE:
+                total += cls._write(batch)
+                batch = []
+        if batch:
+            total += cls._write(batch)
+        return total
+
+    @classmethod
+    def _write(cls, batch) -> int:
+        # Ligne identique à celle en base : synced_at conservé (reconstruction sans effet)
+        fields = [ProductSnapshot._meta.get_field(name).attname for name in cls.COLUMNS if name != 'synced_at']
+        current = {
+            row[0]: row[1:]
+            for row in ProductSnapshot.objects.filter(product__in=[snapshot.product_id for snapshot in batch])
+            .values_list('product_id', *fields, 'synced_at')
+        }
+        for snapshot in batch:
+            row = current.get(snapshot.product_id)
+            if row and tuple(getattr(snapshot, field) for field in fields) == row[:-1]:
+                snapshot.synced_at = row[-1]
+        ProductSnapshot.objects.bulk_create(
+            batch, update_conflicts=True, unique_fields=['product'], update_fields=cls.COLUMNS
+        )
+        return len(batch)
+
+    @classmethod
+    def refresh(cls, product_ids) -> int:
+        """Recalculer les snapshots de quelques produits"""
+        return cls.sync(Product.objects.filter(pk__in=list(product_ids)))
+
+    @classmethod
+    def refresh_category(cls, category) -> int:
+        """Recalculer les produits d'une catégorie et de ses descendants (nom ou chemin modifié)"""
+        start, end = Category.subtree_range(category.path)
+        return cls.sync(Product.objects.filter(category__path__gte=start, category__path__lt=end))
+
+    @classmethod
+    def rebuild(cls) -> int:
+        """Reconstruction complète (les snapshots orphelins disparaissent par cascade)"""
+        count = cls.sync(Product.objects.all())
+        logger.info(f"Product snapshots rebuilt: {count}")
+        return count
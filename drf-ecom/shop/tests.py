@@ -1,12 +1,73 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction
+from django.conf import settings
 from django.contrib.auth.models import User
-from rest_framework.test import APITestCase
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.text import slugify
+from rest_framework.test import APITestCase, APIRequestFactory
+from rest_framework.request import Request
 from rest_framework import status
+from rest_framework_simplejwt.tokens import RefreshToken
+from datetime import datetime, timedelta
 from decimal import Decimal
+from unittest import mock
+from PIL import Image
+import csv
+import io
+import json
+import os
+import tempfile
+import time
+from admin_dashboard.models import Invoice, INVOICE_NUMBERS
+from cache_system import CacheManager, CacheVersionStore
+from cookie_manager import CartCookies, UserPreferenceCookies
+from query_optimizer import SerializerQueryOptimizer
+from . import payments
 from .models import (
-    Category, Product, Customer, Cart, CartItem, 
-    Order, OrderItem, Wishlist, WishlistItem
+    Category, Product, ProductImage, ProductSnapshot, Customer, Cart, CartItem, 
+    Order, OrderItem, Wishlist, WishlistItem, IdempotencyRecord, PaymentEvent, ProductCoPurchase,
+    ProductRecommendation, SequenceCounter, StockMovement, StockReservation
 )
+from .cart_store import CartStore
+from .cart_sweeper import CartSweeper
+from .catalog_import import CatalogImporter, read_json
+from .facets import ProductFacets
+from .idempotency import IdempotencyConflict, IdempotencyStore
+from .payments import CircuitBreaker, FakeGateway, GatewayUnavailable, PaymentService
+from .recommendations import CoPurchaseRecommender
+from .sequences import Sequence
+from .serializers import CartSerializer
+from .snapshots import ProductSnapshotBuilder
+from .stock import InsufficientStock, StockLedger, StockReservationService, low_stock
+from .views import CategoryViewSet, ProductViewSet
+from .webhooks import PaymentEventInbox
+
+
+def create_category(name, **fields):
+    """Catégorie de test, slug tiré du nom"""
+    fields.setdefault('slug', slugify(name))
+    return Category.objects.create(name=name, **fields)
+
+
+def create_product(category, name, sku, price='10.00', **fields):
+    """Produit de test, slug tiré du nom"""
+    fields.setdefault('slug', slugify(name))
+    fields.setdefault('description', 'Test')
+    return Product.objects.create(name=name, sku=sku, price=Decimal(price), category=category, **fields)
+
+
+def create_products(category, name, sku, count, **fields):
+    """count produits « name i », SKU « sku00i »"""
+    return [create_product(category, f'{name} {i}', f'{sku}{i:03d}', **fields) for i in range(count)]
+
 
 class CustomerTestCase(APITestCase):
     def setUp(self):
@@ -72,6 +133,7 @@ class CustomerTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertIn('is_valid', response.data)
 
+
 class ProductTestCase(APITestCase):
     def setUp(self):
         self.category = Category.objects.create(
@@ -119,6 +181,7 @@ class ProductTestCase(APITestCase):
         
         self.assertEqual(product.stock_quantity, 5)
 
+
 class CartTestCase(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -190,6 +253,7 @@ class CartTestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertFalse(CartItem.objects.filter(id=cart_item.id).exists())
 
+
 class OrderTestCase(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -272,6 +336,7 @@ class OrderTestCase(APITestCase):
         
         self.assertEqual(order.status, 'processing')
 
+
 class WishlistTestCase(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -323,4 +388,1449 @@ class WishlistTestCase(APITestCase):
         }, format='json')
         
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertFalse(WishlistItem.objects.filter(id=wishlist_item.id).exists())
\ No newline at end of file
+        self.assertFalse(WishlistItem.objects.filter(id=wishlist_item.id).exists())
+
+
+class ProductSearchTestCase(APITestCase):
+    def setUp(self):
+        self.category = create_category('Electronics', description='Electronic products')
+        self.laptop = create_product(
+            self.category, 'Laptop Pro', 'LAP001', '999.00', description='Ordinateur portable professionnel'
+        )
+        self.mouse = create_product(
+            self.category, 'Souris sans fil', 'MOU001', '19.99', description='Accessoire pour laptop'
+        )
+
+    def test_search_prefix_and_ranking(self):
+        """Test recherche plein texte par préfixe, classée par pertinence"""
+        response = self.client.get('/api/shop/products/', {'search': 'lapt'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        slugs = [product['slug'] for product in response.data['results']]
+        self.assertEqual(slugs, ['laptop-pro', 'souris-sans-fil'])
+
+    def test_search_index_follows_updates(self):
+        """Test synchronisation de l'index lors des modifications"""
+        self.mouse.description = 'Accessoire sans fil'
+        self.mouse.save()
+        self.laptop.delete()
+
+        response = self.client.get('/api/shop/products/', {'search': 'laptop'})
+        self.assertEqual(response.data['count'], 0)
+
+
+class ProductFacetsTestCase(APITestCase):
+    def setUp(self):
+        # Versions mémorisées et facettes en cache survivent aux transactions de test
+        CacheManager._versions.clear()
+        cache.clear()
+        self.books = create_category('Livres')
+        self.games = create_category('Jeux')
+        for i, (category, price, stock, digital) in enumerate([
+            (self.books, '10.00', 5, False),
+            (self.books, '30.00', 0, True),
+            (self.games, '30.00', 2, False),
+            (self.games, '800.00', 1, False),
+        ]):
+            create_product(category, f'Facette {i}', f'FAC{i:03d}', price, stock_quantity=stock, is_digital=digital)
+
+    def test_facet_counts(self):
+        """Test compteurs de facettes en une seule requête"""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/shop/products/facets/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len([q for q in context.captured_queries if 'GROUP BY' in q['sql']]), 1)
+
+        facets = response.data
+        self.assertEqual(facets['total'], 4)
+        self.assertEqual({c['name']: c['count'] for c in facets['category']}, {'Livres': 2, 'Jeux': 2})
+        self.assertEqual(facets['is_digital'], {'true': 1, 'false': 3})
+        self.assertEqual(facets['in_stock'], {'true': 3, 'false': 1})
+        self.assertEqual(
+            [(b['min'], b['max'], b['count']) for b in facets['price']],
+            [(0, 25, 1), (25, 50, 2), (500, None, 1)]
+        )
+
+        response = self.client.get('/api/shop/products/', {'category': self.books.id, 'facets': 1})
+        self.assertEqual(response.data['facets']['total'], 2)
+
+    def test_facets_invalidated_on_product_change(self):
+        """Test invalidation des facettes en cache après modification d'un produit"""
+        request = Request(APIRequestFactory().get('/api/shop/products/facets/'))
+        self.assertEqual(ProductFacets.for_request(Product.objects.all(), request)['total'], 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.get(sku='FAC000').delete()
+        self.assertEqual(ProductFacets.for_request(Product.objects.all(), request)['total'], 3)
+
+    def test_version_shared_between_processes(self):
+        """Test version lue en base : un incrément d'un autre processus est vu après VERSION_TTL"""
+        version = CacheManager.get_version('facettes-test')
+        # Incrément fait par un autre worker : seul le compteur en base change
+        SequenceCounter.objects.filter(key='version:facettes-test').update(value=version + 1)
+        self.assertEqual(CacheManager.get_version('facettes-test'), version)
+        CacheManager._versions['facettes-test'] = (version, 0)
+        self.assertEqual(CacheManager.get_version('facettes-test'), version + 1)
+
+    def test_version_bumped_on_commit(self):
+        """Test version incrémentée au commit seulement, jamais pour une transaction annulée"""
+        version = CacheManager.get_version('facettes-test')
+        with self.captureOnCommitCallbacks(execute=True):
+            CacheManager.bump_version('facettes-test')
+            self.assertEqual(CacheManager.get_version('facettes-test'), version)
+        self.assertEqual(CacheManager.get_version('facettes-test'), version + 1)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            try:
+                with transaction.atomic():
+                    CacheManager.bump_version('facettes-test')
+                    raise ValueError
+            except ValueError:
+                pass
+        self.assertEqual(callbacks, [])
+
+    def test_facets_invalidated_on_reservation(self):
+        """Test facette in_stock à jour après une réservation faite par UPDATE"""
+        request = Request(APIRequestFactory().get('/api/shop/products/facets/'))
+        self.assertEqual(ProductFacets.for_request(Product.objects.all(), request)['in_stock'], {'true': 3, 'false': 1})
+        customer = Customer.objects.get(user=User.objects.create_user(username='facettes'))
+        order = Order.objects.create(
+            customer=customer, total_amount=Decimal('0'), vat_amount=Decimal('0'),
+            billing_address={}, shipping_address={}, payment_method='card'
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            StockReservationService.hold(order, [(Product.objects.get(sku='FAC003').pk, 1)])
+        self.assertEqual(ProductFacets.for_request(Product.objects.all(), request)['in_stock'], {'true': 2, 'false': 2})
+
+    def test_cache_version_store(self):
+        """Test versions dans le cache Django (cache.incr) quand aucun stockage n'est configuré"""
+        store = CacheVersionStore()
+        cache.delete(store.key('facettes-test'))
+        version = store.get('facettes-test')
+        self.assertEqual(store.get('facettes-test'), version)
+        self.assertEqual(store.bump('facettes-test'), version + 1)
+        cache.delete(store.key('facettes-test'))
+        self.assertGreater(store.bump('facettes-test'), version)
+
+
+class ConditionalGetTestCase(APITestCase):
+    def setUp(self):
+        # Appel direct des vues : le cache de réponses du middleware n'intervient pas
+        self.factory = APIRequestFactory()
+        self.category = create_category('Audio')
+        self.product = create_product(self.category, 'Casque', 'ETAG001', '80.00', stock_quantity=4)
+
+    def test_product_list_not_modified(self):
+        """Test 304 sur la liste tant que le catalogue ne change pas"""
+        view = ProductViewSet.as_view({'get': 'list'})
+        response = view(self.factory.get('/api/shop/products/'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertIn('Last-Modified', response)
+
+        with CaptureQueriesContext(connection) as context:
+            response = view(self.factory.get('/api/shop/products/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(len(context.captured_queries), 1)
+
+        # Un autre filtre est une autre ressource
+        response = view(self.factory.get('/api/shop/products/', {'search': 'casque'}, HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        # Une sortie de stock (UPDATE sans save()) change aussi l'ETag
+        StockReservationService.take({self.product.pk: 1})
+        ProductSnapshotBuilder.refresh([self.product.pk])
+        response = view(self.factory.get('/api/shop/products/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_product_detail_if_modified_since(self):
+        """Test 304 sur le détail avec If-Modified-Since"""
+        view = ProductViewSet.as_view({'get': 'retrieve'})
+        response = view(self.factory.get('/api/shop/products/casque/'), slug='casque')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = view(
+            self.factory.get('/api/shop/products/casque/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']),
+            slug='casque'
+        )
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = view(self.factory.get('/api/shop/products/inconnu/'), slug='inconnu')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_category_version_etag(self):
+        """Test ETag des catégories dérivé du compteur de version"""
+        view = CategoryViewSet.as_view({'get': 'tree'})
+        etag = view(self.factory.get('/api/shop/categories/tree/'))['ETag']
+        response = view(self.factory.get('/api/shop/categories/tree/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Hi-Fi'
+            self.category.save()
+        response = view(self.factory.get('/api/shop/categories/tree/', HTTP_IF_NONE_MATCH=etag))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_middleware_cache_follows_version(self):
+        """Test cache de réponses du middleware : une modification n'est jamais masquée"""
+        cache.clear()
+        first = self.client.get('/api/shop/categories/')
+        self.assertEqual(self.client.get('/api/shop/categories/')['ETag'], first['ETag'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Hi-Fi'
+            self.category.save()
+        response = self.client.get('/api/shop/categories/', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertIn('Hi-Fi', response.content.decode())
+
+
+class ProductSnapshotTestCase(APITestCase):
+    def setUp(self):
+        self.parent = create_category('Maison')
+        self.category = create_category('Cuisine', parent=self.parent)
+        self.product = create_product(
+            self.category, 'Bouilloire', 'BOU001', '40.00', description='Inox', stock_quantity=3
+        )
+
+    def test_list_reads_snapshot_without_join(self):
+        """Test liste résumée (?summary=1) servie par le modèle de lecture, sans jointure"""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/shop/products/', {'descendants': 'maison', 'summary': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([q for q in context.captured_queries if 'JOIN' in q['sql']])
+
+        product = response.data['results'][0]
+        self.assertEqual(product['id'], self.product.id)
+        self.assertEqual(product['category_name'], 'Cuisine')
+        self.assertEqual(product['price_with_vat'], '48.40')
+        self.assertTrue(product['is_in_stock'])
+
+        # Sans le paramètre, la liste garde la représentation complète
+        product = self.client.get('/api/shop/products/', {'descendants': 'maison'}).data['results'][0]
+        self.assertEqual(product['images'], [])
+        self.assertEqual((product['category'], product['min_stock_level']), (self.category.id, 5))
+        self.assertNotIn('primary_image', product)
+
+    def test_price_with_vat_filter(self):
+        """Test fourchette de prix TVAC sur la colonne stockée"""
+        create_product(self.category, 'Grille-pain', 'GRI001', '19.99', description='Inox')
+        self.assertEqual(Product.objects.get(sku='GRI001').price_with_vat, Decimal('24.19'))
+        self.product.price = Decimal('20.00')
+        self.product.save()
+        self.assertEqual(self.product.price_with_vat, Decimal('24.20'))
+        self.product.price = Decimal('40.00')
+        self.product.save(update_fields=['price'])
+        self.assertEqual(self.product.price_with_vat, Decimal('48.40'))
+
+        response = self.client.get('/api/shop/products/', {'min_price': '25', 'max_price': '48.40'})
+        self.assertEqual([p['slug'] for p in response.data['results']], ['bouilloire'])
+
+        response = self.client.get('/api/shop/products/', {'ordering': 'price_with_vat'})
+        self.assertEqual([p['slug'] for p in response.data['results']], ['grille-pain', 'bouilloire'])
+
+    def test_snapshot_follows_changes(self):
+        """Test mise à jour du modèle de lecture par les signaux"""
+        self.product.stock_quantity = 0
+        self.product.price = Decimal('50.00')
+        self.product.save()
+        self.category.name = 'Cuisson'
+        self.category.save()
+        other = create_category('Jardin')
+        self.parent.parent = other
+        self.parent.save()
+
+        snapshot = ProductSnapshot.objects.get(pk=self.product.pk)
+        self.assertFalse(snapshot.is_in_stock)
+        self.assertEqual(snapshot.price_with_vat, Decimal('60.50'))
+        self.assertEqual(snapshot.category_name, 'Cuisson')
+        self.assertEqual(snapshot.category_path, Category.objects.get(pk=self.category.pk).path)
+
+        self.product.delete()
+        self.assertFalse(ProductSnapshot.objects.exists())
+
+
+class ProductImagePipelineTestCase(APITestCase):
+    def setUp(self):
+        media = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(self.settings(MEDIA_ROOT=media))
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (2000, 1000), (200, 30, 30)).save(buffer, 'PNG')
+        self.product = create_product(create_category('Photo'), 'Lampe', 'LAM001')
+        self.image = ProductImage.objects.create(
+            product=self.product, is_primary=True,
+            image=SimpleUploadedFile('lampe.png', buffer.getvalue(), content_type='image/png')
+        )
+
+    def test_backfill_generates_variants(self):
+        """Test génération parallèle des déclinaisons et exposition des URLs"""
+        call_command('build_image_variants', workers=1, stdout=io.StringIO())
+        self.image.refresh_from_db()
+
+        with default_storage.open(self.image.variants['card']['webp']) as handle:
+            self.assertEqual(Image.open(handle).size, (480, 240))
+        with default_storage.open(self.image.variants['thumbnail']['jpg']) as handle:
+            self.assertEqual(Image.open(handle).format, 'JPEG')
+
+        response = self.client.get(f'/api/shop/products/{self.product.slug}/')
+        variants = response.data['images'][0]['variants']
+        self.assertEqual(set(variants), {'thumbnail', 'card', 'zoom'})
+        self.assertTrue(variants['zoom']['webp'].endswith('/zoom.webp'))
+
+        snapshot = ProductSnapshot.objects.get(pk=self.product.pk)
+        self.assertTrue(snapshot.primary_image_variants['card']['jpg'].endswith('/card.jpg'))
+
+
+class CatalogExportTestCase(APITestCase):
+    def setUp(self):
+        self.products = create_products(
+            create_category('Export'), 'Export', 'EXP', 3, description='Ligne 1\nLigne 2, "citée"'
+        )
+
+    def test_ndjson_export(self):
+        """Test export NDJSON en flux"""
+        response = self.client.get('/api/shop/products/export/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertTrue(response['Content-Type'].startswith('application/x-ndjson'))
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        rows = [json.loads(line) for line in lines]
+        self.assertEqual([row['sku'] for row in rows], ['EXP000', 'EXP001', 'EXP002'])
+        self.assertEqual(rows[0]['price_with_vat'], '12.10')
+
+    def test_csv_export_updated_since(self):
+        """Test export CSV limité aux produits modifiés depuis une date"""
+        since = Product.objects.get(sku='EXP002').updated_at
+        self.products[0].is_active = False
+        self.products[0].save()
+
+        params = {'format': 'csv', 'updated_since': since.isoformat()}
+        response = self.client.get('/api/shop/products/export/', params)
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        # Anonyme : les produits désactivés ne sont pas exposés
+        self.assertEqual([row['sku'] for row in rows], ['EXP002'])
+
+        self.client.force_authenticate(user=User.objects.create_user(username='partenaire', is_staff=True))
+        response = self.client.get('/api/shop/products/export/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([(row['sku'], row['is_active']) for row in rows], [('EXP002', 'True'), ('EXP000', 'False')])
+        self.assertEqual(rows[0]['description'], 'Ligne 1\nLigne 2, "citée"')
+
+        response = self.client.get('/api/shop/products/export/', {'updated_since': 'hier'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_reserved_stock_exported(self):
+        """Test export incrémental d'un produit dont seul le stock a changé"""
+        product = self.products[1]
+        product.stock_quantity = 5
+        product.save()
+        since = self.client.get('/api/shop/products/export/')['X-Export-Started-At']
+        customer = Customer.objects.get(user=User.objects.create_user(username='export'))
+        order = Order.objects.create(
+            customer=customer, total_amount=Decimal('0'), vat_amount=Decimal('0'),
+            billing_address={}, shipping_address={}, payment_method='card'
+        )
+        StockReservationService.hold(order, [(product.pk, 2)])
+
+        response = self.client.get('/api/shop/products/export/', {'updated_since': since})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([(row['sku'], row['stock_quantity']) for row in rows], [('EXP001', 3)])
+
+    def test_rebuild_does_not_mark_products_updated(self):
+        """Test reconstruction du modèle de lecture : l'export incrémental reste vide"""
+        since = self.client.get('/api/shop/products/export/')['X-Export-Started-At']
+        ProductSnapshotBuilder.rebuild()
+        response = self.client.get('/api/shop/products/export/', {'updated_since': since})
+        self.assertEqual(b''.join(response.streaming_content), b'')
+
+        listed = self.client.get('/api/shop/products/', {'summary': 1}).data['results'][0]
+        detail = self.client.get(f"/api/shop/products/{listed['slug']}/").data
+        self.assertEqual(listed['updated_at'], Product.objects.get(pk=listed['id']).updated_at)
+        self.assertEqual(parse_datetime(detail['updated_at']), listed['updated_at'])
+
+
+class CatalogImportTestCase(APITestCase):
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.category = create_category('Fournisseur')
+        create_product(
+            self.category, 'Ancien nom', 'SUP001', '5.00', slug='ancien', description='Existant', stock_quantity=7
+        )
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as handle:
+            handle.write(content)
+        return path
+
+    def test_csv_upsert_in_batches(self):
+        """Test import CSV : mise à jour sur sku, création et rejets"""
+        path = self.write('feed.csv', (
+            'sku,name,price,category,is_digital\n'
+            'SUP001,Nouveau nom,"6,50",fournisseur,non\n'
+            'SUP002,Câble,3.20,fournisseur,1\n'
+            'SUP003,Inconnu,1.00,absente,0\n'
+            'SUP004,Prise,abc,fournisseur,0\n'
+        ))
+        out = io.StringIO()
+        call_command('import_catalog', path, batch_size=1, stdout=out, stderr=io.StringIO())
+
+        updated = Product.objects.get(sku='SUP001')
+        self.assertEqual((updated.name, updated.price, updated.slug), ('Nouveau nom', Decimal('6.50'), 'ancien'))
+        self.assertEqual(updated.stock_quantity, 7)
+        self.assertTrue(Product.objects.get(sku='SUP002').is_digital)
+        self.assertFalse(Product.objects.filter(sku__in=['SUP003', 'SUP004']).exists())
+        self.assertEqual(ProductSnapshot.objects.get(sku='SUP002').price, Decimal('3.20'))
+        self.assertIn('1 créés, 1 mis à jour, 2 rejetés', out.getvalue())
+        self.assertEqual(out.getvalue().count('📦 lot'), 2)
+
+        response = self.client.get('/api/shop/products/', {'search': 'câble'})
+        self.assertEqual([p['sku'] for p in response.data['results']], ['SUP002'])
+
+    def test_slug_conflicts(self):
+        """Test noms longs identiques : sku conservé dans le slug, conflit rejeté ligne par ligne"""
+        name = 'Adaptateur secteur universel pour ordinateur portable'
+        stats = CatalogImporter().run([
+            {'sku': 'LONG-001', 'name': name, 'price': '9', 'category': 'fournisseur'},
+            {'sku': 'LONG-002', 'name': name, 'price': '9', 'category': 'fournisseur'},
+            {'sku': 'DUP-001', 'name': 'Doublon', 'slug': 'ancien', 'price': '1', 'category': 'fournisseur'},
+        ])
+        self.assertEqual((stats['created'], stats['rejected']), (2, 1))
+        slugs = list(Product.objects.filter(sku__startswith='LONG').order_by('sku').values_list('slug', flat=True))
+        self.assertEqual([slug[-8:] for slug in slugs], ['long-001', 'long-002'])
+        self.assertTrue(all(len(slug) <= 50 for slug in slugs))
+        self.assertFalse(Product.objects.filter(sku='DUP-001').exists())
+
+    def test_json_array_stream(self):
+        """Test lecture en flux d'un tableau JSON"""
+        path = self.write('feed.json', '[{"sku": "J1", "name": "Un", "price": 1, "category": "fournisseur"},\n'
+                                       ' {"sku": "J2", "name": "Deux", "price": "2.5", "category": "fournisseur"}]')
+        with open(path, encoding='utf-8') as stream:
+            stats = CatalogImporter().run(read_json(stream, buffer_size=8))
+        self.assertEqual(stats['created'], 2)
+        self.assertEqual(Product.objects.get(sku='J2').price, Decimal('2.50'))
+
+
+class StockReservationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='stock', email='stock@example.com')
+        self.customer = Customer.objects.get(user=self.user)
+        category = create_category('Stock')
+        self.phone = create_product(category, 'Téléphone', 'STK001', '100.00', stock_quantity=3)
+        self.case = create_product(category, 'Coque', 'STK002', stock_quantity=10)
+
+    def create_order(self):
+        return Order.objects.create(
+            customer=self.customer, total_amount=Decimal('0'), vat_amount=Decimal('0'),
+            billing_address={}, shipping_address={}, payment_method='card'
+        )
+
+    def stock(self, product):
+        return Product.objects.values_list('stock_quantity', flat=True).get(pk=product.pk)
+
+    def test_hold_is_all_or_nothing(self):
+        """Test réservation conditionnelle de tout le panier, sans survente"""
+        StockReservationService.hold(self.create_order(), [(self.phone.id, 2), (self.case.id, 1)])
+        self.assertEqual((self.stock(self.phone), self.stock(self.case)), (1, 9))
+
+        with self.assertRaises(InsufficientStock) as context:
+            StockReservationService.hold(self.create_order(), [(self.case.id, 5), (self.phone.id, 2)])
+        self.assertEqual(context.exception.product_ids, [self.phone.id])
+        self.assertEqual((self.stock(self.phone), self.stock(self.case)), (1, 9))
+        self.assertEqual(ProductSnapshot.objects.get(pk=self.case.pk).stock_quantity, 9)
+
+    def test_convert_and_sweep(self):
+        """Test conversion au paiement et libération des réservations expirées"""
+        paid, abandoned = self.create_order(), self.create_order()
+        StockReservationService.hold(paid, [(self.phone.id, 1)])
+        StockReservationService.hold(abandoned, [(self.phone.id, 2), (self.case.id, 4)])
+        StockReservationService.convert(paid)
+        self.assertEqual(self.stock(self.phone), 0)
+
+        released = StockReservationService.release_expired(now=timezone.now() + timedelta(hours=1))
+        self.assertEqual(released, 2)
+        self.assertEqual((self.stock(self.phone), self.stock(self.case)), (2, 10))
+        self.assertEqual(StockReservation.objects.get(order=paid).status, 'converted')
+        self.assertEqual(StockReservationService.release_expired(now=timezone.now() + timedelta(hours=1)), 0)
+
+        # Paiement après expiration : le stock est repris s'il est encore disponible
+        StockReservationService.convert(abandoned)
+        self.assertEqual((self.stock(self.phone), self.stock(self.case)), (0, 6))
+
+
+class StockLedgerTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='ops', email='ops@example.com', is_staff=True)
+        self.customer = Customer.objects.get(user=self.user)
+        category = create_category('Réassort')
+        self.product = create_product(category, 'Cartouche', 'LOW001', '5.00', stock_quantity=6, min_stock_level=5)
+        create_product(category, 'Papier', 'LOW002', '5.00', stock_quantity=50, min_stock_level=5)
+
+    def test_ledger_balances_and_alert(self):
+        """Test journal des mouvements, soldes recalculés et alerte de seuil"""
+        alerts = []
+        handler = lambda sender, product_ids, **kwargs: alerts.append(product_ids)
+        low_stock.connect(handler)
+        self.addCleanup(low_stock.disconnect, handler)
+
+        order = Order.objects.create(
+            customer=self.customer, total_amount=Decimal('0'), vat_amount=Decimal('0'),
+            billing_address={}, shipping_address={}, payment_method='card'
+        )
+        StockReservationService.hold(order, [(self.product.id, 2)])
+        self.assertEqual(alerts, [[self.product.id]])
+
+        self.product.refresh_from_db()
+        self.product.stock_quantity += 10
+        self.product.save()
+
+        movements = StockMovement.objects.filter(product=self.product).order_by('id')
+        self.assertEqual([(m.reason, m.quantity) for m in movements], [('adjustment', 6), ('reservation', -2), ('adjustment', 10)])
+
+        StockLedger.rebuild_balances()
+        self.assertEqual([m.balance for m in movements.all()], [6, 4, 14])
+        with self.assertRaises(ValueError):
+            movements.first().save()
+
+    def test_low_stock_endpoint(self):
+        """Test liste de réassort servie par l'index partiel"""
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=2)
+
+        self.assertEqual(self.client.get('/api/shop/products/low_stock/').status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.force_authenticate(user=self.user)
+        response = self.client.get('/api/shop/products/low_stock/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(p['sku'], p['shortfall']) for p in response.data['results']], [('LOW001', 3)])
+
+        plan = Product.objects.filter(Product.LOW_STOCK).order_by('stock_quantity', 'id').explain()
+        self.assertIn('product_low_stock_idx', plan)
+
+    def test_low_stock_not_cached_for_anonymous(self):
+        """Test liste de réassort : jamais resservie depuis le cache, pagination par curseur"""
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=2)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        response = self.client.get('/api/shop/products/low_stock/', {'pagination': 'cursor'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([p['sku'] for p in response.data['results']], ['LOW001'])
+
+        self.client.credentials()
+        response = self.client.get('/api/shop/products/low_stock/', {'pagination': 'cursor'})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class ProductPaginationTestCase(APITestCase):
+    def setUp(self):
+        self.category = create_category('Books', description='Books')
+        create_products(self.category, 'Book', 'BOOK', 5, description='Paperback')
+
+    def test_cursor_pagination_walks_all_pages(self):
+        """Test pagination par curseur (created_at, id) sans doublons"""
+        response = self.client.get('/api/shop/products/', {'pagination': 'cursor', 'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertIsNone(response.data['previous'])
+
+        slugs = [product['slug'] for product in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            slugs += [product['slug'] for product in response.data['results']]
+
+        self.assertEqual(slugs, [f'book-{i}' for i in reversed(range(5))])
+
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([p['slug'] for p in response.data['results']], ['book-2', 'book-1'])
+
+    def test_estimated_count(self):
+        """Test comptage estimé en mode curseur"""
+        response = self.client.get('/api/shop/products/', {'pagination': 'cursor', 'count': 'estimated'})
+        self.assertEqual(response.data['count'], 5)
+
+
+class CategoryTreeTestCase(APITestCase):
+    def setUp(self):
+        self.root = create_category('Maison')
+        self.kitchen = create_category('Cuisine', parent=self.root)
+        self.knives = create_category('Couteaux', parent=self.kitchen)
+        self.garden = create_category('Jardin')
+
+        for category in (self.root, self.kitchen, self.knives, self.garden):
+            create_product(category, f'Produit {category.name}', f'SKU-{category.slug}')
+
+    def test_materialized_path(self):
+        """Test chemin matérialisé et sous-arbre"""
+        self.knives.refresh_from_db()
+        self.assertEqual(self.knives.depth, 2)
+        self.assertTrue(self.knives.path.startswith(self.kitchen.path))
+        self.assertEqual(
+            set(self.root.get_descendants().values_list('slug', flat=True)),
+            {'maison', 'cuisine', 'couteaux'}
+        )
+
+    def test_move_subtree(self):
+        """Test déplacement d'une branche sous une autre racine"""
+        self.kitchen.parent = self.garden
+        self.kitchen.save()
+
+        self.knives.refresh_from_db()
+        self.assertEqual(self.knives.path, self.garden.path + Category.path_segment(self.kitchen.pk) + Category.path_segment(self.knives.pk))
+        self.assertEqual(self.knives.depth, 2)
+
+        with self.assertRaises(ValueError):
+            self.garden.parent = self.knives
+            self.garden.save()
+
+    def test_descendants_filter(self):
+        """Test filtre des produits d'une sous-arborescence"""
+        response = self.client.get('/api/shop/products/', {'descendants': 'cuisine'})
+        slugs = {product['slug'] for product in response.data['results']}
+        self.assertEqual(slugs, {'produit-cuisine', 'produit-couteaux'})
+
+    def test_tree_endpoint(self):
+        """Test arborescence imbriquée pour le menu"""
+        response = self.client.get('/api/shop/categories/tree/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        roots = {node['slug']: node for node in response.data}
+        self.assertEqual(set(roots), {'maison', 'jardin'})
+        self.assertEqual(roots['maison']['children'][0]['children'][0]['slug'], 'couteaux')
+
+
+class RecommendationTestCase(APITestCase):
+    def setUp(self):
+        user = User.objects.create_user(username='buyer', email='buyer@example.com')
+        self.customer = Customer.objects.get(user=user)
+        self.category = create_category('Sport')
+        self.products = create_products(self.category, 'Article', 'ART', 4, price='5.00')
+
+    def create_order(self, *products, payment_status='paid'):
+        order = Order.objects.create(
+            customer=self.customer,
+            total_amount=Decimal('0'),
+            vat_amount=Decimal('0'),
+            billing_address={},
+            shipping_address={},
+            payment_method='card',
+            payment_status=payment_status
+        )
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=product.price, vat_rate=Decimal('21'))
+        return order
+
+    def test_incremental_co_purchase(self):
+        """Test matrice d'achats conjoints et mise à jour incrémentale"""
+        a, b, c, d = self.products
+        self.create_order(a, b)
+        self.create_order(a, c)
+        self.create_order(a, c)
+        CoPurchaseRecommender().run()
+
+        self.assertEqual(ProductRecommendation.objects.get(product=a).related_ids, [c.id, b.id])
+
+        self.create_order(a, b, d)
+        self.create_order(a, b)
+        stats = CoPurchaseRecommender().run()
+
+        self.assertEqual(stats['products'], 3)
+        self.assertEqual(ProductCoPurchase.objects.get(product=a, related=b).count, 3)
+        self.assertEqual(ProductRecommendation.objects.get(product=a).related_ids, [b.id, c.id, d.id])
+
+        response = self.client.get(f'/api/shop/products/{a.slug}/related_products/')
+        self.assertEqual([p['id'] for p in response.data], [b.id, c.id, d.id])
+
+    def test_late_payment_and_cancellation(self):
+        """Test commande payée après une commande plus récente comptée, commande annulée décomptée"""
+        a, b, c, _ = self.products
+        early = self.create_order(a, b, payment_status='pending')
+        self.create_order(a, c)
+        self.create_order(a, c)
+        CoPurchaseRecommender().run()
+        self.assertFalse(ProductCoPurchase.objects.filter(product=a, related=b).exists())
+
+        Order.objects.filter(pk=early.pk).update(payment_status='paid')
+        stats = CoPurchaseRecommender().run()
+        self.assertEqual((stats['orders_added'], stats['orders_removed']), (1, 0))
+        self.assertEqual(ProductCoPurchase.objects.get(product=a, related=b).count, 1)
+
+        Order.objects.filter(items__product=c).update(status='cancelled')
+        stats = CoPurchaseRecommender().run()
+        self.assertEqual(stats['orders_removed'], 2)
+        self.assertFalse(ProductCoPurchase.objects.filter(product=a, related=c).exists())
+        self.assertEqual(ProductRecommendation.objects.get(product=a).related_ids, [b.id])
+        self.assertEqual(ProductRecommendation.objects.get(product=c).related_ids, [])
+        self.assertEqual(CoPurchaseRecommender().run()['orders_removed'], 0)
+
+
+class QuerysetOptimizerTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='optim', email='optim@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.customer = Customer.objects.get(user=self.user)
+        self.products = create_products(create_category('Optim'), 'Optim', 'OPT', 3, price='1.00')
+
+    def create_orders(self, count):
+        for _ in range(count):
+            order = Order.objects.create(
+                customer=self.customer, total_amount=Decimal('3'), vat_amount=Decimal('0'),
+                billing_address={}, shipping_address={}, payment_method='card'
+            )
+            for product in self.products:
+                OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=product.price, vat_rate=Decimal('21'))
+
+    def count_list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/shop/orders/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries)
+
+    def test_order_list_query_count_is_constant(self):
+        """Test nombre de requêtes indépendant du nombre de commandes"""
+        self.create_orders(2)
+        small = self.count_list_queries()
+        self.create_orders(8)
+        self.assertEqual(self.count_list_queries(), small)
+
+    def test_plan_reports_unoptimized_fields(self):
+        """Test détection des champs non optimisables"""
+        plan = SerializerQueryOptimizer.plan_for(CartSerializer)
+        self.assertIn('items.subtotal', plan.unoptimized)
+        self.assertNotIn('items_count', plan.unoptimized)
+        self.assertIn('items', plan.prefetch_related)
+
+    def test_sparse_fieldset(self):
+        """Test ?fields= : réponse, colonnes et préchargements restreints"""
+        self.create_orders(2)
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/shop/orders/', {'fields': 'id,order_number,items.quantity'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        results = response.data.get('results', response.data)
+        self.assertEqual(set(results[0]), {'id', 'order_number', 'items'})
+        self.assertEqual(set(results[0]['items'][0]), {'quantity'})
+
+        sql = [q['sql'] for q in context.captured_queries]
+        orders_sql = next(q for q in sql if 'FROM "shop_order"' in q and 'shop_orderitem' not in q)
+        items_sql = next(q for q in sql if 'FROM "shop_orderitem"' in q)
+        self.assertNotIn('"notes"', orders_sql)
+        self.assertNotIn('shop_customer', orders_sql)
+        self.assertNotIn('"unit_price"', items_sql)
+        self.assertNotIn('shop_product', items_sql)
+
+    def test_expand_relation(self):
+        """Test ?expand= : relation dépliée sans requête par ligne"""
+        self.create_orders(2)
+        params = {'fields': 'id,items.product.name,items.product.price', 'expand': 'items.product'}
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/shop/orders/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        results = response.data.get('results', response.data)
+        self.assertEqual(results[0]['items'][0]['product'], {'name': 'Optim 0', 'price': '1.00'})
+        small = len(context.captured_queries)
+
+        self.create_orders(5)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get('/api/shop/orders/', params)
+        self.assertEqual(len(context.captured_queries), small)
+
+
+class CartTotalsTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='panier', email='panier@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.cart = Cart.objects.create(customer=Customer.objects.get(user=self.user))
+        self.category = create_category('Totaux')
+        # Entrée du panier déjà en cache : seule la lecture du panier est mesurée
+        CartStore.get(self.cart.id)
+
+    def add_items(self, count, start=0):
+        for i in range(start, start + count):
+            product = create_product(self.category, f'Article {i}', f'TOT{i:03d}')
+            CartItem.objects.create(cart=self.cart, product=product, quantity=2)
+
+    def get_cart(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(f'/api/shop/cart/{self.cart.id}/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data, len(context.captured_queries)
+
+    def test_totals_in_constant_queries(self):
+        """Test totaux calculés en SQL, nombre de requêtes indépendant du panier"""
+        self.add_items(2)
+        data, small = self.get_cart()
+        self.assertEqual(data['total_amount'], '40.00')
+        self.assertEqual(data['vat_amount'], '8.40')
+        self.assertEqual(data['items_count'], 2)
+
+        self.add_items(28, start=2)
+        data, large = self.get_cart()
+        self.assertEqual(large, small)
+        self.assertEqual(data['total_amount'], '600.00')
+        self.assertEqual(data['items_count'], 30)
+
+    def test_totals_without_annotation(self):
+        """Test totaux d'un panier lu sans with_totals() (une requête d'agrégat)"""
+        self.add_items(3)
+        cart = Cart.objects.get(pk=self.cart.pk)
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(cart.total_amount, Decimal('60.00'))
+            self.assertEqual(cart.vat_amount, Decimal('12.60'))
+            self.assertEqual(cart.items_count, 3)
+        self.assertEqual(len(context.captured_queries), 1)
+
+        other = Customer.objects.get(user=User.objects.create_user(username='vide'))
+        empty = Cart.objects.with_totals().get(pk=Cart.objects.create(customer=other).pk)
+        self.assertEqual((empty.total_amount, empty.items_count), (Decimal('0.00'), 0))
+
+
+class CartStoreTestCase(APITestCase):
+    def setUp(self):
+        # Écriture différée : cache partagé entre processus (table en base)
+        settings_override = override_settings(
+            CACHES={**settings.CACHES, 'carts': {
+                'BACKEND': 'django.core.cache.backends.db.DatabaseCache', 'LOCATION': 'cart_store_cache',
+            }},
+            CART_STORE_CACHE='carts',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        call_command('createcachetable', 'cart_store_cache', stdout=io.StringIO())
+        # Les entrées du cache local survivent aux transactions de test
+        cache.clear()
+        self.user = User.objects.create_user(username='cache', email='cache@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.cart = Cart.objects.create(customer=Customer.objects.get(user=self.user))
+        self.products = create_products(create_category('Cache'), 'Cache', 'CST', 2, price='5.00')
+
+    def add(self, product, quantity=1):
+        return self.client.post(
+            f'/api/shop/cart/{self.cart.id}/add_item/', {'product_id': product.id, 'quantity': quantity}, format='json'
+        )
+
+    def test_mutations_written_behind_and_coalesced(self):
+        """Test mutations en cache, écrites en base en une fois au flush"""
+        for _ in range(3):
+            response = self.add(self.products[0], 2)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['quantity'], 6)
+        self.add(self.products[1])
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+        self.assertEqual(CartStore.flush(), 1)
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity')),
+            {self.products[0].id: 6, self.products[1].id: 1}
+        )
+        self.assertEqual(CartStore.flush(), 0)
+
+        self.client.delete(f'/api/shop/cart/{self.cart.id}/remove_item/', {'product_id': self.products[1].id}, format='json')
+        CartStore.flush()
+        self.assertEqual(list(CartItem.objects.filter(cart=self.cart).values_list('product_id', flat=True)), [self.products[0].id])
+
+    def test_invalid_quantity_rejected(self):
+        """Test quantité nulle, négative ou non entière refusée avant toute écriture"""
+        for quantity in (0, -2, 'deux', 1.5):
+            response = self.add(self.products[0], quantity)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('quantity', response.data)
+        self.assertEqual(CartStore.get(self.cart.id)['items'], {})
+
+    def test_read_your_writes(self):
+        """Test lecture du panier après mutation sans flush explicite"""
+        self.add(self.products[0], 3)
+        response = self.client.get(f'/api/shop/cart/{self.cart.id}/')
+        self.assertEqual(response.data['items_count'], 1)
+        self.assertEqual(response.data['total_amount'], '15.00')
+
+        self.client.post(f'/api/shop/cart/{self.cart.id}/clear/')
+        response = self.client.get(f'/api/shop/cart/{self.cart.id}/')
+        self.assertEqual(response.data['items_count'], 0)
+
+    def test_oldest_dirty_cart_triggers_flush(self):
+        """Test flush en arrière-plan lancé quand le plus ancien panier sale dépasse FLUSH_MAX_AGE (cache en base)"""
+        self.assertTrue(CartStore.write_behind())
+        with mock.patch('shop.cart_store.async_processor.submit_task') as submit:
+            self.add(self.products[0])
+            submit.assert_not_called()
+            CartStore.cache().set(CartStore.DIRTY_SINCE_KEY, time.time() - CartStore.FLUSH_MAX_AGE, None)
+            self.add(self.products[1])
+        submit.assert_called_once_with(CartStore.flush_pending)
+
+        CartStore.flush_pending()
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 2)
+        self.assertIsNone(CartStore.cache().get(CartStore.DIRTY_SINCE_KEY))
+
+    def test_flush_skips_deleted_product(self):
+        """Test flush d'un panier dont un produit a été supprimé entre-temps"""
+        self.add(self.products[0])
+        self.add(self.products[1])
+        self.products[1].delete()
+        self.assertEqual(CartStore.flush(), 1)
+        self.assertEqual(list(CartItem.objects.filter(cart=self.cart).values_list('product_id', flat=True)), [self.products[0].id])
+
+    def test_batch_add_items(self):
+        """Test ajout groupé de plusieurs produits, panier renvoyé une fois"""
+        self.add(self.products[0])
+        payload = {'items': [
+            {'product_id': self.products[0].id, 'quantity': 2},
+            {'product_id': self.products[1].id, 'quantity': 3},
+            {'product_id': self.products[1].id},
+        ]}
+        response = self.client.post(f'/api/shop/cart/{self.cart.id}/items/', payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['items_count'], 2)
+        self.assertEqual(response.data['total_amount'], '35.00')
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart=self.cart).values_list('product_id', 'quantity')),
+            {self.products[0].id: 3, self.products[1].id: 4}
+        )
+
+        # Nombre de requêtes indépendant du nombre de lignes
+        category = self.products[0].category
+        extra = create_products(category, 'Lot', 'LOT', 6, price='1.00')
+        counts = []
+        for products in (extra[:1], extra[1:]):
+            with CaptureQueriesContext(connection) as context:
+                self.client.post(f'/api/shop/cart/{self.cart.id}/items/', {
+                    'items': [{'product_id': product.id} for product in products]
+                }, format='json')
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 8)
+
+    def test_batch_unknown_product_rejected(self):
+        """Test ajout groupé refusé entièrement si un produit est inconnu"""
+        response = self.client.post(f'/api/shop/cart/{self.cart.id}/items/', {'items': [
+            {'product_id': self.products[0].id}, {'product_id': 999999},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('999999', str(response.data['items']))
+        self.assertEqual(self.client.get(f'/api/shop/cart/{self.cart.id}/').data['items_count'], 0)
+
+    def test_other_customer_cart_not_found(self):
+        """Test panier d'un autre client introuvable"""
+        other = User.objects.create_user(username='autre', email='autre@example.com')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.add(self.products[0]).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_missing_entry_logged_as_lost(self):
+        """Test entrée d'un panier sale absente du cache : erreur journalisée"""
+        self.add(self.products[0])
+        CartStore.cache().delete(CartStore.key(self.cart.id))
+        with self.assertLogs('shop.cart_store', 'ERROR') as logs:
+            self.assertEqual(CartStore.flush(), 0)
+        self.assertIn(str(self.cart.id), logs.output[0])
+        self.assertFalse(CartItem.objects.filter(cart=self.cart).exists())
+
+    def test_sweep_spares_dirty_carts(self):
+        """Test balayage : panier resté sale après un flush échoué conservé"""
+        Cart.objects.filter(pk=self.cart.pk).update(updated_at=timezone.now() - timedelta(days=40))
+        self.add(self.products[0])
+        with mock.patch.object(CartStore, 'write', side_effect=RuntimeError('base indisponible')):
+            self.assertEqual(CartSweeper.sweep(idle_days=30)['carts'], 0)
+        self.assertIn(self.cart.pk, CartStore.dirty_ids())
+        self.assertEqual(CartStore.flush(), 1)
+        self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 1)
+
+    def test_local_cache_writes_through(self):
+        """Test cache local au processus : mutations écrites directement en base"""
+        with override_settings(CART_STORE_CACHE='default'):
+            self.assertFalse(CartStore.write_behind())
+            self.assertEqual(self.add(self.products[0], 2).data['quantity'], 2)
+            self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, 2)
+            self.assertEqual(CartStore.flush(), 0)
+
+
+class GuestCartCookieTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='invite', email='invite@example.com', password='secret123')
+        category = create_category('Invité')
+        self.products = create_products(category, 'Invité', 'GST', 2, price='4.00')
+        self.products.append(create_product(category, 'Invité 2', 'GST002', '4.00', is_active=False))
+
+    def test_compact_cart_cookie(self):
+        """Test cookie panier compact, signé, plus court que l'ancien JSON"""
+        items = {product_id: 2 for product_id in range(1000, 1040)}
+        value = CartCookies.encode(items)
+        self.assertEqual(CartCookies.decode(value), items)
+        legacy = json.dumps({'items': [
+            {'product_id': pk, 'quantity': qty, 'price': 19.99} for pk, qty in items.items()
+        ], 'total': 1599.2})
+        self.assertLess(len(value), len(legacy) / 4)
+
+        tampered = CartCookies.encode({1: 1})[:-1] + 'x'
+        self.assertIsNone(CartCookies.decode(tampered))
+
+    def test_compact_preferences_cookie(self):
+        """Test préférences dans un seul cookie, anciens cookies encore lus"""
+        preferences = {'language': 'nl', 'currency': 'EUR', 'items_per_page': 50}
+        value = UserPreferenceCookies.encode(preferences)
+        self.assertEqual(UserPreferenceCookies.decode(value), preferences)
+
+        request = APIRequestFactory().get('/')
+        request.COOKIES = {'user_theme': 'dark', 'user_lang': 'fr'}
+        self.assertEqual(UserPreferenceCookies.get_preference(request, 'theme'), 'dark')
+        response = HttpResponse()
+        UserPreferenceCookies.set_preference(response, 'language', 'en', request=request)
+        self.assertEqual(
+            UserPreferenceCookies.decode(response.cookies['prefs'].value),
+            {'language': 'en', 'theme': 'dark'}
+        )
+        self.assertEqual(response.cookies['user_lang'].value, '')
+
+        # Ancienne signature, sans request : ancien cookie, prioritaire sur le cookie compact
+        response = HttpResponse()
+        UserPreferenceCookies.set_preference(response, 'theme', 'light')
+        self.assertEqual(response.cookies['user_theme'].value, 'light')
+        request.COOKIES = {'prefs': UserPreferenceCookies.encode({'theme': 'dark', 'currency': 'EUR'}), 'user_theme': 'light'}
+        self.assertEqual(UserPreferenceCookies.get_preference(request, 'theme'), 'light')
+        self.assertEqual(UserPreferenceCookies.get_preference(request, 'currency'), 'EUR')
+
+    def test_invalid_integer_preference(self):
+        """Test préférence entière invalide ignorée, hors bornes ramenée dans ses bornes"""
+        value = UserPreferenceCookies.encode({'language': 'fr', 'items_per_page': 'beaucoup'})
+        self.assertEqual(UserPreferenceCookies.decode(value), {'language': 'fr'})
+        value = UserPreferenceCookies.encode({'items_per_page': -5})
+        self.assertEqual(UserPreferenceCookies.decode(value), {'items_per_page': 1})
+        value = UserPreferenceCookies.encode({'items_per_page': '5000'})
+        self.assertEqual(UserPreferenceCookies.decode(value), {'items_per_page': 100})
+
+        request = APIRequestFactory().get('/')
+        request.COOKIES = {'user_items_per_page': 'abc'}
+        response = HttpResponse()
+        UserPreferenceCookies.set_preferences(request, response, {'theme': 'dark'})
+        self.assertEqual(UserPreferenceCookies.decode(response.cookies['prefs'].value), {'theme': 'dark'})
+
+    def test_merge_on_login(self):
+        """Test fusion du panier invité à la connexion, quantités cumulées"""
+        cart = Cart.objects.create(customer=Customer.objects.get(user=self.user))
+        CartItem.objects.create(cart=cart, product=self.products[0], quantity=1)
+        self.client.cookies['guest_cart'] = CartCookies.encode({
+            self.products[0].id: 2, self.products[1].id: 1, self.products[2].id: 5
+        })
+
+        response = self.client.post('/api/auth/token/', {'username': 'invite', 'password': 'secret123'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('access', response.data)
+        self.assertEqual(response.cookies['guest_cart'].value, '')
+        # Produit inactif ignoré
+        self.assertEqual(
+            dict(CartItem.objects.filter(cart=cart).values_list('product_id', 'quantity')),
+            {self.products[0].id: 3, self.products[1].id: 1}
+        )
+
+
+class CartSweeperTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = create_product(create_category('Balayage'), 'Balayage', 'SWP001', '3.00')
+        self.carts = []
+        for i in range(4):
+            user = User.objects.create_user(username=f'balai{i}', email=f'balai{i}@example.com')
+            cart = Cart.objects.create(customer=Customer.objects.get(user=user))
+            CartItem.objects.create(cart=cart, product=self.product, quantity=1)
+            self.carts.append(cart)
+
+    def test_sweep_idle_carts_in_batches(self):
+        """Test suppression par lots des paniers inactifs, paniers récents conservés"""
+        old = timezone.now() - timedelta(days=40)
+        Cart.objects.filter(pk__in=[cart.pk for cart in self.carts[:3]]).update(updated_at=old)
+        # Modifié en cache seulement : écrit avant le balayage, donc conservé
+        CartStore.add(self.carts[2].pk, {self.product.pk: 1})
+
+        stats = CartSweeper.sweep(idle_days=30, batch_size=1)
+        self.assertEqual(stats['carts'], 2)
+        self.assertEqual(stats['items'], 2)
+        self.assertEqual(stats['batches'], 2)
+        self.assertEqual(
+            set(Cart.objects.values_list('pk', flat=True)), {self.carts[2].pk, self.carts[3].pk}
+        )
+        self.assertEqual(CartItem.objects.get(cart=self.carts[2]).quantity, 2)
+        self.assertEqual(CartSweeper.metrics()['carts'], 2)
+        self.assertEqual(CartSweeper.sweep(idle_days=30)['carts'], 0)
+
+    def test_sweep_expired_sessions(self):
+        """Test suppression des sessions expirées en base"""
+        now = timezone.now()
+        Session.objects.bulk_create([
+            Session(session_key=f'expired{i}', session_data='', expire_date=now - timedelta(hours=1))
+            for i in range(3)
+        ] + [Session(session_key='active', session_data='', expire_date=now + timedelta(hours=1))])
+
+        self.assertEqual(CartSweeper.clear_sessions(batch_size=2), 3)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), ['active'])
+
+
+class OrderCheckoutTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='acheteur', email='acheteur@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.customer = Customer.objects.get(user=self.user)
+        self.products = create_products(
+            create_category('Checkout'), 'Checkout', 'CHK', 40, vat_rate=Decimal('21.00'), stock_quantity=100
+        )
+
+    def checkout(self, products, headers=None, **line):
+        address = {'street': '1 Rue Test', 'city': 'Bruxelles'}
+        return self.client.post('/api/shop/orders/', {
+            'customer': self.customer.id,
+            'billing_address': address,
+            'shipping_address': address,
+            'payment_method': 'card',
+            'items': [{'product': product.id, 'quantity': 2, **line} for product in products],
+        }, format='json', headers=headers)
+
+    def test_prices_from_catalog(self):
+        """Test prix et TVA lus dans le catalogue, pas dans la requête"""
+        response = self.checkout(self.products[:2], unit_price='0.01', vat_rate='0')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(response.data['order_number'])
+        self.assertEqual(response.data['total_amount'], '40.00')
+        self.assertEqual(response.data['vat_amount'], '8.40')
+        order = Order.objects.get(id=response.data['id'])
+        self.assertEqual(set(order.items.values_list('unit_price', 'vat_rate')), {(Decimal('10.00'), Decimal('21.00'))})
+
+    def test_queries_independent_of_lines(self):
+        """Test nombre de requêtes du checkout indépendant du nombre de lignes"""
+        # Premier checkout : création du compteur de numérotation, hors mesure
+        self.checkout(self.products[:1])
+        counts = []
+        for products in (self.products[:2], self.products[2:]):
+            with CaptureQueriesContext(connection) as context:
+                response = self.checkout(products)
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            counts.append(len(context.captured_queries))
+        self.assertEqual(counts[0], counts[1])
+        inserts = [q['sql'] for q in context.captured_queries if q['sql'].startswith('INSERT INTO "shop_order"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertFalse(any(q['sql'].startswith('UPDATE "shop_order"') for q in context.captured_queries))
+
+    def test_idempotent_checkout(self):
+        """Test checkout rejoué avec la même Idempotency-Key : une seule commande"""
+        headers = {'Idempotency-Key': 'checkout-1'}
+        first = self.checkout(self.products[:2], headers=headers)
+        second = self.checkout(self.products[:2], headers=headers)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.data['id'], first.data['id'])
+        self.assertEqual(second['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+        # Même clé, autre requête
+        self.assertEqual(self.checkout(self.products[:1], headers=headers).status_code, 422)
+        # Sans clé : exécutée normalement
+        self.checkout(self.products[:2])
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_idempotency_in_flight_and_sweep(self):
+        """Test requête dupliquée pendant la première (409 après attente) et expiration"""
+        record, claimed = IdempotencyStore.claim(self.user, 'pending', 'POST /api/shop/orders/', 'x')
+        self.assertTrue(claimed)
+        self.assertFalse(IdempotencyStore.claim(self.user, 'pending', 'POST /api/shop/orders/', 'x')[1])
+        with mock.patch.object(IdempotencyStore, 'WAIT_TIMEOUT', 0):
+            with self.assertRaises(IdempotencyConflict):
+                IdempotencyStore.wait(record)
+
+        self.assertEqual(IdempotencyStore.sweep(now=timezone.now() + timedelta(days=2)), 1)
+        self.assertFalse(IdempotencyRecord.objects.exists())
+
+    def test_unknown_product_rejected(self):
+        """Test checkout refusé si un produit est inconnu, rien n'est écrit"""
+        response = self.client.post('/api/shop/orders/', {
+            'customer': self.customer.id, 'billing_address': {}, 'shipping_address': {},
+            'payment_method': 'card', 'items': [{'product': 999999, 'quantity': 1}],
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+
+
+class SequenceTestCase(TestCase):
+    def test_gapless_sequence(self):
+        """Test numérotation continue : une transaction annulée ne laisse pas de trou"""
+        numbers = Sequence('test_gapless', prefix='T', width=3)
+        now = timezone.make_aware(datetime(2025, 3, 1))
+        self.assertEqual(numbers.next(now=now), 'T2025001')
+        try:
+            with transaction.atomic():
+                numbers.next(now=now)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(numbers.next(now=now), 'T2025002')
+        # Nouvelle période : nouveau compteur
+        self.assertEqual(numbers.next(now=timezone.make_aware(datetime(2026, 1, 2))), 'T2026001')
+
+    def test_block_allocation(self):
+        """Test réservation par blocs : une requête pour block_size numéros"""
+        numbers = Sequence('test_block', period_format='', width=4, block_size=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(numbers.next(), '0001')
+        with self.assertNumQueries(0):
+            following = [numbers.next() for _ in range(9)]
+        self.assertEqual(following[-1], '0010')
+        self.assertEqual(SequenceCounter.objects.get(key='test_block').value, 10)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(numbers.next(), '0011')
+        self.assertEqual(SequenceCounter.objects.get(key='test_block').value, 20)
+
+    def test_concurrent_blocks_kept(self):
+        """Test deux blocs réservés avant publication : aucun numéro perdu ni servi deux fois"""
+        numbers = Sequence('test_concurrent', period_format='', width=4, block_size=10)
+        with self.captureOnCommitCallbacks(execute=True):
+            # Aucun bloc publié : chaque appel réserve le sien, comme deux threads simultanés
+            first = [numbers.next(), numbers.next()]
+        self.assertEqual(first, ['0001', '0011'])
+        with self.assertNumQueries(0):
+            following = [numbers.next() for _ in range(18)]
+        self.assertEqual(sorted(first + following), [f'{n:04d}' for n in range(1, 21)])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(numbers.next(), '0021')
+
+    def test_seed_and_scope(self):
+        """Test compteur amorcé depuis l'ancienne numérotation, un compteur par scope"""
+        numbers = Sequence('test_seed', prefix='S', period_format='', seed=lambda scope, prefix: 41 if scope == 'a' else 0)
+        self.assertEqual(numbers.next(scope='a'), 'S000042')
+        self.assertEqual(numbers.next(scope='b'), 'S000001')
+        self.assertEqual(numbers.next(scope='a'), 'S000043')
+
+    def test_order_numbers_unique(self):
+        """Test numéros de commande attribués par la séquence"""
+        user = User.objects.create_user(username='sequence', email='sequence@example.com')
+        customer = Customer.objects.get(user=user)
+        orders = [
+            Order.objects.create(
+                customer=customer, total_amount=Decimal('0'), vat_amount=Decimal('0'),
+                billing_address={}, shipping_address={}, payment_method='card'
+            )
+            for _ in range(3)
+        ]
+        numbers = [order.order_number for order in orders]
+        self.assertEqual(len(set(numbers)), 3)
+        self.assertTrue(all(number.startswith('CMD') for number in numbers))
+
+
+class PaymentGatewayTestCase(APITestCase):
+    def setUp(self):
+        payments._gateways.clear()
+        settings_override = override_settings(PAYMENT_GATEWAY='fake')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.gateway = payments.get_gateway()
+
+        self.user = User.objects.create_user(username='payeur', email='payeur@example.com')
+        self.client.force_authenticate(user=self.user)
+        self.product = create_product(create_category('Paiement'), 'Paiement', 'PAY001', '25.00', stock_quantity=10)
+        response = self.client.post('/api/shop/orders/', {
+            'customer': Customer.objects.get(user=self.user).id,
+            'billing_address': {}, 'shipping_address': {}, 'payment_method': 'card',
+            'items': [{'product': self.product.id, 'quantity': 2}],
+        }, format='json')
+        self.order = Order.objects.get(id=response.data['id'])
+
+    def url(self, action):
+        return f'/api/shop/orders/{self.order.id}/{action}/'
+
+    def test_single_attempt_on_request_path(self):
+        """Test une seule tentative sans attente par défaut, reprises seulement si demandées"""
+        gateway = FakeGateway(failure_rate=1.0)
+        with mock.patch.object(gateway, 'simulate_network', side_effect=GatewayUnavailable('panne')) as network:
+            with mock.patch('shop.payments.time.sleep') as sleep:
+                with self.assertRaises(GatewayUnavailable):
+                    gateway.create_intent(100, 'eur', {})
+                self.assertEqual(network.call_count, 1)
+                sleep.assert_not_called()
+
+                with self.assertRaises(GatewayUnavailable):
+                    gateway.retrieve_intent('pi_fake', retries=gateway.RETRIES)
+                self.assertEqual(network.call_count, 2 + gateway.RETRIES)
+
+    def test_circuit_breaker(self):
+        """Test disjoncteur ouvert après des échecs : échec immédiat, refermé après un essai réussi"""
+        gateway = FakeGateway(failure_rate=1.0)
+        gateway.breaker = CircuitBreaker(failure_threshold=3, reset_timeout=60)
+        for _ in range(3):
+            with self.assertRaises(GatewayUnavailable):
+                gateway.create_intent(100, 'eur', {})
+        self.assertEqual(gateway.breaker.state, 'open')
+
+        with mock.patch.object(gateway, 'simulate_network') as network:
+            with self.assertRaises(GatewayUnavailable):
+                gateway.create_intent(100, 'eur', {})
+            network.assert_not_called()
+
+        gateway.failure_rate = 0
+        gateway.breaker.reset_timeout = 0
+        self.assertEqual(gateway.breaker.state, 'half_open')
+        # Essai terminé par une erreur imprévue : l'essai est libéré
+        with mock.patch.object(gateway, 'simulate_network', side_effect=ValueError('réponse illisible')):
+            with self.assertRaises(ValueError):
+                gateway.create_intent(100, 'eur', {})
+        self.assertEqual(gateway.breaker.state, 'half_open')
+        gateway.create_intent(100, 'eur', {})
+        self.assertEqual(gateway.breaker.state, 'closed')
+
+    def test_payment_flow(self):
+        """Test intention créée, confirmation lue en base, webhook manquant rattrapé par reconcile_payments"""
+        response = self.client.post(self.url('create_payment_intent'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        intent_id = response.data['payment_intent_id']
+        self.assertTrue(response.data['client_secret'])
+
+        self.gateway.succeed(intent_id)
+        with mock.patch.object(self.gateway, 'retrieve_intent') as retrieve:
+            self.assertEqual(self.client.post(self.url('confirm_payment')).status_code, status.HTTP_400_BAD_REQUEST)
+            retrieve.assert_not_called()
+
+        out = io.StringIO()
+        call_command('reconcile_payments', minutes=0, stdout=out)
+        self.assertIn('1 paiements confirmés', out.getvalue())
+        response = self.client.post(self.url('confirm_payment'))
+        self.assertEqual(response.data, {'status': 'payment_confirmed'})
+        self.order.refresh_from_db()
+        self.assertEqual((self.order.payment_status, self.order.status), ('paid', 'confirmed'))
+        self.assertEqual(set(StockReservation.objects.filter(order=self.order).values_list('status', flat=True)), {'converted'})
+
+    def test_confirmed_by_event(self):
+        """Test confirmation par événement webhook, sans interroger la passerelle"""
+        intent_id = self.client.post(self.url('create_payment_intent')).data['payment_intent_id']
+        event = self.gateway.succeed(intent_id)
+        self.assertTrue(PaymentService.apply_event(event))
+        self.assertFalse(PaymentService.apply_event(event))
+
+        with mock.patch.object(self.gateway, 'retrieve_intent') as retrieve:
+            response = self.client.post(self.url('confirm_payment'))
+            retrieve.assert_not_called()
+        self.assertEqual(response.data, {'status': 'payment_confirmed'})
+
+    def test_backorder_isolated(self):
+        """Test stock vendu après expiration : paiement enregistré, commande en rupture, le reste du lot confirmé"""
+        response = self.client.post('/api/shop/orders/', {
+            'customer': self.order.customer_id,
+            'billing_address': {}, 'shipping_address': {}, 'payment_method': 'card',
+            'items': [{'product': self.product.id, 'quantity': 1}],
+        }, format='json')
+        late = Order.objects.get(id=response.data['id'])
+        StockReservationService.release(StockReservation.objects.filter(order=late))
+        Product.objects.filter(pk=self.product.pk).update(stock_quantity=0)
+
+        paid = PaymentService.mark_paid_many([self.order, late])
+        self.assertEqual(len(paid), 2)
+        self.assertEqual(
+            dict(Order.objects.filter(pk__in=[self.order.pk, late.pk]).values_list('pk', 'status')),
+            {self.order.pk: 'confirmed', late.pk: 'backorder'}
+        )
+        self.assertEqual((late.payment_status, late.status), ('paid', 'backorder'))
+        self.assertEqual(set(Order.objects.filter(pk__in=[self.order.pk, late.pk]).values_list('payment_status', flat=True)), {'paid'})
+        self.assertEqual(StockReservation.objects.get(order=self.order).status, 'converted')
+        self.assertEqual(StockReservation.objects.get(order=late).status, 'released')
+
+    def test_gateway_unavailable(self):
+        """Test passerelle en panne : 503 avec Retry-After"""
+        self.gateway.failure_rate = 1.0
+        response = self.client.post(self.url('create_payment_intent'))
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '30')
+
+    def post_event(self, event, signature=None):
+        payload = json.dumps(event).encode()
+        return self.client.post(
+            '/api/shop/payments/webhook/', payload, content_type='application/json',
+            HTTP_STRIPE_SIGNATURE=signature if signature is not None else FakeGateway.sign(payload)
+        )
+
+    def test_webhook_deduplicated(self):
+        """Test webhook : acquitté sans traitement, une livraison répétée n'ajoute pas de ligne"""
+        intent_id = self.client.post(self.url('create_payment_intent')).data['payment_intent_id']
+        event = self.gateway.succeed(intent_id)
+        self.client.force_authenticate(user=None)
+        for _ in range(2):
+            response = self.post_event(event)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data, {'received': True})
+        self.assertEqual(PaymentEvent.objects.filter(event_id=event['id']).count(), 1)
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'pending')
+
+        self.assertEqual(self.post_event(event, signature='invalide').status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_events_processed_in_batch(self):
+        """Test worker : commandes payées, réservations converties et factures créées par lot"""
+        orders = [self.order]
+        for _ in range(2):
+            response = self.client.post('/api/shop/orders/', {
+                'customer': self.order.customer_id,
+                'billing_address': {}, 'shipping_address': {}, 'payment_method': 'card',
+                'items': [{'product': self.product.id, 'quantity': 1}],
+            }, format='json')
+            orders.append(Order.objects.get(id=response.data['id']))
+        for order in orders:
+            intent_id = self.client.post(f'/api/shop/orders/{order.id}/create_payment_intent/').data['payment_intent_id']
+            PaymentEventInbox.receive(self.gateway.succeed(intent_id))
+        PaymentEventInbox.receive({'id': 'evt_autre', 'type': 'charge.refunded'})
+        INVOICE_NUMBERS.next()
+
+        # Nombre de requêtes fixe, quelle que soit la taille du lot
+        with self.assertNumQueries(23):
+            stats = PaymentEventInbox.process_pending(batch_size=10)
+        self.assertEqual((stats['events'], stats['orders'], stats['failed']), (4, 3, 0))
+        self.assertFalse(PaymentEvent.objects.filter(processed_at__isnull=True).exists())
+        self.assertEqual(
+            set(Order.objects.filter(id__in=[o.id for o in orders]).values_list('payment_status', flat=True)), {'paid'}
+        )
+        self.assertEqual(
+            set(StockReservation.objects.filter(order__in=orders).values_list('status', flat=True)), {'converted'}
+        )
+        invoices = Invoice.objects.filter(order__in=orders)
+        self.assertEqual(invoices.count(), 3)
+        self.assertEqual(invoices.get(order=self.order).total_incl_vat, self.order.total_amount + self.order.vat_amount)
+        self.assertEqual(invoices.get(order=self.order).lines.get().quantity, 2)
+
+        # Déjà traités : rien n'est rejoué
+        self.assertEqual(PaymentEventInbox.process_pending()['events'], 0)
+        self.assertEqual(Invoice.objects.filter(order__in=orders).count(), 3)
+
+    def test_failed_event_isolated(self):
+        """Test événement en erreur : le reste du lot est appliqué, l'événement fautif reste en attente"""
+        intent_id = self.client.post(self.url('create_payment_intent')).data['payment_intent_id']
+        # Charge utile inattendue : l'intention n'est pas un objet
+        PaymentEventInbox.receive({'id': 'evt_casse', 'type': 'payment_intent.succeeded', 'intent': 'pi_inconnu'})
+        PaymentEventInbox.receive(self.gateway.succeed(intent_id))
+
+        stats = PaymentEventInbox.process_pending()
+        self.assertEqual((stats['events'], stats['orders'], stats['failed']), (1, 1, 1))
+        self.order.refresh_from_db()
+        self.assertEqual(self.order.payment_status, 'paid')
+        broken = PaymentEvent.objects.get(event_id='evt_casse')
+        self.assertEqual((broken.processed_at, broken.attempts), (None, 1))
+        self.assertTrue(broken.error)
+        self.assertGreater(broken.next_attempt_at, broken.received_at)
+
+    def test_failed_event_backoff_then_abandoned(self):
+        """Test événement en échec repris après son délai, abandonné après MAX_ATTEMPTS"""
+        PaymentEventInbox.receive({'id': 'evt_casse', 'type': 'payment_intent.succeeded', 'intent': 'pi_inconnu'})
+        self.assertEqual(PaymentEventInbox.process_pending()['failed'], 1)
+        # Délai de reprise pas écoulé : l'événement n'est pas repris
+        self.assertEqual(PaymentEventInbox.process_pending()['batches'], 0)
+
+        for attempt in range(2, PaymentEventInbox.MAX_ATTEMPTS + 1):
+            PaymentEvent.objects.update(next_attempt_at=timezone.now())
+            if attempt == PaymentEventInbox.MAX_ATTEMPTS:
+                with self.assertLogs('shop.webhooks', 'ERROR') as logs:
+                    PaymentEventInbox.process_pending()
+                self.assertIn('evt_casse abandoned', logs.output[-1])
+            else:
+                PaymentEventInbox.process_pending()
+        broken = PaymentEvent.objects.get()
+        self.assertEqual(broken.attempts, PaymentEventInbox.MAX_ATTEMPTS)
+        self.assertIsNone(broken.processed_at)
+        self.assertIsNotNone(broken.failed_at)
+        self.assertFalse(PaymentEventInbox.pending(now=timezone.now() + PaymentEventInbox.retry_delay(10)).exists())
+
+        self.assertEqual(PaymentEventInbox.requeue_failed(), 1)
+        self.assertEqual(PaymentEventInbox.process_pending()['failed'], 1)
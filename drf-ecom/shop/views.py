@@ -1,60 +1,178 @@
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, authentication_classes, permission_classes
 from rest_framework.response import Response
-from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
+from rest_framework.filters import OrderingFilter
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
-import stripe
-from django.conf import settings
+from django.http import Http404
+from django.http import StreamingHttpResponse
 from cache_system import cache_products, cache_customers, CacheManager
 from low_level_optimizations import PerformanceMonitor, DatabaseOptimizer
 from .vat_validator import validate_vat_number
 from .customer_serializers import CustomerCreateSerializer
+from .search import product_search_index
+from .filters import ProductFilter, ProductSnapshotFilter
+from .facets import ProductFacets
+from .export import CatalogExporter, CSVRenderer, NDJSONRenderer
+from .cart_store import CartStore
+from .idempotency import IdempotencyMixin
+from .payments import GatewayUnavailable, PaymentGatewayError, PaymentService, get_gateway
+from .webhooks import PaymentEventInbox
+from search_index import FullTextSearchFilter
+from pagination import SelectablePagination
+from query_optimizer import QuerysetOptimizerMixin
+from conditional_get import ConditionalGetMixin
 
-from .models import Category, Product, Customer, Cart, CartItem, Order, Wishlist
+from .models import Category, Product, ProductSnapshot, Customer, Cart, Order, Wishlist, ProductRecommendation
 from .serializers import (
-    CategorySerializer, ProductSerializer, CustomerSerializer,
-    CartSerializer, CartItemSerializer, OrderSerializer, OrderCreateSerializer,
+    CategorySerializer, ProductSerializer, ProductSnapshotSerializer, CustomerSerializer,
+    CartSerializer, CartLineSerializer, CartBatchSerializer, OrderSerializer, OrderCreateSerializer,
     WishlistSerializer
 )
 
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Category.objects.filter(is_active=True)
     serializer_class = CategorySerializer
     permission_classes = [AllowAny]
     lookup_field = 'slug'
+    # Pas de updated_at sur Category : version incrémentée par les signaux
+    version_namespace = Category.VERSION_NAMESPACE
+    conditional_actions = ('list', 'retrieve', 'tree')
+
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """Arborescence complète pour le menu de navigation (servie depuis le cache)"""
+        tree = CacheManager.get_cache(Category.TREE_CACHE_KEY)
+        if tree is None:
+            tree = Category.build_tree()
+            CacheManager.set_cache(Category.TREE_CACHE_KEY, tree, category='categories')
+        return Response(tree)
 
-class ProductViewSet(viewsets.ReadOnlyModelViewSet):
+class ProductViewSet(ConditionalGetMixin, QuerysetOptimizerMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Product.objects.filter(is_active=True)
     serializer_class = ProductSerializer
     permission_classes = [AllowAny]
-    filter_backends = [DjangoFilterBackend]
-    filterset_fields = ['category', 'is_digital']
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
+    search_index = product_search_index
     search_fields = ['name', 'description']
-    ordering_fields = ['price', 'created_at']
+    ordering_fields = ['price', 'price_with_vat', 'created_at']
     lookup_field = 'slug'
-    
+    pagination_class = SelectablePagination
+    # Représentation résumée du catalogue (?summary=1), servie par le modèle de lecture sans jointure
+    summary_query_param = 'summary'
+    conditional_actions = ('list', 'retrieve', 'facets')
+    # Validateurs lus sur ProductSnapshot : instant de la dernière réécriture de la ligne
+    updated_field = 'synced_at'
+
+    def uses_snapshot(self) -> bool:
+        """Facettes et liste résumée lisent ProductSnapshot ; la liste complète garde ProductSerializer"""
+        if self.action == 'facets':
+            return True
+        return self.action == 'list' and self.request.query_params.get(self.summary_query_param) in ('1', 'true')
+
+    @property
+    def keyset_ordering(self):
+        if self.action == 'low_stock':
+            # Même ordre que l'index partiel product_low_stock_idx
+            return ('stock_quantity', 'id')
+        return ('-created_at', '-product') if self.uses_snapshot() else ('-created_at', '-id')
+
+    @property
+    def filterset_class(self):
+        return ProductSnapshotFilter if self.uses_snapshot() else ProductFilter
+
+    def get_queryset(self):
+        if self.uses_snapshot():
+            fieldset = self.get_fieldset()
+            columns = ProductSnapshotSerializer.values_for(
+                fieldset and fieldset[0], required=[name.lstrip('-') for name in self.keyset_ordering]
+            )
+            return ProductSnapshot.objects.filter(is_active=True).values(*columns)
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.uses_snapshot():
+            return ProductSnapshotSerializer
+        return super().get_serializer_class()
+
+    def get_validator_queryset(self):
+        # Le snapshot est réécrit à chaque changement du produit, de ses images ou de son stock
+        if self.action == 'retrieve':
+            return ProductSnapshot.objects.filter(is_active=True, slug=self.kwargs['slug'])
+        if self.action == 'list' and not self.uses_snapshot():
+            products = self.filter_queryset(self.get_queryset())
+            return ProductSnapshot.objects.filter(pk__in=products.order_by().values('pk'))
+        return super().get_validator_queryset()
+
     @PerformanceMonitor.measure_execution_time
     @cache_products(timeout=3600)
     def list(self, request, *args, **kwargs):
-        return super().list(request, *args, **kwargs)
+        response = super().list(request, *args, **kwargs)
+        if request.query_params.get('facets') and isinstance(response.data, dict):
+            response.data['facets'] = ProductFacets.for_request(self.filter_queryset(self.get_queryset()), request)
+        return response
+
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Compteurs de facettes pour les filtres courants"""
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(ProductFacets.for_request(queryset, request))
+
+    @action(detail=False, methods=['get'], renderer_classes=[NDJSONRenderer, CSVRenderer])
+    def export(self, request):
+        """Catalogue complet (ou modifié depuis updated_since) en flux NDJSON ou CSV (?format=csv)"""
+        exporter = CatalogExporter(
+            CatalogExporter.parse_since(request.query_params.get('updated_since')),
+            # Les produits retirés ne sont signalés qu'aux partenaires authentifiés (personnel)
+            include_inactive=request.user.is_staff
+        )
+        renderer = request.accepted_renderer
+        stream = exporter.csv() if renderer.format == 'csv' else exporter.ndjson()
+
+        response = StreamingHttpResponse(stream, content_type=f'{renderer.media_type}; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="catalog.{renderer.format}"'
+        response['X-Export-Started-At'] = exporter.started_at.isoformat()
+        return response
+
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def low_stock(self, request):
+        """Liste de réassort : produits sous leur stock minimum (index partiel)"""
+        products = (
+            Product.objects.filter(Product.LOW_STOCK, is_active=True)
+            .order_by('stock_quantity', 'id')
+            .values('id', 'sku', 'name', 'stock_quantity', 'min_stock_level')
+        )
+        page = self.paginate_queryset(products)
+        rows = page if page is not None else products
+        for row in rows:
+            row['shortfall'] = row['min_stock_level'] - row['stock_quantity']
+        return self.get_paginated_response(rows) if page is not None else Response(list(rows))
 
     @action(detail=True, methods=['get'])
     def related_products(self, request, slug=None):
         product = self.get_object()
-        related = Product.objects.filter(
-            category=product.category,
-            is_active=True
-        ).exclude(id=product.id)[:4]
+        related_ids = ProductRecommendation.objects.filter(product_id=product.id).values_list(
+            'related_ids', flat=True
+        ).first()
+
+        if related_ids:
+            # Top-N précalculé par build_recommendations
+            products = Product.objects.filter(is_active=True).in_bulk(related_ids)
+            related = [products[pk] for pk in related_ids if pk in products][:4]
+        else:
+            related = Product.objects.filter(
+                category=product.category,
+                is_active=True
+            ).exclude(id=product.id)[:4]
         serializer = self.get_serializer(related, many=True)
         return Response(serializer.data)
 
-class CustomerViewSet(viewsets.ModelViewSet):
+class CustomerViewSet(QuerysetOptimizerMixin, viewsets.ModelViewSet):
     queryset = Customer.objects.all()
     serializer_class = CustomerSerializer
     permission_classes = [AllowAny]
+    select_related_extra = ('user',)
     
     @PerformanceMonitor.measure_execution_time
     @cache_customers(timeout=1800)
@@ -101,58 +219,95 @@ class CustomerViewSet(viewsets.ModelViewSet):
         print(f"Erreurs de validation: {serializer.errors}")
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-class CartViewSet(viewsets.ModelViewSet):
+class CartViewSet(QuerysetOptimizerMixin, viewsets.ModelViewSet):
+    """Les mutations passent par CartStore (cache, écriture différée) ;
+    les lectures écrivent d'abord en base le panier s'il a changé."""
+    queryset = Cart.objects.all()
     serializer_class = CartSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         customer = get_object_or_404(Customer, user=self.request.user)
-        return Cart.objects.filter(customer=customer)
+        return super().get_queryset().filter(customer=customer).with_totals()
+
+    def get_cart_id(self):
+        """Panier de l'URL, propriété vérifiée sur l'entrée en cache (sans requête)"""
+        try:
+            cart_id = int(self.kwargs['pk'])
+        except (TypeError, ValueError):
+            raise Http404
+        if CartStore.owner(cart_id) != self.request.user.id:
+            raise Http404
+        return cart_id
+
+    def list(self, request, *args, **kwargs):
+        CartStore.flush(Cart.objects.filter(customer__user=request.user).values_list('pk', flat=True))
+        return super().list(request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        # Lire ses propres écritures : le panier est écrit en base s'il est sale
+        CartStore.flush([self.get_cart_id()])
+        return super().retrieve(request, *args, **kwargs)
+
+    def perform_destroy(self, instance):
+        CartStore.discard([instance.pk])
+        super().perform_destroy(instance)
 
     @action(detail=True, methods=['post'])
     def add_item(self, request, pk=None):
-        cart = self.get_object()
-        product_id = request.data.get('product_id')
-        quantity = int(request.data.get('quantity', 1))
-        
-        product = get_object_or_404(Product, id=product_id)
+        cart_id = self.get_cart_id()
+        line = CartLineSerializer(data=request.data)
+        line.is_valid(raise_exception=True)
         
-        cart_item, created = CartItem.objects.get_or_create(
-            cart=cart,
-            product=product,
-            defaults={'quantity': quantity}
-        )
+        product_id = get_object_or_404(Product.objects.values_list('pk', flat=True), id=line.validated_data['product_id'])
+        items = CartStore.add(cart_id, {product_id: line.validated_data['quantity']})
         
-        if not created:
-            cart_item.quantity += quantity
-            cart_item.save()
-        
-        serializer = CartItemSerializer(cart_item)
+        return Response({'product': product_id, 'quantity': items[product_id]}, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['post'], url_path='items')
+    def add_items(self, request, pk=None):
+        """Ajout groupé : une mutation du panier, une transaction d'écriture, le panier renvoyé une fois"""
+        cart_id = self.get_cart_id()
+        batch = CartBatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+
+        CartStore.add(cart_id, batch.validated_data['items'])
+        CartStore.flush([cart_id])
+
+        serializer = self.get_serializer(self.get_queryset().get(pk=cart_id))
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
     @action(detail=True, methods=['delete'])
     def remove_item(self, request, pk=None):
-        cart = self.get_object()
-        product_id = request.data.get('product_id')
+        cart_id = self.get_cart_id()
+        try:
+            product_id = int(request.data.get('product_id'))
+        except (TypeError, ValueError):
+            raise Http404
         
-        cart_item = get_object_or_404(CartItem, cart=cart, product_id=product_id)
-        cart_item.delete()
+        if product_id not in CartStore.get(cart_id)['items']:
+            raise Http404
+        CartStore.remove(cart_id, [product_id])
         
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(detail=True, methods=['post'])
     def clear(self, request, pk=None):
-        cart = self.get_object()
-        cart.items.all().delete()
+        CartStore.clear(self.get_cart_id())
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(IdempotencyMixin, QuerysetOptimizerMixin, viewsets.ModelViewSet):
+    queryset = Order.objects.all()
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = SelectablePagination
+    keyset_ordering = ('-created_at', '-id')
+    # Rejouées par les clients mobiles après un délai dépassé
+    idempotent_actions = ('create', 'create_payment_intent', 'confirm_payment')
 
     def get_queryset(self):
         customer = get_object_or_404(Customer, user=self.request.user)
-        return Order.objects.filter(customer=customer)
+        return super().get_queryset().filter(customer=customer)
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -164,68 +319,48 @@ class OrderViewSet(viewsets.ModelViewSet):
         order = self.get_object()
         
         try:
-            intent = stripe.PaymentIntent.create(
-                amount=int(order.total_amount * 100),  # Stripe utilise les centimes
-                currency='eur',
-                metadata={'order_id': order.id}
-            )
-            
-            order.stripe_payment_intent_id = intent.id
-            order.save()
-            
-            return Response({
-                'client_secret': intent.client_secret,
-                'payment_intent_id': intent.id
-            })
-        except stripe.error.StripeError as e:
-            return Response(
-                {'error': str(e)},
-                status=status.HTTP_400_BAD_REQUEST
+            intent = PaymentService.create_intent(
+                order,
+                # Un appel rejoué après une coupure ne crée pas une seconde intention
+                idempotency_key=self.idempotency_record and f'idem-{self.idempotency_record.pk}'
             )
+        except GatewayUnavailable as e:
+            return Response({'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '30'})
+        except PaymentGatewayError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response({
+            'client_secret': intent['client_secret'],
+            'payment_intent_id': intent['id']
+        })
 
     @action(detail=True, methods=['post'])
     def confirm_payment(self, request, pk=None):
         order = self.get_object()
         
-        if order.stripe_payment_intent_id:
-            try:
-                intent = stripe.PaymentIntent.retrieve(order.stripe_payment_intent_id)
-                
-                if intent.status == 'succeeded':
-                    order.payment_status = 'paid'
-                    order.status = 'confirmed'
-                    order.save()
-                    
-                    # Réduire le stock
-                    for item in order.items.all():
-                        product = item.product
-                        product.stock_quantity -= item.quantity
-                        product.save()
-                    
-                    return Response({'status': 'payment_confirmed'})
-                else:
-                    return Response(
-                        {'error': 'Payment not completed'},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            except stripe.error.StripeError as e:
-                return Response(
-                    {'error': str(e)},
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-        
-        return Response(
-            {'error': 'No payment intent found'},
-            status=status.HTTP_400_BAD_REQUEST
-        )
+        if not order.stripe_payment_intent_id:
+            return Response(
+                {'error': 'No payment intent found'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-class WishlistViewSet(viewsets.ModelViewSet):
+        # Confirmée par webhook (ou reconcile_payments) : la passerelle n'est pas interrogée
+        payment_status = PaymentService.confirm(order)
+        if payment_status != 'succeeded':
+            return Response(
+                {'error': 'Payment not completed'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({'status': 'payment_confirmed'})
+
+class WishlistViewSet(QuerysetOptimizerMixin, viewsets.ModelViewSet):
+    queryset = Wishlist.objects.all()
     serializer_class = WishlistSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         customer = get_object_or_404(Customer, user=self.request.user)
-        return Wishlist.objects.filter(customer=customer)
+        return super().get_queryset().filter(customer=customer)
 
     @action(detail=True, methods=['post'])
     def add_product(self, request, pk=None):
@@ -245,4 +380,18 @@ class WishlistViewSet(viewsets.ModelViewSet):
         product = get_object_or_404(Product, id=product_id)
         wishlist.products.remove(product)
         
-        return Response(status=status.HTTP_204_NO_CONTENT)
\ No newline at end of file
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+@api_view(['POST'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def payment_webhook(request):
+    """Webhook de la passerelle : signature vérifiée, événement enregistré, traitement différé"""
+    try:
+        event = get_gateway().parse_event(request.body, request.headers.get('Stripe-Signature', ''))
+    except PaymentGatewayError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Un seul INSERT : acquittement immédiat, les doublons sont ignorés
+    PaymentEventInbox.receive(event)
+    return Response({'received': True})
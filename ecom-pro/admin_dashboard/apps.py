@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class AdminDashboardConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'admin_dashboard'
\ No newline at end of file
+    name = 'admin_dashboard'
+
+    def ready(self):
+        import admin_dashboard.signals
@@ -0,0 +1,24 @@
+# Generated by Django 5.0.1 on 2026-10-18 12:55
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('admin_dashboard', '0001_initial'),
+        ('shop', '0005_order_order_keyset_idx_product_product_keyset_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='accountingentry',
+            index=models.Index(fields=['entry_date', 'id'], name='entry_keyset_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['created_at', 'id'], name='invoice_keyset_idx'),
+        ),
+    ]
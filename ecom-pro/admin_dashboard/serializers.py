@@ -130,6 +130,11 @@ class InvoiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Invoice
         fields = '__all__'
+        # Chemins d'import : shop.serializers n'est chargé qu'au premier dépliage
+        expandable_fields = {
+            'customer': 'shop.serializers.CustomerSerializer',
+            'order': 'shop.serializers.OrderSerializer',
+        }
 
     def get_balance_due(self, obj):
         total_payments = sum(payment.amount for payment in obj.payments.all())
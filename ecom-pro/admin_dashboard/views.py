@@ -8,11 +8,13 @@ from django.http import HttpResponse
 from datetime import datetime, timedelta
 from decimal import Decimal
 from .utils import generate_invoice_pdf, send_invoice_email, get_invoices_by_period
+from pagination import SelectablePagination
+from query_optimizer import QuerysetOptimizerMixin
 
 from .models import (
     Department, Employee, Leave,
     BelgianChartOfAccounts, AccountingJournal, AccountingEntry,
-    BelgianVATDeclaration, Invoice, Payment
+    BelgianVATDeclaration, Invoice, Payment, INVOICE_NUMBERS, ENTRY_NUMBERS
 )
 from .serializers import (
     DepartmentSerializer, EmployeeSerializer, LeaveSerializer,
@@ -29,7 +31,7 @@ class DepartmentViewSet(viewsets.ModelViewSet):
     serializer_class = DepartmentSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
 
-class EmployeeViewSet(viewsets.ModelViewSet):
+class EmployeeViewSet(QuerysetOptimizerMixin, viewsets.ModelViewSet):
     queryset = Employee.objects.all()
     serializer_class = EmployeeSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
@@ -48,7 +50,7 @@ class EmployeeViewSet(viewsets.ModelViewSet):
             'by_department': list(by_department)
         })
 
-class LeaveViewSet(viewsets.ModelViewSet):
+class LeaveViewSet(QuerysetOptimizerMixin, viewsets.ModelViewSet):
     queryset = Leave.objects.all()
     serializer_class = LeaveSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
@@ -72,7 +74,7 @@ class LeaveViewSet(viewsets.ModelViewSet):
 
 # ============ COMPTABILITÉ ============
 
-class BelgianChartOfAccountsViewSet(viewsets.ModelViewSet):
+class BelgianChartOfAccountsViewSet(QuerysetOptimizerMixin, viewsets.ModelViewSet):
     queryset = BelgianChartOfAccounts.objects.filter(is_active=True)
     serializer_class = BelgianChartOfAccountsSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
@@ -85,12 +87,14 @@ class AccountingJournalViewSet(viewsets.ModelViewSet):
     serializer_class = AccountingJournalSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
 
-class AccountingEntryViewSet(viewsets.ModelViewSet):
+class AccountingEntryViewSet(QuerysetOptimizerMixin, viewsets.ModelViewSet):
     queryset = AccountingEntry.objects.all()
     serializer_class = AccountingEntrySerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
     filterset_fields = ['journal', 'entry_date']
     ordering = ['-entry_date', '-created_at']
+    pagination_class = SelectablePagination
+    keyset_ordering = ('-entry_date', '-id')
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -98,15 +102,9 @@ class AccountingEntryViewSet(viewsets.ModelViewSet):
         return AccountingEntrySerializer
 
     def perform_create(self, serializer):
-        # Générer le numéro d'écriture automatiquement
+        # Numéro d'écriture continu par journal et par exercice
         journal = serializer.validated_data['journal']
-        last_entry = AccountingEntry.objects.filter(journal=journal).order_by('-entry_number').first()
-        
-        if last_entry:
-            last_number = int(last_entry.entry_number.split('-')[-1])
-            entry_number = f"{timezone.now().year}-{last_number + 1:06d}"
-        else:
-            entry_number = f"{timezone.now().year}-000001"
+        entry_number = ENTRY_NUMBERS.next(scope=journal.pk)
         
         serializer.save(
             entry_number=entry_number,
@@ -214,13 +212,15 @@ class BelgianVATDeclarationViewSet(viewsets.ModelViewSet):
 
 # ============ FACTURATION ============
 
-class InvoiceViewSet(viewsets.ModelViewSet):
+class InvoiceViewSet(QuerysetOptimizerMixin, viewsets.ModelViewSet):
     queryset = Invoice.objects.all()
     serializer_class = InvoiceSerializer
     permission_classes = []
     filterset_fields = ['invoice_type', 'status', 'customer']
     search_fields = ['invoice_number', 'customer__user__email']
     ordering = ['-invoice_date']
+    pagination_class = SelectablePagination
+    keyset_ordering = ('-created_at', '-id')
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -228,17 +228,8 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         return InvoiceSerializer
 
     def perform_create(self, serializer):
-        # Générer le numéro de facture automatiquement
-        year = timezone.now().year
-        last_invoice = Invoice.objects.filter(
-            invoice_number__startswith=f"FAC{year}"
-        ).order_by('-invoice_number').first()
-        
-        if last_invoice:
-            last_number = int(last_invoice.invoice_number[-4:])
-            invoice_number = f"FAC{year}{last_number + 1:04d}"
-        else:
-            invoice_number = f"FAC{year}0001"
+        # Numérotation continue des factures
+        invoice_number = INVOICE_NUMBERS.next()
         
         serializer.save(invoice_number=invoice_number)
 
@@ -290,7 +281,7 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(invoices, many=True)
         return Response(serializer.data)
 
-class PaymentViewSet(viewsets.ModelViewSet):
+class PaymentViewSet(QuerysetOptimizerMixin, viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated, IsAdminUser]
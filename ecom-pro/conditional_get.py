@@ -0,0 +1,91 @@
+"""
+Requêtes conditionnelles (ETag / Last-Modified) pour les vues en lecture
+"""
+import hashlib
+import logging
+from django.db.models import Count, Max
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from cache_system import CacheManager
+
+logger = logging.getLogger(__name__)
+
+class NotModified(Exception):
+    """Interrompt la vue avant la sérialisation : le client a déjà la réponse"""
+
+    def __init__(self, response):
+        self.response = response
+        super().__init__(response.status_code)
+
+class ConditionalGetMixin:
+    """304 Not Modified (ou 412) calculé avant toute sérialisation.
+
+    Les validateurs sont obtenus par une requête d'agrégat sur le queryset
+    filtré (``max(updated_at)`` et nombre de lignes, ce qui couvre aussi les
+    suppressions), ou, si la vue déclare ``version_namespace``, par le
+    compteur de version du cache incrémenté à chaque modification. L'ETag
+    est faible : il dépend de l'URL complète, du format négocié et de ces
+    validateurs, pas des octets de la réponse.
+    """
+
+    conditional_actions = ('list', 'retrieve')
+    # Espace de version CacheManager ; None : max(updated_field) + COUNT
+    version_namespace = None
+    updated_field = 'updated_at'
+
+    def get_validator_queryset(self):
+        """Lignes dont dépend la réponse, avant pagination"""
+        queryset = self.filter_queryset(self.get_queryset())
+        if self.action == 'retrieve':
+            lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+            queryset = queryset.filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        return queryset
+
+    def get_validators(self, request):
+        """(état, dernière modification ou None) de la ressource demandée"""
+        if self.version_namespace:
+            return CacheManager.get_version(self.version_namespace), None
+        state = self.get_validator_queryset().order_by().aggregate(
+            last_modified=Max(self.updated_field), count=Count('pk')
+        )
+        last_modified = state['last_modified']
+        return (last_modified.isoformat() if last_modified else None, state['count']), last_modified
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.conditional_headers = {}
+        if request.method not in ('GET', 'HEAD') or self.action not in self.conditional_actions:
+            return
+
+        state, last_modified = self.get_validators(request)
+        signature = repr((
+            type(self).__name__, self.action, request.get_full_path(),
+            request.accepted_renderer.format, state
+        ))
+        etag = 'W/' + quote_etag(hashlib.md5(signature.encode()).hexdigest())
+        # Résolution HTTP : la seconde
+        timestamp = int(last_modified.timestamp()) if last_modified else None
+        self.conditional_headers = {'ETag': etag}
+        if timestamp is not None:
+            self.conditional_headers['Last-Modified'] = http_date(timestamp)
+
+        response = get_conditional_response(
+            request, etag=etag, last_modified=timestamp,
+            response=HttpResponse(headers=self.conditional_headers)
+        )
+        if response.status_code != 200:
+            logger.debug(f"Conditional GET {response.status_code} for {request.path}")
+            raise NotModified(response)
+
+    def handle_exception(self, exc):
+        if isinstance(exc, NotModified):
+            return exc.response
+        return super().handle_exception(exc)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if response.status_code == 200:
+            for header, value in getattr(self, 'conditional_headers', {}).items():
+                response.headers.setdefault(header, value)
+        return response
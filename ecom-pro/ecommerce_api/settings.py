@@ -142,6 +142,9 @@ SPECTACULAR_SETTINGS = {
 # Stripe Configuration
 STRIPE_PUBLISHABLE_KEY = ''
 STRIPE_SECRET_KEY = ''
+STRIPE_WEBHOOK_SECRET = ''
+# 'stripe' ou 'fake' (passerelle en mémoire pour les tests et bancs de charge)
+PAYMENT_GATEWAY = 'stripe'
 
 # Cache configuration avancée
 CACHES = {
@@ -160,8 +163,12 @@ CACHES = {
     }
 }
 
-# Configuration des sessions avec cache
-SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
+# Versions des espaces de clés (ETag, facettes, cache de réponses) : en base tant que
+# le cache par défaut est local au processus ; vide avec Redis/Memcached (cache.incr)
+CACHE_VERSION_STORE = 'shop.cache_versions.SequenceCounterVersionStore'
+
+# Sessions lues en cache, écrites aussi en base : elles survivent au redémarrage
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
 SESSION_CACHE_ALIAS = 'sessions'
 SESSION_COOKIE_AGE = 86400  # 24 heures
 SESSION_COOKIE_SECURE = False  # True en production avec HTTPS
@@ -241,6 +248,14 @@ OPTIMIZATION_SETTINGS = {
     'CACHE_WARM_ON_STARTUP': True,
 }
 
+# Paniers sans modification depuis ce nombre de jours supprimés par sweep_carts
+CART_IDLE_DAYS = 30
+
+# Cache des paniers (écriture différée) : doit être partagé entre processus et
+# sans éviction (Redis noeviction). Sur LocMem, paniers écrits directement en base.
+# Cache partagé : planifier flush_carts chaque minute (voir README, Tâches planifiées)
+CART_STORE_CACHE = 'default'
+
 # Celery Configuration
 CELERY_BROKER_URL = 'redis://localhost:6379/0'
 CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
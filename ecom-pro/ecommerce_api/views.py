@@ -1,4 +1,34 @@
 from django.shortcuts import render
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.views import TokenObtainPairView
+from cookie_manager import CartCookies
+from shop.cart_store import CartStore
+import logging
+
+logger = logging.getLogger(__name__)
 
 def home(request):
-    return render(request, 'home.html')
\ No newline at end of file
+    return render(request, 'home.html')
+
+class LoginView(TokenObtainPairView):
+    """Obtention du jeton JWT ; le panier invité (cookie) rejoint le panier du client"""
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        try:
+            serializer.is_valid(raise_exception=True)
+        except TokenError as e:
+            raise InvalidToken(e.args[0])
+
+        response = Response(serializer.validated_data, status=status.HTTP_200_OK)
+        items = CartCookies.get_items(request)
+        if items:
+            try:
+                CartStore.merge_guest(serializer.user, items)
+                CartCookies.clear_cart(response)
+            except Exception as e:
+                # La connexion n'échoue pas ; le cookie est gardé pour une prochaine fusion
+                logger.error(f"Guest cart merge error for user {serializer.user.pk}: {e}")
+        return response
@@ -6,6 +6,8 @@ import logging
 from django.utils.deprecation import MiddlewareMixin
 from django.http import JsonResponse
 from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import parse_http_date_safe
 from cache_system import CacheManager, SessionCache
 from cookie_manager import SecureCookieManager, UserPreferenceCookies
 from low_level_optimizations import PerformanceMonitor, MemoryOptimizer
@@ -59,46 +61,73 @@ class PerformanceMiddleware(MiddlewareMixin):
         return response
 
 class CacheMiddleware(MiddlewareMixin):
-    """Middleware pour la gestion du cache"""
+    """Middleware pour la gestion du cache.
+
+    Seules les requêtes anonymes sont servies et mises en cache : la clé ne
+    dépend que du chemin et des paramètres, une réponse propre à un
+    utilisateur (actions réservées au personnel) n'y a pas sa place.
+
+    La clé inclut la version CacheManager du chemin, celle qui sert aussi
+    d'ETag à la vue : toute modification rend les réponses en cache
+    inaccessibles. Les produits n'ont pas de telle version (ETag calculé en
+    base par ConditionalGetMixin) et ne passent donc pas par ce cache.
+    """
     
     CACHEABLE_METHODS = ['GET']
-    CACHE_PATHS = ['/api/shop/products/', '/api/shop/categories/', '/api/service/services/']
+    # Chemin -> espace de version (Category.VERSION_NAMESPACE, Service.VERSION_NAMESPACE)
+    CACHE_PATHS = {'/api/shop/categories/': 'categories', '/api/service/services/': 'services'}
+
+    def get_cache_key(self, request):
+        """Clé versionnée, ou None si la requête ne passe pas par le cache"""
+        if request.method not in self.CACHEABLE_METHODS:
+            return None
+        namespace = next((ns for path, ns in self.CACHE_PATHS.items() if request.path.startswith(path)), None)
+        if namespace is None:
+            return None
+        # Jeton JWT (authentifié par DRF, après ce middleware) ou session ouverte
+        user = getattr(request, 'user', None)
+        if 'HTTP_AUTHORIZATION' in request.META or (user and user.is_authenticated):
+            return None
+        return CacheManager.generate_cache_key(
+            'middleware_response',
+            request.path,
+            request.GET.dict(),
+            CacheManager.get_version(namespace)
+        )
     
     def process_request(self, request):
         """Vérifier le cache avant de traiter la requête"""
-        if (request.method in self.CACHEABLE_METHODS and 
-            any(request.path.startswith(path) for path in self.CACHE_PATHS)):
-            
-            cache_key = CacheManager.generate_cache_key(
-                'middleware_cache', 
-                request.path, 
-                request.GET.dict()
-            )
+        # Clé calculée une fois : une réponse est rangée sous la version lue avant la vue
+        request._response_cache_key = cache_key = self.get_cache_key(request)
+        if cache_key:
             
             cached_response = CacheManager.get_cache(cache_key)
             if cached_response:
                 logger.debug(f"Cache hit for {request.path}")
-                return JsonResponse(cached_response)
+                # Les validateurs de la réponse d'origine permettent encore un 304
+                response = JsonResponse(cached_response['content'], headers=cached_response['validators'])
+                return get_conditional_response(
+                    request,
+                    etag=response.get('ETag'),
+                    last_modified=parse_http_date_safe(response.get('Last-Modified', '')),
+                    response=response
+                )
         
         return None
     
     def process_response(self, request, response):
         """Mettre en cache la réponse si applicable"""
-        if (request.method in self.CACHEABLE_METHODS and 
-            any(request.path.startswith(path) for path in self.CACHE_PATHS) and
-            response.status_code == 200):
+        cache_key = getattr(request, '_response_cache_key', None)
+        if cache_key and response.status_code == 200 and not getattr(response, 'streaming', False):
             
             try:
-                cache_key = CacheManager.generate_cache_key(
-                    'middleware_cache', 
-                    request.path, 
-                    request.GET.dict()
-                )
-                
                 # Essayer de parser le JSON pour le mettre en cache
                 if hasattr(response, 'content'):
                     import json
-                    response_data = json.loads(response.content.decode('utf-8'))
+                    response_data = {
+                        'content': json.loads(response.content.decode('utf-8')),
+                        'validators': {h: response[h] for h in ('ETag', 'Last-Modified') if h in response},
+                    }
                     CacheManager.set_cache(cache_key, response_data, 1800, 'api_responses')
                     logger.debug(f"Response cached for {request.path}")
                     
@@ -133,9 +162,8 @@ class UserPreferenceMiddleware(MiddlewareMixin):
     def process_response(self, request, response):
         """Sauvegarder les préférences modifiées"""
         # Vérifier s'il y a des préférences à sauvegarder
-        if hasattr(request, '_preferences_to_save'):
-            for pref, value in request._preferences_to_save.items():
-                UserPreferenceCookies.set_preference(response, pref, value)
+        if getattr(request, '_preferences_to_save', None):
+            UserPreferenceCookies.set_preferences(request, response, request._preferences_to_save)
         
         return response
 
@@ -165,9 +193,15 @@ class SecurityMiddleware(MiddlewareMixin):
 
 class RateLimitMiddleware(MiddlewareMixin):
     """Middleware de limitation de taux"""
+
+    # Appels signés de la passerelle de paiement, livrés en rafales
+    EXEMPT_PATHS = ('/api/shop/payments/webhook/',)
     
     def process_request(self, request):
         """Vérifier les limites de taux"""
+        if request.path in self.EXEMPT_PATHS:
+            return None
+
         # Obtenir l'IP du client
         client_ip = self.get_client_ip(request)
         
@@ -0,0 +1,215 @@
+"""
+Pagination par clé (keyset) et comptage estimé pour les grandes listes
+"""
+import json
+import base64
+import logging
+from collections import OrderedDict
+from django.core.paginator import Paginator as DjangoPaginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+from cache_system import CacheManager
+
+logger = logging.getLogger(__name__)
+
+def estimate_count(queryset) -> int:
+    """Nombre approximatif de lignes d'un queryset.
+
+    PostgreSQL : estimation du planificateur (EXPLAIN), sans parcours.
+    Autres moteurs : COUNT(*) exact, mis en cache pour ne pas être recalculé
+    à chaque page.
+    """
+    connection = connections[queryset.db]
+
+    if connection.vendor == 'postgresql':
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    cache_key = CacheManager.generate_cache_key('estimated_count', str(queryset.query))
+    count = CacheManager.get_cache(cache_key)
+    if count is None:
+        count = queryset.count()
+        CacheManager.set_cache(cache_key, count, category='counts')
+    return count
+
+class EstimatedCountPaginator(DjangoPaginator):
+    """Paginator Django dont le total provient de estimate_count()"""
+
+    @cached_property
+    def count(self):
+        return estimate_count(self.object_list)
+
+class KeysetPagination(BasePagination):
+    """Pagination par curseur sur une clé stable, ex. (created_at, id).
+
+    Chaque page est obtenue par une condition WHERE sur la dernière clé vue
+    (parcours d'index) au lieu d'un OFFSET : la page 1000 coûte autant que la
+    page 1. La clé est lue dans ``view.keyset_ordering`` et doit se terminer
+    par un champ unique.
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering = ('-created_at', '-id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = tuple(getattr(view, 'keyset_ordering', self.ordering))
+        self.page_size = self.get_page_size(request)
+        self.model = queryset.model
+
+        position, reverse = self.decode_cursor(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param) == 'estimated':
+            self.count = estimate_count(queryset)
+
+        ordering = self._reverse_ordering() if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._keyset_filter(ordering, position))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        # Une page existe toujours dans la direction d'où l'on vient
+        if reverse:
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+
+        self.first_key = self._key(rows[0]) if rows else None
+        self.last_key = self._key(rows[-1]) if rows else None
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def get_paginated_response(self, data):
+        payload = OrderedDict()
+        if self.count is not None:
+            payload['count'] = self.count
+        payload['next'] = self.get_next_link()
+        payload['previous'] = self.get_previous_link()
+        payload['results'] = data
+        return Response(payload)
+
+    def get_next_link(self):
+        if not self.has_next or self.last_key is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.last_key, False))
+
+    def get_previous_link(self):
+        if not self.has_previous or self.first_key is None:
+            return None
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.first_key, True))
+
+    # ---- Clé et curseur ----
+
+    def _fields(self):
+        return [name.lstrip('-') for name in self.ordering]
+
+    def _key(self, obj):
+        if isinstance(obj, dict):
+            # Queryset .values() : la clé doit figurer parmi les colonnes lues
+            return [obj[name] for name in self._fields()]
+        return [getattr(obj, 'pk' if name == 'id' else name) for name in self._fields()]
+
+    def _reverse_ordering(self):
+        return tuple(name[1:] if name.startswith('-') else f'-{name}' for name in self.ordering)
+
+    @staticmethod
+    def _keyset_filter(ordering, position):
+        """(a, b) après (x, y) : a > x OR (a = x AND b > y), sens selon l'ordre"""
+        condition = Q()
+        equal = Q()
+        for name, value in zip(ordering, position):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{field}__{lookup}': value})
+            equal &= Q(**{field: value})
+        return condition
+
+    def encode_cursor(self, key, reverse: bool) -> str:
+        values = [value.isoformat() if hasattr(value, 'isoformat') else value for value in key]
+        raw = json.dumps({'k': values, 'r': int(reverse)}, default=str)
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            data = json.loads(raw)
+            fields = self._fields()
+            if len(data['k']) != len(fields):
+                raise ValueError('cursor length')
+            position = [
+                self.model._meta.get_field(name).to_python(value)
+                for name, value in zip(fields, data['k'])
+            ]
+            return position, bool(data.get('r'))
+        except Exception as e:
+            logger.debug(f"Invalid cursor {encoded}: {e}")
+            raise NotFound('Curseur invalide')
+
+class SelectablePagination(PageNumberPagination):
+    """Pagination par numéro de page (défaut) ou par curseur à la demande.
+
+    ``?pagination=cursor`` (ou la présence de ``cursor``) bascule sur
+    KeysetPagination ; ``?count=estimated`` remplace le COUNT(*) exact par
+    une estimation dans les deux modes.
+    """
+
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    mode_query_param = 'pagination'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if (request.query_params.get(self.mode_query_param) == 'cursor' or
+                KeysetPagination.cursor_query_param in request.query_params):
+            self.keyset = KeysetPagination()
+            return self.keyset.paginate_queryset(queryset, request, view)
+
+        if request.query_params.get(self.count_query_param) == 'estimated':
+            self.django_paginator_class = EstimatedCountPaginator
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def get_next_link(self):
+        if self.keyset is not None:
+            return self.keyset.get_next_link()
+        return super().get_next_link()
+
+    def get_previous_link(self):
+        if self.keyset is not None:
+            return self.keyset.get_previous_link()
+        return super().get_previous_link()
@@ -0,0 +1,346 @@
+"""
+Optimisation automatique des querysets à partir des champs des serializers
+"""
+import logging
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from django.utils.module_loading import import_string
+from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+
+logger = logging.getLogger(__name__)
+
+def parse_fieldset(value: str) -> dict:
+    """'id,name,images.image' -> {'id': {}, 'name': {}, 'images': {'image': {}}}"""
+    tree = {}
+    for path in value.split(','):
+        node = tree
+        for name in filter(None, (part.strip() for part in path.split('.'))):
+            node = node.setdefault(name, {})
+    return tree
+
+def _freeze(tree):
+    if tree is None:
+        return None
+    return tuple(sorted((name, _freeze(child)) for name, child in tree.items()))
+
+def apply_fieldset(serializer, only=None, expand=None):
+    """Restreindre un serializer et ses serializers imbriqués aux champs demandés.
+
+    ``only`` : arbre des champs gardés (None : tous) ; ``expand`` : arbre des
+    relations à déplier, parmi ``Meta.expandable_fields`` ({champ: serializer
+    ou chemin d'import}). Une relation dépliée est toujours gardée. Les noms
+    inconnus sont ignorés.
+    """
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+    expand = expand or {}
+    if hasattr(serializer, 'apply_fieldset'):
+        # Serializer sans champs DRF (lignes .values()) : il filtre lui-même
+        serializer.apply_fieldset(only, expand)
+        return
+    if not hasattr(serializer, 'fields'):
+        return
+
+    fields = serializer.fields
+    if only is not None:
+        for name in list(fields):
+            if name not in only and name not in expand:
+                fields.pop(name)
+
+    expandable = getattr(getattr(serializer, 'Meta', None), 'expandable_fields', {})
+    for name in expand:
+        if name in expandable and name in fields:
+            target = expandable[name]
+            if isinstance(target, str):
+                target = import_string(target)
+            kwargs = {'many': isinstance(fields[name], serializers.ManyRelatedField), 'read_only': True}
+            if fields[name].source != name:
+                kwargs['source'] = fields[name].source
+            # BindingDict : l'affectation lie le nouveau champ au serializer
+            fields[name] = target(**kwargs)
+
+    for name, field in fields.items():
+        if isinstance(field, serializers.BaseSerializer):
+            apply_fieldset(field, (only or {}).get(name) or None, expand.get(name))
+
+class QueryPlan:
+    """Jointures, préchargements et colonnes nécessaires à un serializer.
+
+    ``columns`` n'est tenu que pour un serializer restreint par ``?fields=`` :
+    chemins passés à ``.only()``. Un niveau (préfixe de relation) dont un
+    champ lit un attribut Python inconnu est dans ``open_paths`` et n'est pas
+    restreint ; la racine ouverte désactive ``.only()``.
+    """
+
+    def __init__(self, sparse: bool = False):
+        self.select_related = set()
+        self.prefetch_related = {}
+        self.unoptimized = []
+        self.columns = set() if sparse else None
+        self.open_paths = set()
+
+    def only(self, required=()):
+        """Colonnes à charger, ou None si le queryset ne peut pas être restreint"""
+        if self.columns is None or '' in self.open_paths:
+            return None
+        columns = set(required)
+        for column in self.columns:
+            level = column.rsplit('__', 1)[0] + '__' if '__' in column else ''
+            if level not in self.open_paths:
+                columns.add(column)
+        return sorted(columns)
+
+    def apply(self, queryset, required=()):
+        if self.select_related:
+            queryset = queryset.select_related(*sorted(self.select_related))
+        if self.prefetch_related:
+            queryset = queryset.prefetch_related(*self.prefetch_related.values())
+        columns = self.only(required)
+        if columns:
+            queryset = queryset.only(*columns)
+        return queryset
+
+class SerializerQueryOptimizer:
+    """Déduit select_related / prefetch_related des sources d'un serializer.
+
+    - ``source='category.name'`` : jointure sur les relations traversées ;
+    - serializer imbriqué simple : jointure puis analyse récursive ;
+    - serializer imbriqué ``many=True`` : Prefetch dont le queryset est
+      lui-même optimisé pour le serializer enfant.
+
+    Les SerializerMethodField et les sources qui ne sont pas des champs du
+    modèle (propriétés, méthodes) ne peuvent pas être analysés : ils sont
+    signalés dans ``QueryPlan.unoptimized``.
+    """
+
+    _plans = {}
+    # Les plans restreints dépendent de la requête du client : nombre borné
+    MAX_PLANS = 512
+
+    @classmethod
+    def plan_for(cls, serializer_class, fieldset=None):
+        """Plan calculé une seule fois par classe de serializer (et par jeu de champs)"""
+        key = (serializer_class, _freeze(fieldset[0]) if fieldset else None, _freeze(fieldset[1]) if fieldset else None)
+        if key not in cls._plans:
+            serializer = serializer_class()
+            plan = QueryPlan(sparse=fieldset is not None)
+            if fieldset is not None:
+                apply_fieldset(serializer, *fieldset)
+            cls._analyze(serializer, serializer.Meta.model, '', plan)
+            if plan.unoptimized and fieldset is None:
+                logger.warning(
+                    f"{serializer_class.__name__}: fields not optimized: {', '.join(plan.unoptimized)}"
+                )
+            if len(cls._plans) >= cls.MAX_PLANS:
+                cls._plans.clear()
+            cls._plans[key] = plan
+        return cls._plans[key]
+
+    @classmethod
+    def optimize(cls, queryset, serializer_class, fieldset=None, required=()):
+        if not getattr(getattr(serializer_class, 'Meta', None), 'model', None):
+            return queryset
+        return cls.plan_for(serializer_class, fieldset).apply(queryset, required)
+
+    # ---- Analyse ----
+
+    @staticmethod
+    def _relation(model, name):
+        """Champ de relation (directe ou inverse) correspondant à un attribut, sinon None"""
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            # Relation inverse sans related_name : accesseur « xxx_set »
+            for related in model._meta.related_objects:
+                if related.get_accessor_name() == name:
+                    return related
+            return None
+        return field if field.is_relation else False
+
+    @classmethod
+    def lookup_columns(cls, model, attrs, prefix=''):
+        """Colonnes lues en suivant un chemin d'attributs.
+
+        Retourne (colonnes, niveau ouvert) : les clés étrangères traversées
+        puis le champ final. Si le chemin aboutit à un attribut Python
+        (propriété, méthode), ses dépendances sont inconnues : le préfixe de
+        ce modèle est retourné comme niveau à ne pas restreindre.
+        """
+        columns = []
+        for attr in attrs:
+            relation = cls._relation(model, attr)
+            if relation is None:
+                return columns, prefix
+            if relation is False:
+                columns.append(f'{prefix}{attr}')
+                break
+            if not relation.concrete or relation.many_to_many:
+                # Relation multiple : préchargée, rien à lire sur ce modèle
+                break
+            columns.append(f'{prefix}{attr}')
+            prefix = f'{prefix}{attr}__'
+            model = relation.related_model
+        return columns, None
+
+    @classmethod
+    def _collect_columns(cls, serializer, field, model, prefix, plan):
+        """Colonnes lues par un champ gardé (uniquement pour un plan restreint)"""
+        if plan.columns is None:
+            return
+        # Champs calculés : colonnes du même modèle déclarées par le serializer
+        # (tuple vide : valeur annotée par le queryset de la vue)
+        dependencies = getattr(getattr(serializer, 'Meta', None), 'field_dependencies', {})
+        if field.field_name in dependencies:
+            plan.columns.update(f'{prefix}{name}' for name in dependencies[field.field_name])
+            return
+        if isinstance(field, serializers.SerializerMethodField) or field.source == '*':
+            plan.open_paths.add(prefix)
+            return
+        columns, open_path = cls.lookup_columns(model, field.source_attrs, prefix)
+        plan.columns.update(columns)
+        if open_path is not None:
+            plan.open_paths.add(open_path)
+
+    @classmethod
+    def _analyze(cls, serializer, model, prefix, plan):
+        for name, field in serializer.fields.items():
+            if field.write_only or isinstance(field, serializers.HiddenField):
+                continue
+            label = f'{prefix}{name}'.replace('__', '.')
+            cls._collect_columns(serializer, field, model, prefix, plan)
+            if name in getattr(getattr(serializer, 'Meta', None), 'field_dependencies', {}):
+                # Dépendances déclarées (colonnes ou annotation du queryset) : rien à joindre
+                continue
+
+            if isinstance(field, serializers.SerializerMethodField):
+                plan.unoptimized.append(label)
+                continue
+            if field.source == '*':
+                continue
+
+            if isinstance(field, serializers.ListSerializer):
+                cls._analyze_many(field.child, model, field.source_attrs, prefix, plan, label)
+            elif isinstance(field, serializers.ManyRelatedField):
+                cls._analyze_many(None, model, field.source_attrs, prefix, plan, label)
+            elif isinstance(field, serializers.BaseSerializer):
+                cls._analyze_single(field, model, field.source_attrs, prefix, plan, label)
+            elif isinstance(field, serializers.PrimaryKeyRelatedField) and len(field.source_attrs) == 1:
+                # DRF lit directement <fk>_id : aucune jointure nécessaire
+                continue
+            else:
+                cls._analyze_source(field, model, field.source_attrs, prefix, plan, label)
+
+    @classmethod
+    def _walk(cls, model, attrs, prefix, plan, label):
+        """Suivre les relations directes d'un chemin ; retourne (modèle, chemin, reste)"""
+        path = prefix
+        for index, attr in enumerate(attrs):
+            relation = cls._relation(model, attr)
+            if relation is None:
+                if index == 0:
+                    plan.unoptimized.append(label)
+                return model, path, attrs[index:]
+            if relation is False:
+                return model, path, attrs[index + 1:]
+            if relation.one_to_many or relation.many_to_many:
+                return model, path, attrs[index:]
+            path = f'{path}{attr}__'
+            plan.select_related.add(path.rstrip('_'))
+            model = relation.related_model
+        return model, path, []
+
+    @classmethod
+    def _analyze_source(cls, field, model, attrs, prefix, plan, label):
+        model, path, rest = cls._walk(model, attrs, prefix, plan, label)
+        if rest and cls._relation(model, rest[0]) not in (None, False):
+            # Relation multiple atteinte par une source pointée : préchargement simple
+            lookup = f'{path}{rest[0]}'
+            plan.prefetch_related.setdefault(lookup, lookup)
+
+    @classmethod
+    def _analyze_single(cls, serializer, model, attrs, prefix, plan, label):
+        related_model, path, rest = cls._walk(model, attrs, prefix, plan, label)
+        if rest:
+            plan.unoptimized.append(label)
+            return
+        cls._analyze(serializer, related_model, path, plan)
+
+    @classmethod
+    def _analyze_many(cls, child, model, attrs, prefix, plan, label):
+        model, path, rest = cls._walk(model, attrs[:-1], prefix, plan, label)
+        relation = cls._relation(model, attrs[-1]) if not rest else None
+        if not relation:
+            plan.unoptimized.append(label)
+            return
+
+        lookup = f'{path}{attrs[-1]}'
+        queryset = relation.related_model._default_manager.all()
+        if child is not None and getattr(getattr(child, 'Meta', None), 'model', None):
+            child_plan = QueryPlan(sparse=plan.columns is not None)
+            cls._analyze(child, relation.related_model, '', child_plan)
+            plan.unoptimized.extend(f'{label}.{name}' for name in child_plan.unoptimized)
+            # Relation inverse : la clé étrangère sert à rattacher les lignes préchargées
+            required = [relation.field.name] if relation.one_to_many else []
+            queryset = child_plan.apply(queryset, required)
+        plan.prefetch_related[lookup] = Prefetch(lookup, queryset=queryset)
+
+class QuerysetOptimizerMixin:
+    """Mixin de ViewSet : applique le plan du serializer à get_queryset().
+
+    ``select_related_extra`` / ``prefetch_related_extra`` complètent le plan
+    pour les champs signalés comme non optimisables.
+
+    En lecture, ``?fields=id,name,images.image`` restreint la réponse (et les
+    colonnes, jointures et préchargements) aux champs demandés ;
+    ``?expand=category`` déplie une relation déclarée dans
+    ``Meta.expandable_fields`` du serializer.
+    """
+
+    select_related_extra = ()
+    prefetch_related_extra = ()
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+
+    def get_fieldset(self):
+        """(champs, dépliages) demandés, ou None pour la représentation complète"""
+        request = getattr(self, 'request', None)
+        if request is None or request.method not in SAFE_METHODS:
+            return None
+        only = request.query_params.get(self.fields_query_param)
+        expand = request.query_params.get(self.expand_query_param)
+        if not only and not expand:
+            return None
+        return (parse_fieldset(only) if only else None, parse_fieldset(expand) if expand else {})
+
+    def get_required_columns(self, model):
+        """Colonnes toujours chargées : clé de pagination et relations des *_extra"""
+        from pagination import KeysetPagination
+
+        required = set()
+        ordering = getattr(self, 'keyset_ordering', KeysetPagination.ordering)
+        lookups = [name.lstrip('-') for name in ordering] + list(self.select_related_extra) + [
+            getattr(lookup, 'prefetch_through', lookup) for lookup in self.prefetch_related_extra
+        ]
+        for lookup in lookups:
+            columns, _ = SerializerQueryOptimizer.lookup_columns(model, lookup.split('__'))
+            required.update(columns)
+        return required
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        fieldset = self.get_fieldset()
+        required = self.get_required_columns(queryset.model) if fieldset else ()
+        queryset = SerializerQueryOptimizer.optimize(queryset, self.get_serializer_class(), fieldset, required)
+        if self.select_related_extra:
+            queryset = queryset.select_related(*self.select_related_extra)
+        if self.prefetch_related_extra:
+            queryset = queryset.prefetch_related(*self.prefetch_related_extra)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        fieldset = self.get_fieldset()
+        if fieldset is not None:
+            apply_fieldset(serializer, *fieldset)
+        return serializer
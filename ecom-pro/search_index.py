@@ -0,0 +1,193 @@
+"""
+Index de recherche plein texte (SQLite FTS5 / PostgreSQL tsvector + GIN)
+"""
+import re
+import logging
+from typing import List, Optional
+from django.db import connection
+from django.db.models import BooleanField, FloatField, OuterRef, Subquery
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+logger = logging.getLogger(__name__)
+
+class SearchIndex:
+    """Index inversé associé à un modèle.
+
+    Sous SQLite, une table virtuelle FTS5 (rowid = pk du modèle) est tenue à
+    jour par les signaux du modèle. Sous PostgreSQL, un index GIN sur
+    l'expression to_tsvector() est maintenu par la base elle-même.
+    Les autres moteurs ne sont pas indexés et retombent sur le LIKE classique.
+    """
+
+    # Configuration sans racinisation : catalogue multilingue (FR/NL/EN)
+    PG_CONFIG = 'simple'
+
+    def __init__(self, model, fields: List[str], name: Optional[str] = None):
+        self.model = model
+        self.fields = fields
+        self.name = name or f"{model._meta.db_table}_fts"
+
+    # ---- Disponibilité ----
+
+    @staticmethod
+    def is_supported(conn=None) -> bool:
+        """Le moteur courant dispose-t-il d'un index plein texte ?"""
+        vendor = (conn or connection).vendor
+        return vendor in ('sqlite', 'postgresql')
+
+    # ---- Schéma ----
+
+    def _columns(self) -> List[str]:
+        return [self.model._meta.get_field(f).column for f in self.fields]
+
+    def _pg_document(self, alias: str = None) -> str:
+        """Expression tsvector (identique dans l'index et dans les requêtes)"""
+        prefix = f'{alias}.' if alias else ''
+        columns = " || ' ' || ".join(f"coalesce({prefix}\"{column}\", '')" for column in self._columns())
+        return f"to_tsvector('{self.PG_CONFIG}', {columns})"
+
+    def install(self, schema_editor):
+        """Créer l'index (appelé depuis une migration)"""
+        conn = schema_editor.connection
+        table = self.model._meta.db_table
+        if conn.vendor == 'sqlite':
+            columns = ', '.join(self._columns())
+            schema_editor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS "{self.name}" '
+                f"USING fts5({columns}, tokenize='unicode61 remove_diacritics 2')"
+            )
+            schema_editor.execute(
+                f'INSERT INTO "{self.name}"(rowid, {columns}) SELECT id, {columns} FROM "{table}"'
+            )
+        elif conn.vendor == 'postgresql':
+            schema_editor.execute(
+                f'CREATE INDEX IF NOT EXISTS "{self.name}_gin" ON "{table}" '
+                f'USING GIN (({self._pg_document()}))'
+            )
+
+    def uninstall(self, schema_editor):
+        """Supprimer l'index (migration inverse)"""
+        conn = schema_editor.connection
+        if conn.vendor == 'sqlite':
+            schema_editor.execute(f'DROP TABLE IF EXISTS "{self.name}"')
+        elif conn.vendor == 'postgresql':
+            schema_editor.execute(f'DROP INDEX IF EXISTS "{self.name}_gin"')
+
+    # ---- Synchronisation (SQLite uniquement) ----
+
+    def update(self, instance):
+        """Réindexer une instance après sauvegarde"""
+        if connection.vendor != 'sqlite':
+            return
+        columns = self._columns()
+        values = [getattr(instance, f) or '' for f in self.fields]
+        placeholders = ', '.join(['%s'] * (len(columns) + 1))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{self.name}" WHERE rowid = %s', [instance.pk])
+            cursor.execute(
+                f'INSERT INTO "{self.name}"(rowid, {", ".join(columns)}) VALUES ({placeholders})',
+                [instance.pk] + values
+            )
+
+    def remove(self, pk):
+        """Retirer une instance de l'index"""
+        if connection.vendor != 'sqlite':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{self.name}" WHERE rowid = %s', [pk])
+
+    def refresh(self, pks) -> None:
+        """Réindexer un lot de lignes écrites sans signaux (bulk_create, update())"""
+        pks = list(pks)
+        if connection.vendor != 'sqlite' or not pks:
+            return
+        columns = ', '.join(self._columns())
+        table = self.model._meta.db_table
+        placeholders = ', '.join(['%s'] * len(pks))
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{self.name}" WHERE rowid IN ({placeholders})', pks)
+            cursor.execute(
+                f'INSERT INTO "{self.name}"(rowid, {columns}) '
+                f'SELECT id, {columns} FROM "{table}" WHERE id IN ({placeholders})',
+                pks
+            )
+
+    def rebuild(self) -> int:
+        """Reconstruire entièrement l'index (après des update() en masse)"""
+        if connection.vendor != 'sqlite':
+            return 0
+        columns = ', '.join(self._columns())
+        table = self.model._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM "{self.name}"')
+            cursor.execute(
+                f'INSERT INTO "{self.name}"(rowid, {columns}) SELECT id, {columns} FROM "{table}"'
+            )
+            cursor.execute(f'SELECT count(*) FROM "{self.name}"')
+            count = cursor.fetchone()[0]
+        logger.info(f"Search index {self.name} rebuilt: {count} rows")
+        return count
+
+    # ---- Requêtes ----
+
+    @staticmethod
+    def tokenize(terms: str) -> List[str]:
+        """Découper la saisie utilisateur en mots (supprime la syntaxe FTS)"""
+        return re.findall(r'\w+', terms or '')
+
+    def search(self, queryset, terms: str):
+        """Filtrer et classer un queryset par pertinence (préfixes inclus).
+
+        Le queryset peut porter sur un modèle de lecture partageant la clé
+        primaire du modèle indexé (ex. ProductSnapshot).
+        """
+        tokens = self.tokenize(terms)
+        if not tokens:
+            return queryset
+
+        table = self.model._meta.db_table
+        pk_column = f'"{queryset.model._meta.db_table}"."{queryset.model._meta.pk.column}"'
+
+        if connection.vendor == 'sqlite':
+            match = ' '.join(f'"{token}"*' for token in tokens)
+            matching = RawSQL(f'SELECT rowid FROM "{self.name}" WHERE "{self.name}" MATCH %s', [match])
+            # bm25() est négatif : plus petit = plus pertinent
+            rank = RawSQL(
+                f'SELECT -bm25("{self.name}") FROM "{self.name}" '
+                f'WHERE "{self.name}" MATCH %s AND rowid = {pk_column}',
+                [match],
+                output_field=FloatField()
+            )
+            return queryset.filter(pk__in=matching).annotate(search_rank=rank).order_by('-search_rank', 'pk')
+
+        query = ' & '.join(f'{token}:*' for token in tokens)
+        document = self._pg_document(f'"{table}"')
+        tsquery = f"to_tsquery('{self.PG_CONFIG}', %s)"
+        matches = RawSQL(f'{document} @@ {tsquery}', [query], output_field=BooleanField())
+        rank = RawSQL(f'ts_rank({document}, {tsquery})', [query], output_field=FloatField())
+        if queryset.model is not self.model:
+            # Le document n'existe que sur la table indexée : correspondance par clé primaire
+            ranked = self.model._default_manager.filter(matches).annotate(search_rank=rank)
+            return queryset.filter(pk__in=ranked.values('pk')).annotate(
+                search_rank=Subquery(ranked.filter(pk=OuterRef('pk')).values('search_rank')[:1])
+            ).order_by('-search_rank', 'pk')
+        return queryset.filter(matches).annotate(search_rank=rank).order_by('-search_rank', 'pk')
+
+class FullTextSearchFilter(SearchFilter):
+    """Remplaçant de SearchFilter adossé à un SearchIndex.
+
+    La vue déclare ``search_index`` ; sans index disponible (autre moteur),
+    le filtre retombe sur le comportement LIKE de ``search_fields``.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        index = getattr(view, 'search_index', None)
+        terms = request.query_params.get(self.search_param, '')
+
+        if index is None or not SearchIndex.is_supported():
+            return super().filter_queryset(request, queryset, view)
+        if not terms.strip():
+            return queryset
+
+        return index.search(queryset, terms)
@@ -2,4 +2,7 @@ from django.apps import AppConfig
 
 class ServiceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'service'
\ No newline at end of file
+    name = 'service'
+
+    def ready(self):
+        import service.signals
\ No newline at end of file
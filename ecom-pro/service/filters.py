@@ -0,0 +1,13 @@
+import django_filters
+from .models import Service
+
+class ServiceFilter(django_filters.FilterSet):
+    """Filtres du catalogue de services"""
+
+    # Fourchette de prix TVAC, sur la colonne stockée et indexée
+    min_price = django_filters.NumberFilter(field_name='price_with_vat', lookup_expr='gte')
+    max_price = django_filters.NumberFilter(field_name='price_with_vat', lookup_expr='lte')
+
+    class Meta:
+        model = Service
+        fields = ['category', 'type']
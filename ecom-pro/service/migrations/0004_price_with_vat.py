@@ -0,0 +1,25 @@
+# Generated by Django 5.0.1 on 2026-10-18 13:04
+
+import django.db.models.expressions
+import django.db.models.functions.math
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('service', '0003_supportticket_ticket_keyset_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='service',
+            name='price_with_vat',
+            field=models.GeneratedField(db_persist=True, expression=django.db.models.functions.math.Round(django.db.models.expressions.CombinedExpression(django.db.models.expressions.CombinedExpression(models.F('price'), '*', django.db.models.expressions.CombinedExpression(models.F('vat_rate'), '+', models.Value(Decimal('100')))), '*', models.Value(Decimal('0.01'))), 2), output_field=models.DecimalField(decimal_places=2, max_digits=10)),
+        ),
+        migrations.AddIndex(
+            model_name='service',
+            index=models.Index(fields=['price_with_vat'], name='service_price_vat_idx'),
+        ),
+    ]
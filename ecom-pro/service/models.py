@@ -1,6 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
-from shop.models import Customer
+from shop.models import Customer, VatInclusivePriceMixin, vat_inclusive_price
 from decimal import Decimal
 
 class ServiceCategory(models.Model):
@@ -14,7 +14,7 @@ class ServiceCategory(models.Model):
     def __str__(self):
         return self.name
 
-class Service(models.Model):
+class Service(VatInclusivePriceMixin, models.Model):
     SERVICE_TYPES = [
         ('subscription', 'Abonnement'),
         ('one_time', 'Prestation ponctuelle'),
@@ -29,18 +29,28 @@ class Service(models.Model):
     price = models.DecimalField(max_digits=10, decimal_places=2)
     duration_minutes = models.PositiveIntegerField(null=True, blank=True)
     vat_rate = models.DecimalField(max_digits=4, decimal_places=2, default=Decimal('21.00'))
+    # Prix TVAC calculé et stocké par la base (voir shop.models.vat_inclusive_price)
+    price_with_vat = models.GeneratedField(
+        expression=vat_inclusive_price(),
+        output_field=models.DecimalField(max_digits=10, decimal_places=2),
+        db_persist=True
+    )
     is_active = models.BooleanField(default=True)
     requires_appointment = models.BooleanField(default=True)
     max_participants = models.PositiveIntegerField(default=1)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Version CacheManager incrémentée à chaque modification (validateur HTTP)
+    VERSION_NAMESPACE = 'services'
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['price_with_vat'], name='service_price_vat_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
-    @property
-    def price_with_vat(self):
-        return self.price * (1 + self.vat_rate / 100)
-
 class Subscription(models.Model):
     STATUS_CHOICES = [
         ('active', 'Actif'),
@@ -132,6 +142,9 @@ class SupportTicket(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['customer', 'created_at', 'id'], name='ticket_keyset_idx'),
+        ]
 
 class TicketMessage(models.Model):
     ticket = models.ForeignKey(SupportTicket, related_name='messages', on_delete=models.CASCADE)
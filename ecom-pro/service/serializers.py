@@ -13,6 +13,7 @@ class ServiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Service
         fields = '__all__'
+        expandable_fields = {'category': ServiceCategorySerializer}
 
 class SubscriptionSerializer(serializers.ModelSerializer):
     service_name = serializers.CharField(source='service.name', read_only=True)
@@ -21,6 +22,7 @@ class SubscriptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Subscription
         fields = '__all__'
+        expandable_fields = {'service': ServiceSerializer}
 
 class AppointmentSerializer(serializers.ModelSerializer):
     service_name = serializers.CharField(source='service.name', read_only=True)
@@ -30,6 +32,7 @@ class AppointmentSerializer(serializers.ModelSerializer):
     class Meta:
         model = Appointment
         fields = '__all__'
+        expandable_fields = {'service': ServiceSerializer}
 
 class TicketMessageSerializer(serializers.ModelSerializer):
     author_name = serializers.CharField(source='author.get_full_name', read_only=True)
@@ -53,4 +56,5 @@ class ServiceReviewSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ServiceReview
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+        expandable_fields = {'service': ServiceSerializer}
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from cache_system import CacheManager
+from .models import Service, ServiceCategory
+from .search import service_search_index
+
+@receiver(post_save, sender=Service)
+def index_service(sender, instance, **kwargs):
+    """Maintenir l'index plein texte des services à jour"""
+    service_search_index.update(instance)
+
+@receiver(post_delete, sender=Service)
+def unindex_service(sender, instance, **kwargs):
+    """Retirer un service supprimé de l'index plein texte"""
+    service_search_index.remove(instance.pk)
+
+@receiver(post_save, sender=Service)
+@receiver(post_delete, sender=Service)
+@receiver(post_save, sender=ServiceCategory)
+@receiver(post_delete, sender=ServiceCategory)
+def bump_service_version(sender, **kwargs):
+    """Invalider les ETag du catalogue de services (pas de updated_at sur Service)"""
+    CacheManager.bump_version(Service.VERSION_NAMESPACE)
@@ -2,6 +2,8 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.filters import OrderingFilter
+from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from datetime import datetime, timedelta
@@ -12,18 +14,34 @@ from .serializers import (
     AppointmentSerializer, SupportTicketSerializer, TicketMessageSerializer,
     ServiceReviewSerializer
 )
+from .search import service_search_index
+from .filters import ServiceFilter
 from shop.models import Customer
+from shop.sequences import Sequence, last_number
+from search_index import FullTextSearchFilter
+from pagination import SelectablePagination
+from query_optimizer import QuerysetOptimizerMixin
+from conditional_get import ConditionalGetMixin
+
+TICKET_NUMBERS = Sequence(
+    'ticket', prefix='TK', period_format='%Y%m%d', width=4, block_size=100,
+    seed=lambda scope, prefix: last_number(SupportTicket.objects.all(), 'ticket_number', prefix)
+)
 
 class ServiceCategoryViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = ServiceCategory.objects.filter(is_active=True)
     serializer_class = ServiceCategorySerializer
     permission_classes = [AllowAny]
 
-class ServiceViewSet(viewsets.ReadOnlyModelViewSet):
+class ServiceViewSet(ConditionalGetMixin, QuerysetOptimizerMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Service.objects.filter(is_active=True)
     serializer_class = ServiceSerializer
     permission_classes = [AllowAny]
-    filterset_fields = ['category', 'type']
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
+    filterset_class = ServiceFilter
+    ordering_fields = ['name', 'price', 'price_with_vat', 'created_at']
+    version_namespace = Service.VERSION_NAMESPACE
+    search_index = service_search_index
     search_fields = ['name', 'description']
 
     @action(detail=True, methods=['get'])
@@ -61,13 +79,14 @@ class ServiceViewSet(viewsets.ReadOnlyModelViewSet):
         
         return Response({'available_slots': slots})
 
-class SubscriptionViewSet(viewsets.ModelViewSet):
+class SubscriptionViewSet(QuerysetOptimizerMixin, viewsets.ModelViewSet):
+    queryset = Subscription.objects.all()
     serializer_class = SubscriptionSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         customer = get_object_or_404(Customer, user=self.request.user)
-        return Subscription.objects.filter(customer=customer)
+        return super().get_queryset().filter(customer=customer)
 
     @action(detail=True, methods=['post'])
     def pause(self, request, pk=None):
@@ -83,13 +102,14 @@ class SubscriptionViewSet(viewsets.ModelViewSet):
         subscription.save()
         return Response({'status': 'resumed'})
 
-class AppointmentViewSet(viewsets.ModelViewSet):
+class AppointmentViewSet(QuerysetOptimizerMixin, viewsets.ModelViewSet):
+    queryset = Appointment.objects.all()
     serializer_class = AppointmentSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         customer = get_object_or_404(Customer, user=self.request.user)
-        return Appointment.objects.filter(customer=customer)
+        return super().get_queryset().filter(customer=customer)
 
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
@@ -122,18 +142,20 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         except ValueError:
             return Response({'error': 'Invalid date format'}, status=status.HTTP_400_BAD_REQUEST)
 
-class SupportTicketViewSet(viewsets.ModelViewSet):
+class SupportTicketViewSet(QuerysetOptimizerMixin, viewsets.ModelViewSet):
+    queryset = SupportTicket.objects.all()
     serializer_class = SupportTicketSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = SelectablePagination
+    keyset_ordering = ('-created_at', '-id')
 
     def get_queryset(self):
         customer = get_object_or_404(Customer, user=self.request.user)
-        return SupportTicket.objects.filter(customer=customer)
+        return super().get_queryset().filter(customer=customer)
 
     def perform_create(self, serializer):
         customer = get_object_or_404(Customer, user=self.request.user)
-        # Générer un numéro de ticket unique
-        ticket_number = f"TK{timezone.now().strftime('%Y%m%d')}{SupportTicket.objects.count() + 1:04d}"
+        ticket_number = TICKET_NUMBERS.next()
         serializer.save(customer=customer, ticket_number=ticket_number)
 
     @action(detail=True, methods=['post'])
@@ -153,13 +175,14 @@ class SupportTicketViewSet(viewsets.ModelViewSet):
         serializer = TicketMessageSerializer(message)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-class ServiceReviewViewSet(viewsets.ModelViewSet):
+class ServiceReviewViewSet(QuerysetOptimizerMixin, viewsets.ModelViewSet):
+    queryset = ServiceReview.objects.all()
     serializer_class = ServiceReviewSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         customer = get_object_or_404(Customer, user=self.request.user)
-        return ServiceReview.objects.filter(customer=customer)
+        return super().get_queryset().filter(customer=customer)
 
     def perform_create(self, serializer):
         customer = get_object_or_404(Customer, user=self.request.user)
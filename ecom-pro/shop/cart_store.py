@@ -0,0 +1,341 @@
+"""
+Paniers actifs tenus dans le cache et écrits en base en différé (write-behind)
+"""
+import time
+import logging
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from low_level_optimizations import async_processor
+from .models import Cart, CartItem, Customer, Product
+
+logger = logging.getLogger(__name__)
+
+class CartStoreUnavailable(Exception):
+    """Le cache ne répond pas ou le verrou du panier n'a pas pu être pris"""
+
+class CartStore:
+    """Une entrée de cache par panier : {'user', 'items': {produit: quantité}, 'touched'}.
+
+    L'écriture différée suppose un cache partagé par tous les processus
+    (Redis, Memcached, base) désigné par ``CART_STORE_CACHE`` : entrées,
+    ensemble des paniers sales et verrous y vivent. Sur un cache local au
+    processus (LocMem, fichiers, dummy), chaque mutation est écrite
+    directement en base et rien n'est gardé en cache.
+
+    Les mutations modifient l'entrée sous un verrou court (``cache.add``,
+    l'API de cache de Django n'ayant pas d'opérations atomiques sur un hash)
+    et marquent le panier « sale ». ``flush()`` écrit les paniers sales par
+    lots : une transaction, bulk_create / bulk_update / DELETE groupés, les
+    mutations successives d'un panier coalescées en une seule écriture.
+    L'entrée est relue en cache sous le verrou de ligne du panier : deux
+    flush concurrents ne peuvent pas réécrire un état plus ancien.
+
+    Tant qu'un panier n'est pas écrit, ses mutations n'existent que dans le
+    cache : une entrée évincée ou perdue avec le serveur de cache est
+    journalisée en erreur au flush, pas rattrapée. Le cache choisi ne doit
+    donc pas évincer ces clés (Redis ``noeviction`` ou base dédiée). Si le
+    cache ne répond pas, la mutation est écrite directement en base ; si
+    un flush échoue, les paniers sont de nouveau marqués sales.
+
+    Un flush est lancé en arrière-plan dès ``FLUSH_BATCH_SIZE`` paniers
+    sales, ou quand le plus ancien l'est depuis ``FLUSH_MAX_AGE`` secondes.
+    Ces deux déclencheurs ne jouent qu'à la mutation suivante : la commande
+    ``flush_carts`` doit être planifiée chaque minute pour qu'un trafic
+    faible n'en laisse aucun en attente.
+    """
+
+    KEY_PREFIX = 'cart_store'
+    DIRTY_KEY = 'cart_store:dirty'
+    # Instant (epoch) où l'ensemble des paniers sales a cessé d'être vide
+    DIRTY_SINCE_KEY = 'cart_store:dirty_since'
+    # Durée de vie d'une entrée : largement supérieure à l'intervalle de flush
+    TIMEOUT = 7 * 86400
+    LOCK_TIMEOUT = 5
+    FLUSH_BATCH_SIZE = 200
+    FLUSH_MAX_AGE = 30
+    # Backends propres à un processus : pas d'écriture différée
+    LOCAL_BACKENDS = (LocMemCache, FileBasedCache, DummyCache)
+
+    @staticmethod
+    def cache():
+        return caches[getattr(settings, 'CART_STORE_CACHE', 'default')]
+
+    @classmethod
+    def write_behind(cls) -> bool:
+        """Écriture différée seulement si le cache est partagé entre processus"""
+        return not isinstance(cls.cache(), cls.LOCAL_BACKENDS)
+
+    @classmethod
+    def key(cls, cart_id) -> str:
+        return f'{cls.KEY_PREFIX}:{cart_id}'
+
+    @classmethod
+    @contextmanager
+    def locked(cls, name):
+        key = f'{cls.KEY_PREFIX}:lock:{name}'
+        cache = cls.cache()
+        deadline = time.monotonic() + cls.LOCK_TIMEOUT
+        while not cache.add(key, 1, cls.LOCK_TIMEOUT):
+            if time.monotonic() > deadline:
+                raise CartStoreUnavailable(f'Verrou {key} indisponible')
+            time.sleep(0.005)
+        try:
+            yield
+        finally:
+            cache.delete(key)
+
+    # ---- Lecture ----
+
+    @staticmethod
+    def read_db(cart_id):
+        """Entrée construite depuis la base (une requête), None si le panier n'existe pas"""
+        rows = list(Cart.objects.filter(pk=cart_id).values_list('customer__user_id', 'items__product_id', 'items__quantity', 'updated_at'))
+        if not rows:
+            return None
+        return {
+            'user': rows[0][0],
+            'items': {product_id: quantity for _, product_id, quantity, _ in rows if product_id is not None},
+            'touched': rows[0][3],
+        }
+
+    @classmethod
+    def load(cls, cart_id):
+        if not cls.write_behind():
+            return cls.read_db(cart_id)
+        cache = cls.cache()
+        entry = cache.get(cls.key(cart_id))
+        if entry is None:
+            entry = cls.read_db(cart_id)
+            if entry is not None:
+                cache.add(cls.key(cart_id), entry, cls.TIMEOUT)
+        return entry
+
+    @classmethod
+    def get(cls, cart_id):
+        """Entrée du panier, lue en base si le cache ne répond pas"""
+        try:
+            return cls.load(cart_id)
+        except Exception as e:
+            logger.warning(f"Cart store read error for cart {cart_id}: {e}")
+            return cls.read_db(cart_id)
+
+    @classmethod
+    def owner(cls, cart_id):
+        """Utilisateur propriétaire du panier (servi par le cache), None s'il n'existe pas"""
+        entry = cls.get(cart_id)
+        return entry and entry['user']
+
+    # ---- Mutations ----
+
+    @classmethod
+    def mutate(cls, cart_id, change):
+        """Appliquer change(items) à l'entrée du panier ; retourne les lignes résultantes"""
+        if not cls.write_behind():
+            return cls.write_through(cart_id, change)
+        try:
+            with cls.locked(cart_id):
+                entry = cls.load(cart_id)
+                if entry is None:
+                    return None
+                change(entry['items'])
+                entry['touched'] = timezone.now()
+                cls.cache().set(cls.key(cart_id), entry, cls.TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Cart store unavailable, writing cart {cart_id} through: {e}")
+            return cls.write_through(cart_id, change)
+        try:
+            cls.mark_dirty([cart_id])
+        except Exception as e:
+            # En cache mais pas marqué sale : écrit tout de suite pour ne pas être perdu
+            logger.warning(f"Cart store dirty set unavailable, flushing cart {cart_id}: {e}")
+            cls.write([cart_id])
+        return entry['items']
+
+    @classmethod
+    def add(cls, cart_id, quantities: dict):
+        """Ajouter des quantités (plusieurs produits en une mutation)"""
+        def change(items):
+            for product_id, quantity in quantities.items():
+                items[product_id] = items.get(product_id, 0) + quantity
+        return cls.mutate(cart_id, change)
+
+    @classmethod
+    def remove(cls, cart_id, product_ids):
+        def change(items):
+            for product_id in product_ids:
+                items.pop(product_id, None)
+        return cls.mutate(cart_id, change)
+
+    @classmethod
+    def clear(cls, cart_id):
+        return cls.mutate(cart_id, lambda items: items.clear())
+
+    @classmethod
+    def discard(cls, cart_ids):
+        """Oublier des paniers supprimés"""
+        cls.cache().delete_many([cls.key(pk) for pk in cart_ids])
+
+    @classmethod
+    def merge_guest(cls, user, quantities: dict) -> int:
+        """Fusionner un panier invité dans le panier du client (connexion).
+
+        Les quantités s'ajoutent à celles du panier ; les produits inconnus
+        ou inactifs sont ignorés. Un seul upsert groupé sur (panier,
+        produit), après écriture en base de l'état en cache du panier.
+        """
+        quantities = {int(pk): int(qty) for pk, qty in quantities.items() if int(qty) > 0}
+        if not quantities:
+            return 0
+        cart, _ = Cart.objects.get_or_create(customer=Customer.objects.get(user=user))
+        with cls.locked(cart.pk):
+            cls.write([cart.pk])
+            with transaction.atomic():
+                current = dict(
+                    CartItem.objects.filter(cart=cart, product_id__in=quantities).values_list('product_id', 'quantity')
+                )
+                lines = [
+                    CartItem(cart=cart, product_id=product_id, quantity=current.get(product_id, 0) + quantities[product_id])
+                    for product_id in Product.objects.filter(pk__in=quantities, is_active=True).values_list('pk', flat=True)
+                ]
+                CartItem.objects.bulk_create(
+                    lines, update_conflicts=True, unique_fields=['cart', 'product'], update_fields=['quantity']
+                )
+                Cart.objects.filter(pk=cart.pk).update(updated_at=timezone.now())
+            # Relu depuis la base à la prochaine lecture
+            cls.cache().delete(cls.key(cart.pk))
+        logger.info(f"Guest cart merged into cart {cart.pk}: {len(lines)} products")
+        return len(lines)
+
+    # ---- Écriture différée ----
+
+    @classmethod
+    def mark_dirty(cls, cart_ids):
+        cache = cls.cache()
+        with cls.locked('dirty'):
+            dirty = cache.get(cls.DIRTY_KEY) or set()
+            dirty.update(cart_ids)
+            cache.set(cls.DIRTY_KEY, dirty, None)
+            cache.add(cls.DIRTY_SINCE_KEY, time.time(), None)
+            since = cache.get(cls.DIRTY_SINCE_KEY) or time.time()
+        if len(dirty) >= cls.FLUSH_BATCH_SIZE or time.time() - since >= cls.FLUSH_MAX_AGE:
+            async_processor.submit_task(cls.flush_pending)
+
+    @classmethod
+    def dirty_ids(cls) -> set:
+        """Paniers modifiés en cache et pas encore écrits en base"""
+        if not cls.write_behind():
+            return set()
+        return cls.cache().get(cls.DIRTY_KEY) or set()
+
+    @classmethod
+    def flush(cls, cart_ids=None) -> int:
+        """Écrire les paniers sales (tous, ou seulement ceux de cart_ids) ; retourne le nombre écrit"""
+        if not cls.write_behind():
+            # Mutations déjà en base
+            return 0
+        cache = cls.cache()
+        with cls.locked('dirty'):
+            dirty = cache.get(cls.DIRTY_KEY) or set()
+            selected = dirty if cart_ids is None else dirty & {int(pk) for pk in cart_ids}
+            if not selected:
+                return 0
+            cache.set(cls.DIRTY_KEY, dirty - selected, None)
+            if selected == dirty:
+                cache.delete(cls.DIRTY_SINCE_KEY)
+
+        selected = sorted(selected)
+        written = 0
+        for start in range(0, len(selected), cls.FLUSH_BATCH_SIZE):
+            batch = selected[start:start + cls.FLUSH_BATCH_SIZE]
+            try:
+                written += cls.write(batch, dirty=True)
+            except Exception as e:
+                logger.error(f"Cart flush error for {len(batch)} carts: {e}")
+                cls.mark_dirty(batch)
+        if written:
+            logger.debug(f"Carts flushed: {written}")
+        return written
+
+    @classmethod
+    def flush_pending(cls):
+        """Point d'entrée des flush lancés en arrière-plan"""
+        try:
+            cls.flush()
+        finally:
+            close_old_connections()
+
+    @classmethod
+    def write(cls, cart_ids, dirty=False) -> int:
+        """Écrire en base l'état en cache de quelques paniers.
+
+        dirty : paniers marqués sales, une entrée absente du cache est une
+        mutation perdue (journalisée en erreur).
+        """
+        with transaction.atomic():
+            # Verrou de ligne d'abord, lecture du cache ensuite : l'état écrit est le plus récent
+            locked = Cart.objects.select_for_update().filter(pk__in=cart_ids).order_by('pk').values_list('pk', flat=True)
+            keys = {cls.key(pk): pk for pk in locked}
+            entries = {keys[key]: entry for key, entry in cls.cache().get_many(list(keys)).items()}
+            cls._apply(entries)
+        lost = sorted(set(keys.values()) - set(entries)) if dirty else []
+        if lost:
+            logger.error(f"Cart store entries missing for {len(lost)} dirty carts, mutations lost: {lost}")
+        return len(entries)
+
+    @classmethod
+    def write_through(cls, cart_id, change):
+        """Repli sans cache : mutation appliquée directement en base"""
+        with transaction.atomic():
+            if not Cart.objects.select_for_update().filter(pk=cart_id).exists():
+                return None
+            entry = cls.read_db(cart_id)
+            change(entry['items'])
+            entry['touched'] = timezone.now()
+            cls._apply({cart_id: entry})
+        cls.cache().delete(cls.key(cart_id))
+        return entry['items']
+
+    @staticmethod
+    def _apply(entries: dict):
+        """Différence entre les lignes voulues et les lignes en base, appliquée en opérations groupées"""
+        if not entries:
+            return
+        wanted = {
+            (cart_id, product_id): quantity
+            for cart_id, entry in entries.items()
+            for product_id, quantity in entry['items'].items()
+            if quantity > 0
+        }
+        # Un produit supprimé entre-temps ne doit pas bloquer tout le lot
+        products = set(Product.objects.filter(pk__in={product_id for _, product_id in wanted}).values_list('pk', flat=True))
+        current = {
+            (cart_id, product_id): (pk, quantity)
+            for pk, cart_id, product_id, quantity in CartItem.objects.filter(cart_id__in=list(entries)).values_list(
+                'pk', 'cart_id', 'product_id', 'quantity'
+            )
+        }
+
+        CartItem.objects.bulk_create([
+            CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity)
+            for (cart_id, product_id), quantity in wanted.items()
+            if (cart_id, product_id) not in current and product_id in products
+        ])
+        CartItem.objects.bulk_update([
+            CartItem(pk=current[line][0], quantity=quantity)
+            for line, quantity in wanted.items()
+            if line in current and current[line][1] != quantity
+        ], ['quantity'])
+        removed = [pk for line, (pk, _) in current.items() if line not in wanted]
+        if removed:
+            CartItem.objects.filter(pk__in=removed).delete()
+        # bulk_update n'applique pas auto_now : updated_at = dernière mutation réelle
+        Cart.objects.bulk_update(
+            [Cart(pk=cart_id, updated_at=entry['touched']) for cart_id, entry in entries.items()],
+            ['updated_at']
+        )
@@ -0,0 +1,219 @@
+"""
+Import en masse du catalogue fournisseur (CSV / JSON) par upserts en flux
+"""
+import csv
+import json
+import time
+import logging
+from decimal import Decimal, InvalidOperation
+from django.db import IntegrityError, transaction
+from django.utils.text import slugify
+from cache_system import CacheManager
+from .facets import ProductFacets
+from .models import Category, Product
+from .search import product_search_index
+from .snapshots import ProductSnapshotBuilder
+from .stock import StockLedger
+
+logger = logging.getLogger(__name__)
+
+def read_csv(stream):
+    """Une ligne du fichier à la fois (csv.DictReader est déjà paresseux)"""
+    yield from csv.DictReader(stream)
+
+def read_json(stream, buffer_size: int = 65536):
+    """Objets d'un fichier JSON Lines ou d'un tableau JSON, lus au fil de l'eau.
+
+    Le tableau n'est jamais chargé entier : le flux est lu par blocs et
+    chaque objet décodé avec raw_decode dès qu'il est complet (un objet
+    incomplet échoue au décodage et provoque la lecture du bloc suivant).
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    in_array = None
+    exhausted = False
+
+    while True:
+        # Sauter blancs et séparateurs entre deux éléments
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if in_array is None and position < len(buffer):
+            in_array = buffer[position] == '['
+            position += int(in_array)
+            continue
+        if in_array and position < len(buffer) and buffer[position] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if exhausted:
+                if buffer[position:].strip():
+                    raise
+                return
+            chunk = stream.read(buffer_size)
+            exhausted = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+
+        position = end
+        yield item
+
+class CatalogImporter:
+    """Upsert par lots des produits d'un flux fournisseur, clé naturelle ``sku``.
+
+    Seul le lot courant est en mémoire. Les catégories sont résolues par
+    slug via un dictionnaire chargé une fois. Chaque lot est un
+    ``bulk_create(update_conflicts=True)`` dans sa propre transaction, suivi
+    de la mise à jour des structures normalement tenues par les signaux
+    (index plein texte, modèle de lecture) que bulk_create ne déclenche pas.
+    """
+
+    BATCH_SIZE = 1000
+    DECIMAL_FIELDS = ('price', 'cost_price', 'vat_rate', 'weight')
+    INTEGER_FIELDS = ('stock_quantity', 'min_stock_level')
+    BOOLEAN_FIELDS = ('is_active', 'is_digital')
+    TEXT_FIELDS = ('name', 'description', 'dimensions')
+    # Le slug n'est jamais réécrit : les URLs existantes restent valides
+    UPDATE_FIELDS = TEXT_FIELDS + DECIMAL_FIELDS + INTEGER_FIELDS + BOOLEAN_FIELDS
+    TRUE_VALUES = {'1', 'true', 'yes', 'oui', 'y'}
+    SLUG_LENGTH = Product._meta.get_field('slug').max_length
+
+    def __init__(self, batch_size: int = None, create_categories: bool = False, on_batch=None):
+        self.batch_size = batch_size or self.BATCH_SIZE
+        self.create_categories = create_categories
+        self.on_batch = on_batch
+        self.categories = dict(Category.objects.values_list('slug', 'id'))
+        self.stats = {'rows': 0, 'created': 0, 'updated': 0, 'rejected': 0, 'batches': 0}
+        self.errors = []
+
+    # ---- Conversion ----
+
+    def category_id(self, slug: str):
+        if slug not in self.categories and self.create_categories and slug:
+            category = Category.objects.create(name=slug.replace('-', ' ').title(), slug=slug)
+            self.categories[slug] = category.id
+        return self.categories.get(slug)
+
+    def build(self, row: dict):
+        """Instance non sauvegardée et champs fournis ; ValueError si la ligne est invalide"""
+        sku = str(row.get('sku') or '').strip()
+        if not sku:
+            raise ValueError('sku manquant')
+        category_id = self.category_id(str(row.get('category') or '').strip())
+        if category_id is None:
+            raise ValueError(f"catégorie inconnue '{row.get('category')}'")
+
+        values = {'sku': sku, 'category_id': category_id}
+        for field in self.TEXT_FIELDS:
+            if row.get(field) is not None:
+                values[field] = str(row[field]).strip()
+        for field in self.DECIMAL_FIELDS:
+            if row.get(field) not in (None, ''):
+                try:
+                    values[field] = Decimal(str(row[field]).replace(',', '.'))
+                except InvalidOperation:
+                    raise ValueError(f"{field} invalide '{row[field]}'")
+        for field in self.INTEGER_FIELDS:
+            if row.get(field) not in (None, ''):
+                values[field] = int(row[field])
+        for field in self.BOOLEAN_FIELDS:
+            if row.get(field) not in (None, ''):
+                value = row[field]
+                values[field] = value if isinstance(value, bool) else str(value).strip().lower() in self.TRUE_VALUES
+
+        if 'price' not in values or not values.get('name'):
+            raise ValueError('nom et prix obligatoires')
+        fields = frozenset(values) - {'sku', 'category_id'}
+        values['slug'] = row.get('slug') or self.slug(values['name'], sku)
+        return Product(**values), fields
+
+    @classmethod
+    def slug(cls, name: str, sku: str) -> str:
+        """Nom tronqué suivi du sku entier : deux sku différents ne donnent jamais le même slug"""
+        suffix = slugify(sku)[:cls.SLUG_LENGTH]
+        head = slugify(name)[:max(cls.SLUG_LENGTH - len(suffix) - 1, 0)].strip('-')
+        return f'{head}-{suffix}' if head else suffix
+
+    # ---- Import ----
+
+    def run(self, rows):
+        start = time.time()
+        batch = {}
+        for line, row in enumerate(rows, start=1):
+            self.stats['rows'] += 1
+            try:
+                product, fields = self.build(row)
+            except (ValueError, TypeError) as e:
+                self.stats['rejected'] += 1
+                self.errors.append((line, str(e)))
+                continue
+            # Un sku répété dans le lot : la dernière ligne l'emporte
+            batch[product.sku] = (product, fields, line)
+            if len(batch) >= self.batch_size:
+                self.flush(batch)
+                batch = {}
+        if batch:
+            self.flush(batch)
+
+        self.stats['duration'] = time.time() - start
+        logger.info(f"Catalog import: {self.stats}")
+        return self.stats
+
+    def flush(self, batch: dict):
+        try:
+            self.write(batch)
+        except IntegrityError as e:
+            # Lot refusé (slug déjà pris...) : repris ligne par ligne, seules les fautives sont rejetées
+            logger.warning(f"Catalog import batch rejected, retrying row by row: {e}")
+            for sku, entry in batch.items():
+                try:
+                    self.write({sku: entry})
+                except IntegrityError as e:
+                    self.stats['rejected'] += 1
+                    self.errors.append((entry[2], str(e)))
+
+    def write(self, batch: dict):
+        start = time.time()
+        skus = list(batch)
+        # Seules les colonnes fournies sont mises à jour : une ligne sans stock_quantity
+        # ne remet pas le stock existant à la valeur par défaut
+        groups = {}
+        for product, fields, _ in batch.values():
+            groups.setdefault(fields, []).append(product)
+
+        stocked = [sku for sku, (_, fields, _) in batch.items() if 'stock_quantity' in fields]
+
+        with transaction.atomic():
+            previous = dict(Product.objects.filter(sku__in=skus).values_list('sku', 'stock_quantity'))
+            existing = len(previous)
+            for fields, products in groups.items():
+                Product.objects.bulk_create(
+                    products, update_conflicts=True, unique_fields=['sku'],
+                    update_fields=[f for f in self.UPDATE_FIELDS if f in fields] + ['category', 'updated_at']
+                )
+            imported = Product.objects.filter(sku__in=skus)
+            if stocked:
+                StockLedger.record('import', {
+                    pk: stock - previous.get(sku, 0)
+                    for pk, sku, stock in imported.filter(sku__in=stocked).values_list('pk', 'sku', 'stock_quantity')
+                })
+            product_search_index.refresh(imported.values_list('pk', flat=True))
+            ProductSnapshotBuilder.sync(imported)
+            CacheManager.bump_version(ProductFacets.CACHE_NAMESPACE)
+
+        self.stats['batches'] += 1
+        self.stats['created'] += len(batch) - existing
+        self.stats['updated'] += existing
+        duration = time.time() - start
+        report = {
+            'batch': self.stats['batches'],
+            'size': len(batch),
+            'duration': duration,
+            'rate': len(batch) / duration if duration else 0,
+        }
+        logger.debug(f"Catalog import batch: {report}")
+        if self.on_batch:
+            self.on_batch(report)
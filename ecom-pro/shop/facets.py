@@ -0,0 +1,95 @@
+"""
+Facettes du catalogue produits calculées en une seule requête agrégée
+"""
+from collections import OrderedDict
+from django.db.models import Case, Count, IntegerField, Value, When
+from cache_system import CacheManager
+from .models import ProductSnapshot
+
+class ProductFacets:
+    """Compteurs par catégorie, produit numérique, disponibilité et tranche de prix.
+
+    Une seule requête GROUP BY sur toutes les dimensions à la fois produit le
+    « cube » des combinaisons présentes (quelques dizaines de lignes) ; chaque
+    facette en est ensuite la marginale, calculée en Python. Le résultat est
+    mis en cache par signature de filtres normalisée et par version du
+    catalogue (incrémentée à chaque modification de produit).
+    """
+
+    CACHE_NAMESPACE = 'products'
+    # Bornes des tranches de prix (€ HTVA) ; la dernière tranche est ouverte
+    PRICE_BUCKETS = [25, 50, 100, 250, 500]
+    # Paramètres sans effet sur l'ensemble filtré
+    IGNORED_PARAMS = {'page', 'page_size', 'cursor', 'pagination', 'count', 'ordering', 'facets'}
+
+    @classmethod
+    def cache_key(cls, query_params) -> str:
+        signature = sorted(
+            (key, sorted(query_params.getlist(key)))
+            for key in query_params
+            if key not in cls.IGNORED_PARAMS
+        )
+        version = CacheManager.get_version(cls.CACHE_NAMESPACE)
+        return CacheManager.generate_cache_key('product_facets', version, signature)
+
+    @classmethod
+    def compute(cls, queryset):
+        """Calculer toutes les facettes d'un queryset filtré"""
+        price_bucket = Case(
+            *[When(price__lt=bound, then=Value(index)) for index, bound in enumerate(cls.PRICE_BUCKETS)],
+            default=Value(len(cls.PRICE_BUCKETS)),
+            output_field=IntegerField()
+        )
+        in_stock = Case(
+            When(stock_quantity__gt=0, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField()
+        )
+        # Le modèle de lecture porte déjà le nom de catégorie : pas de jointure
+        category_name = 'category_name' if queryset.model is ProductSnapshot else 'category__name'
+        cube = (
+            queryset.order_by().prefetch_related(None)
+            .annotate(facet_in_stock=in_stock, facet_price=price_bucket)
+            .values('category_id', category_name, 'is_digital', 'facet_in_stock', 'facet_price')
+            .annotate(total=Count('pk'))
+        )
+
+        categories = OrderedDict()
+        is_digital = {'true': 0, 'false': 0}
+        in_stock_counts = {'true': 0, 'false': 0}
+        prices = [0] * (len(cls.PRICE_BUCKETS) + 1)
+        total = 0
+
+        for row in cube:
+            count = row['total']
+            total += count
+            category = categories.setdefault(
+                row['category_id'], {'id': row['category_id'], 'name': row[category_name], 'count': 0}
+            )
+            category['count'] += count
+            is_digital['true' if row['is_digital'] else 'false'] += count
+            in_stock_counts['true' if row['facet_in_stock'] else 'false'] += count
+            prices[row['facet_price']] += count
+
+        bounds = [0] + cls.PRICE_BUCKETS + [None]
+        return {
+            'total': total,
+            'category': sorted(categories.values(), key=lambda c: (-c['count'], c['name'])),
+            'is_digital': is_digital,
+            'in_stock': in_stock_counts,
+            'price': [
+                {'min': bounds[i], 'max': bounds[i + 1], 'count': count}
+                for i, count in enumerate(prices)
+                if count
+            ],
+        }
+
+    @classmethod
+    def for_request(cls, queryset, request):
+        """Facettes du queryset filtré, servies depuis le cache si possible"""
+        key = cls.cache_key(request.query_params)
+        facets = CacheManager.get_cache(key)
+        if facets is None:
+            facets = cls.compute(queryset)
+            CacheManager.set_cache(key, facets, category='products')
+        return facets
@@ -0,0 +1,174 @@
+"""
+Déclinaisons redimensionnées des images produits (WebP / JPEG)
+"""
+import io
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Boîtes englobantes (largeur, hauteur) : le ratio est conservé, jamais d'agrandissement
+VARIANTS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'zoom': (1600, 1600),
+}
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+
+def render_variants(data: bytes) -> dict:
+    """Décoder une image et produire toutes ses déclinaisons.
+
+    Fonction pure exécutée dans un processus du pool : octets en entrée,
+    {variante: {format: octets}} en sortie, aucun accès à Django.
+    """
+    with Image.open(io.BytesIO(data)) as source:
+        source = ImageOps.exif_transpose(source)
+        if source.mode not in ('RGB', 'RGBA'):
+            source = source.convert('RGBA' if 'transparency' in source.info else 'RGB')
+
+        rendered = {}
+        for variant, size in VARIANTS.items():
+            image = source.copy()
+            image.thumbnail(size, Image.LANCZOS)
+            # JPEG n'a pas de transparence : fond blanc
+            flat = image
+            if image.mode == 'RGBA':
+                flat = Image.new('RGB', image.size, (255, 255, 255))
+                flat.paste(image, mask=image.getchannel('A'))
+
+            rendered[variant] = {}
+            for extension, (pil_format, options) in FORMATS.items():
+                buffer = io.BytesIO()
+                (image if pil_format == 'WEBP' else flat).save(buffer, pil_format, **options)
+                rendered[variant][extension] = buffer.getvalue()
+        return rendered
+
+class ProductImagePipeline:
+    """Génère et enregistre les déclinaisons d'une ProductImage.
+
+    Le décodage et le redimensionnement (CPU) s'exécutent dans un pool de
+    processus partagé ; l'écriture dans le stockage et en base reste dans le
+    processus appelant. ``ProductImage.variants`` mémorise le fichier source
+    traité : une image déjà à jour n'est pas retraitée.
+    """
+
+    MAX_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+    _pool = None
+
+    @classmethod
+    def pool(cls) -> ProcessPoolExecutor:
+        if cls._pool is None:
+            cls._pool = ProcessPoolExecutor(max_workers=cls.MAX_WORKERS)
+        return cls._pool
+
+    @staticmethod
+    def variant_name(image, variant: str, extension: str) -> str:
+        return f'products/variants/{image.pk}/{variant}.{extension}'
+
+    @staticmethod
+    def is_current(image) -> bool:
+        return bool(image.image) and image.variants.get('source') == image.image.name
+
+    @staticmethod
+    def read_source(image) -> bytes:
+        with image.image.storage.open(image.image.name, 'rb') as handle:
+            return handle.read()
+
+    @classmethod
+    def store(cls, image, rendered: dict) -> dict:
+        """Écrire les fichiers produits et enregistrer leurs chemins sur l'image"""
+        from .models import ProductImage
+        from .snapshots import ProductSnapshotBuilder
+
+        variants = {'source': image.image.name}
+        for variant, files in rendered.items():
+            variants[variant] = {}
+            for extension, content in files.items():
+                name = cls.variant_name(image, variant, extension)
+                if default_storage.exists(name):
+                    default_storage.delete(name)
+                variants[variant][extension] = default_storage.save(name, ContentFile(content))
+
+        # update() : pas de post_save, donc pas de nouveau passage dans le pipeline
+        ProductImage.objects.filter(pk=image.pk).update(variants=variants)
+        image.variants = variants
+        ProductSnapshotBuilder.refresh([image.product_id])
+        return variants
+
+    @classmethod
+    def process(cls, image, in_pool: bool = False) -> dict:
+        """Traiter une image (dans le pool de processus ou en ligne)"""
+        data = cls.read_source(image)
+        rendered = cls.pool().submit(render_variants, data).result() if in_pool else render_variants(data)
+        return cls.store(image, rendered)
+
+    @classmethod
+    def process_pk(cls, pk: int):
+        """Point d'entrée des tâches d'arrière-plan lancées après un upload"""
+        from .models import ProductImage
+
+        try:
+            image = ProductImage.objects.filter(pk=pk).first()
+            if image is not None and not cls.is_current(image):
+                cls.process(image, in_pool=True)
+        except Exception as e:
+            logger.error(f"Image variants error for ProductImage {pk}: {e}")
+        finally:
+            close_old_connections()
+
+    @classmethod
+    def process_many(cls, images, workers: int = None, batch_size: int = 32) -> int:
+        """Traitement parallèle par lots (mémoire bornée à un lot de fichiers source)"""
+        processed = 0
+        batch = []
+        with ProcessPoolExecutor(max_workers=workers or cls.MAX_WORKERS) as pool:
+            for image in images:
+                batch.append(image)
+                if len(batch) >= batch_size:
+                    processed += cls._process_batch(pool, batch)
+                    batch = []
+            if batch:
+                processed += cls._process_batch(pool, batch)
+        return processed
+
+    @classmethod
+    def _process_batch(cls, pool, images) -> int:
+        futures = []
+        for image in images:
+            try:
+                futures.append((image, pool.submit(render_variants, cls.read_source(image))))
+            except Exception as e:
+                logger.error(f"Image variants error for ProductImage {image.pk}: {e}")
+
+        processed = 0
+        for image, future in futures:
+            try:
+                cls.store(image, future.result())
+                processed += 1
+            except Exception as e:
+                logger.error(f"Image variants error for ProductImage {image.pk}: {e}")
+        return processed
+
+    @classmethod
+    def discard(cls, variants: dict):
+        """Supprimer les fichiers de déclinaisons d'une image supprimée"""
+        for variant in VARIANTS:
+            for name in variants.get(variant, {}).values():
+                default_storage.delete(name)
+
+    @staticmethod
+    def urls(variants: dict) -> dict:
+        """{variante: {format: url}} à partir des chemins enregistrés"""
+        return {
+            variant: {extension: default_storage.url(name) for extension, name in variants[variant].items()}
+            for variant in VARIANTS
+            if variant in variants
+        }
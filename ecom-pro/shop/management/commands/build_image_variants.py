@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from shop.images import ProductImagePipeline
+from shop.models import ProductImage
+
+class Command(BaseCommand):
+    help = 'Génère en parallèle les déclinaisons redimensionnées des images produits existantes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Nombre de processus (défaut : CPU - 1)')
+        parser.add_argument('--force', action='store_true', help='Régénérer aussi les images déjà traitées')
+
+    def handle(self, *args, **options):
+        images = ProductImage.objects.exclude(image='').order_by('pk').iterator(chunk_size=500)
+        if not options['force']:
+            images = (image for image in images if not ProductImagePipeline.is_current(image))
+
+        count = ProductImagePipeline.process_many(images, workers=options['workers'])
+        self.stdout.write(f'✅ {count} images traitées')
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from shop.recommendations import CoPurchaseRecommender
+
+class Command(BaseCommand):
+    help = 'Calcule les recommandations « achetés ensemble » à partir des commandes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Reconstruire depuis zéro au lieu de traiter les commandes modifiées')
+        parser.add_argument('--top', type=int, default=CoPurchaseRecommender.TOP_N, help='Nombre de recommandations par produit')
+
+    def handle(self, *args, **options):
+        recommender = CoPurchaseRecommender(top_n=options['top'])
+        mode = 'complet' if options['full'] else 'incrémental'
+        self.stdout.write(f'🔄 Calcul des recommandations ({mode})...')
+
+        stats = recommender.run(full=options['full'])
+
+        self.stdout.write(
+            f"✅ {stats['orders_added']} commandes comptées, {stats['orders_removed']} décomptées : "
+            f"{stats['products']} produits, {stats['pairs']} paires mises à jour"
+        )
+        self.stdout.write(f"⏱️ {stats['duration']:.2f}s")
@@ -0,0 +1,45 @@
+import sys
+from django.core.management.base import BaseCommand, CommandError
+from shop.catalog_import import CatalogImporter, read_csv, read_json
+
+class Command(BaseCommand):
+    help = 'Importe un flux fournisseur (CSV, JSON ou JSON Lines) par upserts en lots sur le sku'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Fichier à importer ('-' pour l'entrée standard)")
+        parser.add_argument('--format', choices=['csv', 'json'], help='Format (déduit de l\'extension par défaut)')
+        parser.add_argument('--batch-size', type=int, default=CatalogImporter.BATCH_SIZE, help='Produits par lot')
+        parser.add_argument('--create-categories', action='store_true', help='Créer les catégories inconnues')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path.lower().endswith('.csv') else 'json')
+        reader = read_csv if file_format == 'csv' else read_json
+
+        importer = CatalogImporter(
+            batch_size=options['batch_size'],
+            create_categories=options['create_categories'],
+            on_batch=self.report_batch
+        )
+        try:
+            stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8-sig')
+        except OSError as e:
+            raise CommandError(f'Impossible de lire {path}: {e}')
+        with stream:
+            stats = importer.run(reader(stream))
+
+        for line, error in importer.errors[:20]:
+            self.stderr.write(f'⚠️ ligne {line}: {error}')
+        if len(importer.errors) > 20:
+            self.stderr.write(f'⚠️ ... {len(importer.errors) - 20} autres lignes rejetées')
+
+        self.stdout.write(
+            f"✅ {stats['rows']} lignes : {stats['created']} créés, {stats['updated']} mis à jour, "
+            f"{stats['rejected']} rejetés en {stats['duration']:.2f}s"
+        )
+
+    def report_batch(self, report):
+        self.stdout.write(
+            f"📦 lot {report['batch']} : {report['size']} produits en {report['duration']:.2f}s "
+            f"({report['rate']:.0f} produits/s)"
+        )
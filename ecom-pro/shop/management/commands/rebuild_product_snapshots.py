@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from shop.snapshots import ProductSnapshotBuilder
+
+class Command(BaseCommand):
+    help = 'Reconstruit le modèle de lecture dénormalisé du catalogue produits'
+
+    def handle(self, *args, **options):
+        count = ProductSnapshotBuilder.rebuild()
+        self.stdout.write(f'✅ {count} produits recopiés dans le modèle de lecture')
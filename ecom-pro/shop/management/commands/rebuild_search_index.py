@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from shop.search import product_search_index
+from service.search import service_search_index
+
+class Command(BaseCommand):
+    help = 'Reconstruit les index plein texte des produits et des services'
+
+    def handle(self, *args, **options):
+        for index in (product_search_index, service_search_index):
+            count = index.rebuild()
+            self.stdout.write(f'✅ {index.name}: {count} entrées indexées')
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from shop.stock import StockLedger
+
+class Command(BaseCommand):
+    help = 'Recalcule le solde courant de chaque mouvement du journal de stock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, action='append', help='Limiter à un produit (répétable)')
+
+    def handle(self, *args, **options):
+        count = StockLedger.rebuild_balances(options['product'])
+        self.stdout.write(f'✅ {count} mouvements mis à jour')
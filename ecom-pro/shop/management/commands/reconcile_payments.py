@@ -0,0 +1,20 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from shop.models import Order
+from shop.payments import PaymentService
+
+class Command(BaseCommand):
+    help = 'Confirme les paiements réussis dont le webhook n\'est pas arrivé (à planifier toutes les 5 minutes)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, default=10, help='Intentions créées depuis au moins ce nombre de minutes')
+
+    def handle(self, *args, **options):
+        # Laisser au webhook le temps d'arriver avant d'interroger la passerelle
+        orders = (
+            Order.objects.filter(payment_status='pending', updated_at__lte=timezone.now() - timedelta(minutes=options['minutes']))
+            .exclude(stripe_payment_intent_id='').exclude(status='cancelled')
+        )
+        count = PaymentService.reconcile(orders.iterator())
+        self.stdout.write(f'✅ {count} paiements confirmés par la passerelle')
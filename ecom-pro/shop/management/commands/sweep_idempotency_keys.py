@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from shop.idempotency import IdempotencyStore
+
+class Command(BaseCommand):
+    help = 'Supprime les réponses Idempotency-Key expirées (à planifier chaque heure)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=IdempotencyStore.SWEEP_BATCH_SIZE, help='Enregistrements par lot')
+
+    def handle(self, *args, **options):
+        count = IdempotencyStore.sweep(batch_size=options['batch_size'])
+        self.stdout.write(f'✅ {count} clés d\'idempotence expirées supprimées')
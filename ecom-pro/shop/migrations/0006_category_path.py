@@ -0,0 +1,53 @@
+# Generated by Django 5.0.1 on 2026-10-18 12:56
+
+from django.db import migrations, models
+
+
+def path_segment(pk):
+    # Copie figée de Category.path_segment : base 36, largeur fixe de 6
+    digits = ''
+    while pk:
+        pk, remainder = divmod(pk, 36)
+        digits = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ'[remainder] + digits
+    return digits.rjust(6, '0') + '/'
+
+
+def build_category_paths(apps, schema_editor):
+    Category = apps.get_model('shop', 'Category')
+
+    parents = dict(Category.objects.values_list('id', 'parent_id'))
+    paths = {}
+
+    def path_of(pk):
+        if pk not in paths:
+            parent_id = parents[pk]
+            prefix = path_of(parent_id) if parent_id else ''
+            paths[pk] = prefix + path_segment(pk)
+        return paths[pk]
+
+    categories = list(Category.objects.all())
+    for category in categories:
+        category.path = path_of(category.pk)
+        category.depth = category.path.count('/') - 1
+    Category.objects.bulk_update(categories, ['path', 'depth'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_order_order_keyset_idx_product_product_keyset_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(build_category_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.1 on 2026-10-18 13:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_price_with_vat'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productimage',
+            name='variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.AddField(
+            model_name='productsnapshot',
+            name='primary_image_variants',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.0.1 on 2026-10-18 13:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productsnapshot',
+            index=models.Index(fields=['updated_at', 'product'], name='snapshot_updated_idx'),
+        ),
+    ]
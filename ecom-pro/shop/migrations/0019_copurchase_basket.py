@@ -0,0 +1,41 @@
+# Generated by Django 5.0.1 on 2026-10-18 17:05
+
+from collections import defaultdict
+from django.db import migrations, models
+
+
+def record_counted_baskets(apps, schema_editor):
+    # Commandes déjà comptées avec l'ancien filigrane (id <= last_order_id, non annulées) :
+    # le prochain passage décomptera celles qui ne sont pas payées
+    ProductRecommendation = apps.get_model('shop', 'ProductRecommendation')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    ProductCoPurchaseBasket = apps.get_model('shop', 'ProductCoPurchaseBasket')
+    last = ProductRecommendation.objects.aggregate(last=models.Max('last_order_id'))['last']
+    if not last:
+        return
+    baskets = defaultdict(set)
+    rows = OrderItem.objects.filter(order_id__lte=last).exclude(order__status='cancelled').values_list('order_id', 'product_id')
+    for order_id, product_id in rows.iterator(chunk_size=5000):
+        baskets[order_id].add(product_id)
+    ProductCoPurchaseBasket.objects.bulk_create(
+        [ProductCoPurchaseBasket(order_id=order_id, product_ids=sorted(ids)) for order_id, ids in baskets.items()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_payment_event_retry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCoPurchaseBasket',
+            fields=[
+                ('order_id', models.PositiveBigIntegerField(primary_key=True, serialize=False)),
+                ('product_ids', models.JSONField(default=list)),
+            ],
+        ),
+        migrations.RunPython(record_counted_baskets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,7 @@
+"""
+Index plein texte du catalogue produits
+"""
+from search_index import SearchIndex
+from .models import Product
+
+product_search_index = SearchIndex(Product, ['name', 'description', 'sku'])
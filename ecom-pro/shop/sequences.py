@@ -0,0 +1,127 @@
+"""
+Numérotation des documents (commandes, factures, écritures, tickets) par compteurs en base
+"""
+import logging
+import threading
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Length
+from django.utils import timezone
+from .models import SequenceCounter
+
+logger = logging.getLogger(__name__)
+
+def last_number(queryset, field: str, prefix: str) -> int:
+    """Plus grand numéro déjà attribué sous ce préfixe (amorçage depuis l'ancienne numérotation)"""
+    value = (
+        queryset.filter(**{f'{field}__startswith': prefix})
+        .order_by(Length(field).desc(), f'-{field}')
+        .values_list(field, flat=True)
+        .first()
+    )
+    suffix = value[len(prefix):] if value else ''
+    return int(suffix) if suffix.isdigit() else 0
+
+class Sequence:
+    """Numérotation « préfixe + période + numéro » sans doublon, en O(1).
+
+    Un compteur par (clé, période) est incrémenté par un UPDATE
+    ``value = value + n`` : le verrou de ligne sérialise les attributions
+    concurrentes, quel que soit le nombre de processus.
+
+    ``block_size=1`` : numéro pris dans la transaction de l'appelant ; une
+    annulation annule aussi l'incrément, la numérotation reste continue
+    (factures, écritures comptables). ``block_size > 1`` : le processus
+    réserve un bloc et le consomme en mémoire, une requête pour
+    ``block_size`` numéros ; le reste du bloc n'est publié qu'au commit, à
+    la suite des blocs réservés en parallèle par d'autres threads, et les
+    numéros non utilisés à l'arrêt du processus sont perdus (trous).
+
+    ``seed(scope, prefix)`` donne la valeur de départ d'un compteur créé,
+    pour continuer une numérotation existante.
+    """
+
+    # Blocs réservés par ce processus : clé -> (période, [[prochain, dernier], ...])
+    _blocks = {}
+    _lock = threading.Lock()
+
+    def __init__(self, name: str, prefix: str = '', period_format: str = '%Y', width: int = 6,
+                 block_size: int = 1, seed=None):
+        self.name = name
+        self.prefix = prefix
+        self.period_format = period_format
+        self.width = width
+        self.block_size = block_size
+        self.seed = seed
+
+    def next(self, scope='', now=None) -> str:
+        """Numéro suivant (scope : sous-numérotation, par exemple un journal comptable)"""
+        period = timezone.localtime(now).strftime(self.period_format) if self.period_format else ''
+        key = f'{self.name}:{scope}' if scope else self.name
+        head = f'{self.prefix}{period}'
+        seed = (lambda: self.seed(scope, head)) if self.seed else None
+        return f'{head}{self.next_value(key, period, self.block_size, seed):0{self.width}d}'
+
+    def next_many(self, count: int, scope='', now=None) -> list:
+        """count numéros consécutifs ; une seule requête pour une numérotation continue"""
+        if count <= 0:
+            return []
+        if self.block_size > 1:
+            return [self.next(scope, now) for _ in range(count)]
+        period = timezone.localtime(now).strftime(self.period_format) if self.period_format else ''
+        key = f'{self.name}:{scope}' if scope else self.name
+        head = f'{self.prefix}{period}'
+        seed = (lambda: self.seed(scope, head)) if self.seed else None
+        last = self.allocate(key, period, count, seed)
+        return [f'{head}{number:0{self.width}d}' for number in range(last - count + 1, last + 1)]
+
+    @classmethod
+    def next_value(cls, key: str, period: str, block_size: int = 1, seed=None) -> int:
+        if block_size <= 1:
+            return cls.allocate(key, period, 1, seed)
+
+        with cls._lock:
+            block_period, blocks = cls._blocks.get(key, (None, []))
+            if block_period == period:
+                while blocks and blocks[0][0] > blocks[0][1]:
+                    blocks.pop(0)
+                if blocks:
+                    value = blocks[0][0]
+                    blocks[0][0] += 1
+                    return value
+
+        last = cls.allocate(key, period, block_size, seed)
+        logger.debug(f"Sequence block reserved: {key} {period} up to {last}")
+        first = last - block_size + 1
+        remainder = [first + 1, last]
+
+        def publish():
+            with cls._lock:
+                block_period, blocks = cls._blocks.get(key, (None, []))
+                if block_period == period:
+                    # Deux threads ont réservé en même temps : le bloc encore entamé reste servi
+                    blocks.append(remainder)
+                else:
+                    cls._blocks[key] = (period, [remainder])
+
+        # Annulée, la transaction rend aussi le bloc : il ne doit pas être réutilisé
+        transaction.on_commit(publish)
+        return first
+
+    @staticmethod
+    def allocate(key: str, period: str, size: int, seed=None) -> int:
+        """Réserver size numéros ; retourne le dernier"""
+        counters = SequenceCounter.objects.filter(key=key, period=period)
+        with transaction.atomic():
+            if not counters.update(value=F('value') + size):
+                value = (seed() if seed else 0) + size
+                try:
+                    with transaction.atomic():
+                        SequenceCounter.objects.create(key=key, period=period, value=value)
+                    return value
+                except IntegrityError:
+                    # Créé en parallèle par un autre processus
+                    counters.update(value=F('value') + size)
+            return counters.values_list('value', flat=True).get()
+
+ORDER_NUMBERS = Sequence('order', prefix='CMD', width=7, block_size=100)
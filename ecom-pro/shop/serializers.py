@@ -1,15 +1,38 @@
+from decimal import Decimal
+from django.db import transaction
 from rest_framework import serializers
-from .models import Category, Product, ProductImage, Customer, Address, Cart, CartItem, Order, OrderItem, Wishlist
+from .images import ProductImagePipeline
+from .stock import InsufficientStock, StockReservationService
+from .models import Category, Product, ProductImage, ProductSnapshot, Customer, Address, Cart, CartItem, Order, OrderItem, Wishlist
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
 
+class ImageVariantsField(serializers.Field):
+    """URLs des déclinaisons redimensionnées : {variante: {format: url}}"""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, variants):
+        urls = ProductImagePipeline.urls(variants)
+        request = self.context.get('request')
+        if request is not None:
+            urls = {
+                variant: {extension: request.build_absolute_uri(url) for extension, url in formats.items()}
+                for variant, formats in urls.items()
+            }
+        return urls
+
 class ProductImageSerializer(serializers.ModelSerializer):
+    variants = ImageVariantsField()
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'alt_text', 'is_primary']
+        fields = ['id', 'image', 'variants', 'alt_text', 'is_primary']
 
 class ProductSerializer(serializers.ModelSerializer):
     images = ProductImageSerializer(many=True, read_only=True)
@@ -20,6 +43,47 @@ class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
         fields = '__all__'
+        expandable_fields = {'category': CategorySerializer}
+        field_dependencies = {'is_in_stock': ('stock_quantity',)}
+
+class ProductSnapshotSerializer(serializers.BaseSerializer):
+    """Sérialisation directe des lignes ``.values()`` de ProductSnapshot.
+
+    Pas de champ DRF par attribut : chaque ligne est recopiée telle quelle,
+    seuls les décimaux sont convertis en chaîne comme le fait DecimalField.
+    """
+
+    VALUES = (
+        'product', 'name', 'slug', 'sku', 'description', 'category', 'category_name',
+        'price', 'vat_rate', 'price_with_vat', 'stock_quantity', 'is_in_stock',
+        'is_digital', 'primary_image', 'primary_image_variants', 'created_at', 'updated_at'
+    )
+    DECIMAL_FIELDS = ('price', 'vat_rate', 'price_with_vat')
+    selected = VALUES
+
+    class Meta:
+        model = ProductSnapshot
+
+    @classmethod
+    def values_for(cls, only, required=()):
+        """Colonnes à lire pour ``?fields=`` (``id`` désigne la colonne product)"""
+        if only is None:
+            return cls.VALUES
+        return tuple(
+            name for name in cls.VALUES
+            if ('id' if name == 'product' else name) in only or name in required
+        )
+
+    def apply_fieldset(self, only, expand):
+        if only is not None:
+            self.selected = self.values_for(only)
+
+    def to_representation(self, row):
+        data = {('id' if name == 'product' else name): row[name] for name in self.selected}
+        for name in self.DECIMAL_FIELDS:
+            if name in data:
+                data[name] = str(data[name])
+        return data
 
 class AddressSerializer(serializers.ModelSerializer):
     class Meta:
@@ -54,18 +118,40 @@ class CartItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = CartItem
         fields = ['id', 'product', 'product_name', 'product_price', 'quantity', 'subtotal', 'added_at']
+        expandable_fields = {'product': ProductSerializer}
 
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
+    # Annotés par Cart.objects.with_totals() (une requête d'agrégat sinon)
     total_amount = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
-    items_count = serializers.SerializerMethodField()
+    vat_amount = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
+    items_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Cart
-        fields = ['id', 'customer', 'items', 'total_amount', 'items_count', 'created_at', 'updated_at']
-
-    def get_items_count(self, obj):
-        return obj.items.count()
+        fields = ['id', 'customer', 'items', 'total_amount', 'vat_amount', 'items_count', 'created_at', 'updated_at']
+        field_dependencies = {'total_amount': (), 'vat_amount': (), 'items_count': ()}
+
+class CartLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+class CartBatchSerializer(serializers.Serializer):
+    """Plusieurs lignes ajoutées au panier en une requête (liste de souhaits, re-commande)"""
+    MAX_LINES = 200
+
+    items = CartLineSerializer(many=True, allow_empty=False, max_length=MAX_LINES)
+
+    def validate_items(self, items):
+        # Produits résolus en une seule requête IN ; un produit répété est cumulé
+        quantities = {}
+        for line in items:
+            quantities[line['product_id']] = quantities.get(line['product_id'], 0) + line['quantity']
+        found = set(Product.objects.filter(pk__in=quantities, is_active=True).values_list('pk', flat=True))
+        missing = sorted(set(quantities) - found)
+        if missing:
+            raise serializers.ValidationError(f'Produits introuvables: {missing}')
+        return quantities
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
@@ -75,6 +161,11 @@ class OrderItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = OrderItem
         fields = '__all__'
+        expandable_fields = {'product': ProductSerializer}
+        field_dependencies = {
+            'subtotal': ('unit_price', 'quantity'),
+            'vat_amount': ('unit_price', 'quantity', 'vat_rate'),
+        }
 
 class OrderSerializer(serializers.ModelSerializer):
     items = OrderItemSerializer(many=True, read_only=True)
@@ -83,29 +174,63 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = '__all__'
+        expandable_fields = {'customer': CustomerSerializer}
+
+class OrderLineSerializer(serializers.Serializer):
+    """Ligne de commande reçue : prix et TVA viennent toujours du catalogue"""
+    product = serializers.IntegerField(source='product_id')
+    quantity = serializers.IntegerField(min_value=1)
 
 class OrderCreateSerializer(serializers.ModelSerializer):
-    items = OrderItemSerializer(many=True)
+    """Checkout en aller-retour minimal : prix lus en une requête IN, commande
+    insérée une fois avec ses totaux calculés en mémoire, lignes en bulk_create."""
+    items = OrderLineSerializer(many=True, write_only=True, allow_empty=False)
+    CENT = Decimal('0.01')
 
     class Meta:
         model = Order
-        fields = ['customer', 'billing_address', 'shipping_address', 'payment_method', 'notes', 'items']
-
+        fields = [
+            'id', 'order_number', 'status', 'customer', 'billing_address', 'shipping_address',
+            'payment_method', 'notes', 'items', 'total_amount', 'vat_amount'
+        ]
+        read_only_fields = ['order_number', 'status', 'total_amount', 'vat_amount']
+
+    def build_items(self, lines):
+        """Lignes non sauvegardées (un produit répété est cumulé) ; ValidationError si un produit manque"""
+        quantities = {}
+        for line in lines:
+            quantities[line['product_id']] = quantities.get(line['product_id'], 0) + line['quantity']
+        prices = {
+            pk: (price, vat_rate)
+            for pk, price, vat_rate in Product.objects.filter(pk__in=quantities, is_active=True).values_list(
+                'pk', 'price', 'vat_rate'
+            )
+        }
+        missing = sorted(set(quantities) - set(prices))
+        if missing:
+            raise serializers.ValidationError({'items': [f'Produits introuvables: {missing}']})
+        return [
+            OrderItem(product_id=pk, quantity=quantity, unit_price=prices[pk][0], vat_rate=prices[pk][1])
+            for pk, quantity in quantities.items()
+        ]
+
+    @transaction.atomic
     def create(self, validated_data):
-        items_data = validated_data.pop('items')
-        order = Order.objects.create(**validated_data)
-        
-        total_amount = 0
-        vat_amount = 0
-        
-        for item_data in items_data:
-            item = OrderItem.objects.create(order=order, **item_data)
-            total_amount += item.subtotal
-            vat_amount += item.vat_amount
-        
-        order.total_amount = total_amount
-        order.vat_amount = vat_amount
-        order.save()
+        items = self.build_items(validated_data.pop('items'))
+        order = Order.objects.create(
+            total_amount=sum(item.subtotal for item in items).quantize(self.CENT),
+            vat_amount=sum(item.vat_amount for item in items).quantize(self.CENT),
+            **validated_data
+        )
+        for item in items:
+            item.order = order
+        OrderItem.objects.bulk_create(items)
+
+        # Réservation du stock pour la durée du paiement (annule la commande si indisponible)
+        try:
+            StockReservationService.hold(order, [(item.product_id, item.quantity) for item in items])
+        except InsufficientStock as e:
+            raise serializers.ValidationError({'items': [f'Stock insuffisant (produits {e.product_ids})']})
         
         return order
 
@@ -1,8 +1,19 @@
-from django.db.models.signals import post_save, pre_save
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Customer, Order
-import uuid
+from django.db import transaction
+from cache_system import CacheManager
+from low_level_optimizations import async_processor
+from .models import Category, Customer, Order, Product, ProductImage
+from .search import product_search_index
+from .facets import ProductFacets
+from .sequences import ORDER_NUMBERS
+from .snapshots import ProductSnapshotBuilder
+from .images import ProductImagePipeline
+from .stock import StockLedger, low_stock
+import logging
+
+logger = logging.getLogger(__name__)
 
 @receiver(post_save, sender=User)
 def create_customer_profile(sender, instance, created, **kwargs):
@@ -14,4 +25,80 @@ def create_customer_profile(sender, instance, created, **kwargs):
 def generate_order_number(sender, instance, **kwargs):
     """Générer automatiquement un numéro de commande unique"""
     if not instance.order_number:
-        instance.order_number = f"CMD{uuid.uuid4().hex[:8].upper()}"
\ No newline at end of file
+        instance.order_number = ORDER_NUMBERS.next()
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    """Maintenir l'index plein texte du catalogue à jour"""
+    product_search_index.update(instance)
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    """Retirer un produit supprimé de l'index plein texte"""
+    product_search_index.remove(instance.pk)
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_tree(sender, **kwargs):
+    """Invalider l'arborescence en cache après toute modification"""
+    CacheManager.delete_cache(Category.TREE_CACHE_KEY)
+    CacheManager.bump_version(Category.VERSION_NAMESPACE)
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_facets(sender, **kwargs):
+    """Invalider les facettes en cache dès qu'un produit change"""
+    CacheManager.bump_version(ProductFacets.CACHE_NAMESPACE)
+
+@receiver(post_save, sender=Product)
+def refresh_product_snapshot(sender, instance, **kwargs):
+    """Recalculer la ligne du modèle de lecture du catalogue"""
+    ProductSnapshotBuilder.refresh([instance.pk])
+
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def refresh_product_snapshot_image(sender, instance, origin=None, **kwargs):
+    """Image principale modifiée (ignoré si le produit lui-même est supprimé)"""
+    if isinstance(origin, Product):
+        return
+    ProductSnapshotBuilder.refresh([instance.product_id])
+
+@receiver(post_save, sender=Category)
+def refresh_category_snapshots(sender, instance, created, **kwargs):
+    """Propager nom et chemin de catégorie aux produits du sous-arbre"""
+    if not created:
+        ProductSnapshotBuilder.refresh_category(instance)
+
+@receiver(post_save, sender=ProductImage)
+def generate_image_variants(sender, instance, **kwargs):
+    """Déclinaisons redimensionnées générées en arrière-plan après l'upload"""
+    if instance.image and not ProductImagePipeline.is_current(instance):
+        transaction.on_commit(lambda: async_processor.submit_task(ProductImagePipeline.process_pk, instance.pk))
+
+@receiver(post_delete, sender=ProductImage)
+def delete_image_variants(sender, instance, **kwargs):
+    """Supprimer les fichiers de déclinaisons d'une image supprimée"""
+    ProductImagePipeline.discard(instance.variants)
+
+@receiver(pre_save, sender=Product)
+def measure_stock_adjustment(sender, instance, update_fields=None, **kwargs):
+    """Mémoriser l'écart de stock d'une modification manuelle (admin, API)"""
+    if update_fields is not None and 'stock_quantity' not in update_fields:
+        instance._stock_delta = 0
+        return
+    previous = Product.objects.filter(pk=instance.pk).values_list('stock_quantity', flat=True).first() if instance.pk else 0
+    instance._stock_delta = instance.stock_quantity - (previous or 0)
+
+@receiver(post_save, sender=Product)
+def record_stock_adjustment(sender, instance, **kwargs):
+    """Journaliser l'ajustement dans StockMovement"""
+    delta = getattr(instance, '_stock_delta', 0)
+    if delta:
+        StockLedger.record('adjustment', {instance.pk: delta})
+    instance._stock_delta = 0
+
+@receiver(low_stock)
+def alert_low_stock(sender, product_ids, **kwargs):
+    """Alerte de réassort lorsqu'un produit passe sous son stock minimum"""
+    for sku, stock, minimum in Product.objects.filter(pk__in=product_ids).values_list('sku', 'stock_quantity', 'min_stock_level'):
+        logger.warning(f"Low stock: {sku} ({stock} < {minimum})")
\ No newline at end of file
@@ -0,0 +1,264 @@
+"""
+Réservations de stock à durée limitée, sans verrou applicatif ni save() par ligne
+"""
+import logging
+from collections import Counter
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Sum, Value, When, Window
+from django.dispatch import Signal
+from django.utils import timezone
+from .models import Product, StockMovement, StockReservation
+from cache_system import CacheManager
+from .facets import ProductFacets
+from .snapshots import ProductSnapshotBuilder
+
+logger = logging.getLogger(__name__)
+
+# Émis avec product_ids lorsque des produits passent sous min_stock_level
+low_stock = Signal()
+
+class StockLedger:
+    """Écriture groupée et soldes du journal StockMovement"""
+
+    BATCH_SIZE = 1000
+
+    @classmethod
+    def record(cls, reason: str, deltas: dict, reference: str = ''):
+        """Un mouvement signé par produit, en un seul INSERT groupé"""
+        StockMovement.objects.bulk_create([
+            StockMovement(product_id=product_id, quantity=delta, reason=reason, reference=reference)
+            for product_id, delta in deltas.items()
+            if delta
+        ], batch_size=cls.BATCH_SIZE)
+
+    @classmethod
+    def rebuild_balances(cls, product_ids=None) -> int:
+        """Recalculer le solde courant de chaque mouvement.
+
+        Le journal peut commencer après la création du produit : le solde
+        d'ouverture est déduit du stock actuel (stock - somme des mouvements),
+        puis cumulé par une fonction fenêtre, sans boucle par produit.
+        """
+        movements = StockMovement.objects.all()
+        if product_ids is not None:
+            movements = movements.filter(product_id__in=list(product_ids))
+        rows = (
+            movements
+            .annotate(
+                running=Window(Sum('quantity'), partition_by=[F('product_id')], order_by=[F('created_at').asc(), F('id').asc()]),
+                total=Window(Sum('quantity'), partition_by=[F('product_id')]),
+            )
+            .values_list('id', 'running', 'total', 'product__stock_quantity')
+            .iterator(chunk_size=cls.BATCH_SIZE)
+        )
+
+        updated = 0
+        batch = []
+        for pk, running, total, stock in rows:
+            batch.append(StockMovement(pk=pk, balance=stock - total + running))
+            if len(batch) >= cls.BATCH_SIZE:
+                updated += StockMovement.objects.bulk_update(batch, ['balance'])
+                batch = []
+        if batch:
+            updated += StockMovement.objects.bulk_update(batch, ['balance'])
+        return updated
+
+class InsufficientStock(Exception):
+    """Au moins un produit n'a pas assez de stock disponible"""
+
+    def __init__(self, product_ids):
+        self.product_ids = sorted(product_ids)
+        super().__init__(f"Stock insuffisant pour les produits {self.product_ids}")
+
+class StockReservationService:
+    """Réserve, convertit et libère le stock des commandes.
+
+    La réservation décrémente ``stock_quantity`` immédiatement, pour tout le
+    panier, par un unique ``UPDATE ... WHERE stock_quantity >= quantité``
+    (CASE par produit) : la base arbitre les checkouts concurrents et il ne
+    peut pas y avoir de survente. Si une ligne n'est pas servie, la
+    transaction est annulée. Le paiement convertit la réservation ; sinon le
+    balayeur la libère à expiration et rend le stock, par lots.
+    """
+
+    HOLD_TTL = timedelta(minutes=15)
+    SWEEP_BATCH_SIZE = 500
+
+    @staticmethod
+    def _by_product(quantities: dict):
+        """CASE pk WHEN ... THEN quantité : une expression pour tout le lot"""
+        return Case(
+            *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+            default=Value(0),
+            output_field=IntegerField()
+        )
+
+    @classmethod
+    def take(cls, quantities: dict):
+        """Décrémenter le stock de plusieurs produits en un UPDATE conditionnel, tout ou rien"""
+        quantities = {pk: qty for pk, qty in quantities.items() if qty > 0}
+        if not quantities:
+            return
+        amount = cls._by_product(quantities)
+        try:
+            with transaction.atomic():
+                updated = Product.objects.filter(pk__in=quantities, stock_quantity__gte=amount).update(
+                    stock_quantity=F('stock_quantity') - amount
+                )
+                if updated != len(quantities):
+                    raise InsufficientStock(quantities)
+        except InsufficientStock:
+            # Après annulation du point de sauvegarde : identifier les produits en cause
+            available = Product.objects.filter(pk__in=quantities, stock_quantity__gte=amount)
+            missing = set(quantities) - set(available.values_list('pk', flat=True))
+            raise InsufficientStock(missing or quantities)
+
+        # Seuil franchi par cette sortie : stock < minimum mais stock + quantité >= minimum
+        crossed = Product.objects.filter(
+            Product.LOW_STOCK, pk__in=quantities, stock_quantity__gte=F('min_stock_level') - amount
+        ).values_list('pk', flat=True)
+        crossed = list(crossed)
+        if crossed:
+            low_stock.send(sender=Product, product_ids=crossed)
+
+    @classmethod
+    def give_back(cls, quantities: dict):
+        """Rendre du stock à plusieurs produits en un UPDATE"""
+        quantities = {pk: qty for pk, qty in quantities.items() if qty > 0}
+        if quantities:
+            Product.objects.filter(pk__in=quantities).update(
+                stock_quantity=F('stock_quantity') + cls._by_product(quantities)
+            )
+
+    @staticmethod
+    def stock_changed(product_ids):
+        """Stock modifié par UPDATE (sans signal) : modèle de lecture et facettes à jour"""
+        ProductSnapshotBuilder.refresh(product_ids)
+        CacheManager.bump_version(ProductFacets.CACHE_NAMESPACE)
+
+    @classmethod
+    def hold(cls, order, lines=None, ttl: timedelta = None):
+        """Réserver les lignes d'une commande ; InsufficientStock si une ligne n'est pas servie"""
+        if lines is None:
+            lines = order.items.values_list('product_id', 'quantity')
+        quantities = Counter()
+        for product_id, quantity in lines:
+            quantities[product_id] += quantity
+
+        expires_at = timezone.now() + (ttl or cls.HOLD_TTL)
+        with transaction.atomic():
+            cls.take(quantities)
+            StockReservation.objects.bulk_create([
+                StockReservation(order=order, product_id=product_id, quantity=quantity, expires_at=expires_at)
+                for product_id, quantity in quantities.items()
+            ])
+            StockLedger.record('reservation', {pk: -qty for pk, qty in quantities.items()}, order.order_number)
+        cls.stock_changed(quantities)
+        return expires_at
+
+    @classmethod
+    def convert(cls, order):
+        """Confirmer la sortie de stock au paiement.
+
+        Les réservations encore actives sont simplement marquées converties.
+        Si elles ont été libérées entre-temps (expiration), le stock est repris
+        par le même UPDATE conditionnel ; InsufficientStock s'il a été vendu
+        ailleurs. Une commande sans réservation est servie à partir de ses lignes.
+        """
+        reservations = StockReservation.objects.filter(order=order)
+        with transaction.atomic():
+            converted = reservations.filter(status='held').update(status='converted')
+            if converted or reservations.filter(status='converted').exists():
+                return
+
+            released = reservations.filter(status='released')
+            lines = list(released.values_list('product_id', 'quantity'))
+            quantities = Counter()
+            for product_id, quantity in lines or order.items.values_list('product_id', 'quantity'):
+                quantities[product_id] += quantity
+            cls.take(quantities)
+            StockLedger.record('reservation', {pk: -qty for pk, qty in quantities.items()}, order.order_number)
+
+            if lines:
+                released.update(status='converted')
+            else:
+                now = timezone.now()
+                StockReservation.objects.bulk_create([
+                    StockReservation(order=order, product_id=product_id, quantity=quantity,
+                                     status='converted', expires_at=now)
+                    for product_id, quantity in quantities.items()
+                ])
+        cls.stock_changed(quantities)
+
+    @classmethod
+    def convert_many(cls, orders) -> list:
+        """convert() pour un lot de commandes : les réservations actives en un UPDATE.
+
+        Chaque reprise de stock est isolée dans son point de sauvegarde :
+        retourne les commandes non servies (InsufficientStock) sans annuler
+        les autres.
+        """
+        missing = []
+        with transaction.atomic():
+            held = set(
+                StockReservation.objects.filter(order__in=orders, status='held')
+                .select_for_update(of=('self',)).values_list('order_id', flat=True)
+            )
+            if held:
+                StockReservation.objects.filter(order_id__in=held, status='held').update(status='converted')
+            # Réservation expirée ou absente : reprise conditionnelle, commande par commande
+            for order in orders:
+                if order.pk in held:
+                    continue
+                try:
+                    cls.convert(order)
+                except InsufficientStock as e:
+                    logger.warning(f"Insufficient stock to convert order {order.pk}: {e.product_ids}")
+                    missing.append(order)
+        return missing
+
+    @classmethod
+    def release(cls, reservations) -> int:
+        """Libérer un ensemble de réservations actives et rendre leur stock"""
+        with transaction.atomic():
+            rows = list(
+                reservations.filter(status='held')
+                .select_for_update(skip_locked=True, of=('self',))
+                .values_list('pk', 'product_id', 'quantity', 'order__order_number')
+            )
+            if not rows:
+                return 0
+            quantities = Counter()
+            movements = []
+            for _, product_id, quantity, order_number in rows:
+                quantities[product_id] += quantity
+                movements.append(StockMovement(
+                    product_id=product_id, quantity=quantity, reason='release', reference=order_number
+                ))
+            # Lignes verrouillées (skip_locked) : aucun autre balayeur ne les rendra
+            released = StockReservation.objects.filter(pk__in=[row[0] for row in rows]).update(status='released')
+            cls.give_back(quantities)
+            StockMovement.objects.bulk_create(movements, batch_size=StockLedger.BATCH_SIZE)
+        cls.stock_changed(quantities)
+        return released
+
+    @classmethod
+    def release_expired(cls, now=None, batch_size: int = None) -> int:
+        """Balayeur : libérer par lots toutes les réservations expirées"""
+        now = now or timezone.now()
+        batch_size = batch_size or cls.SWEEP_BATCH_SIZE
+        total = 0
+        while True:
+            batch = StockReservation.objects.filter(status='held', expires_at__lte=now).order_by('expires_at')
+            ids = list(batch.values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                break
+            released = cls.release(StockReservation.objects.filter(pk__in=ids))
+            total += released
+            if released < len(ids):
+                # Le reste est verrouillé par un autre balayeur, qui s'en charge
+                break
+        if total:
+            logger.info(f"Stock reservations released: {total}")
+        return total
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CategoryViewSet, ProductViewSet, CustomerViewSet, CartViewSet, OrderViewSet, WishlistViewSet
+from .views import CategoryViewSet, ProductViewSet, CustomerViewSet, CartViewSet, OrderViewSet, WishlistViewSet, payment_webhook
 from .vat_views import validate_vat_api
 
 router = DefaultRouter()
@@ -14,4 +14,5 @@ router.register(r'wishlist', WishlistViewSet, basename='wishlist')
 urlpatterns = [
     path('', include(router.urls)),
     path('validate-vat/', validate_vat_api, name='validate_vat'),
+    path('payments/webhook/', payment_webhook, name='payment_webhook'),
 ]
\ No newline at end of file
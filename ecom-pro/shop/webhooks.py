@@ -0,0 +1,123 @@
+"""
+Webhooks de paiement : réception en un INSERT, traitement différé par lots
+"""
+import logging
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import PaymentEvent
+from .payments import PaymentService
+
+logger = logging.getLogger(__name__)
+
+class PaymentEventInbox:
+    """Événements de la passerelle, écrits à la réception et traités par un worker.
+
+    La réception ne fait qu'un INSERT (``ignore_conflicts`` : une livraison
+    répétée bute sur l'index unique de event_id et est ignorée) et répond
+    aussitôt : sa latence ne dépend ni du volume ni du traitement. Le
+    worker prend les événements en attente par lots (``skip_locked`` :
+    plusieurs workers se partagent la file), les applique en quelques
+    requêtes groupées et les marque traités dans la même transaction.
+
+    Un événement en échec est repris après un délai exponentiel
+    (``RETRY_DELAY`` doublé à chaque tentative, plafonné) ; après
+    ``MAX_ATTEMPTS`` échecs il est abandonné (``failed_at``), sort de la
+    file et l'erreur est journalisée pour être reprise à la main.
+    """
+
+    BATCH_SIZE = 500
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = 30
+    RETRY_DELAY_MAX = 3600
+
+    @staticmethod
+    def receive(event: dict):
+        """Enregistrer un événement ; un doublon est ignoré sans erreur"""
+        PaymentEvent.objects.bulk_create([
+            PaymentEvent(event_id=event['id'], type=event.get('type', ''), payload=event)
+        ], ignore_conflicts=True)
+
+    @classmethod
+    def process_pending(cls, batch_size: int = None) -> dict:
+        """Traiter toute la file par lots ; retourne les compteurs"""
+        batch_size = batch_size or cls.BATCH_SIZE
+        stats = {'events': 0, 'orders': 0, 'failed': 0, 'batches': 0}
+        while True:
+            processed = cls.process_batch(batch_size, stats)
+            if not processed:
+                break
+            stats['batches'] += 1
+            if processed < batch_size:
+                break
+        if stats['events']:
+            logger.info(f"Payment events processed: {stats}")
+        return stats
+
+    @classmethod
+    def pending(cls, now=None):
+        """Événements à traiter maintenant : ni traités, ni abandonnés, délai de reprise écoulé"""
+        return PaymentEvent.objects.filter(processed_at__isnull=True, failed_at__isnull=True).filter(
+            Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now or timezone.now())
+        )
+
+    @classmethod
+    def retry_delay(cls, attempts: int) -> timedelta:
+        return timedelta(seconds=min(cls.RETRY_DELAY_MAX, cls.RETRY_DELAY * 2 ** (attempts - 1)))
+
+    @classmethod
+    def process_batch(cls, batch_size: int, stats: dict) -> int:
+        with transaction.atomic():
+            events = list(cls.pending().select_for_update(skip_locked=True).order_by('id')[:batch_size])
+            if not events:
+                return 0
+            try:
+                with transaction.atomic():
+                    stats['orders'] += PaymentService.apply_events([event.payload for event in events])
+                failed = []
+            except Exception as e:
+                # Un événement fautif ne bloque pas le lot : reprise une par une
+                logger.warning(f"Payment event batch failed, retrying one by one: {e}")
+                failed = cls.process_each(events, stats)
+
+            now = timezone.now()
+            for event in events:
+                event.attempts += 1
+                if event not in failed:
+                    event.processed_at = now
+                    event.next_attempt_at = None
+                elif event.attempts < cls.MAX_ATTEMPTS:
+                    event.next_attempt_at = now + cls.retry_delay(event.attempts)
+                else:
+                    event.failed_at = now
+                    logger.error(
+                        f"Payment event {event.event_id} abandoned after {event.attempts} attempts: {event.error}"
+                    )
+            PaymentEvent.objects.bulk_update(
+                events, ['processed_at', 'failed_at', 'next_attempt_at', 'attempts', 'error']
+            )
+        stats['events'] += len(events) - len(failed)
+        stats['failed'] += len(failed)
+        return len(events)
+
+    @staticmethod
+    def requeue_failed() -> int:
+        """Remettre en file les événements abandonnés (après correction de la cause)"""
+        return PaymentEvent.objects.filter(failed_at__isnull=False, processed_at__isnull=True).update(
+            failed_at=None, next_attempt_at=None, attempts=0
+        )
+
+    @staticmethod
+    def process_each(events, stats: dict) -> list:
+        failed = []
+        for event in events:
+            try:
+                with transaction.atomic():
+                    stats['orders'] += PaymentService.apply_events([event.payload])
+                event.error = ''
+            except Exception as e:
+                logger.error(f"Payment event {event.event_id} failed: {e}")
+                event.error = str(e)
+                failed.append(event)
+        return failed